@@ -36,11 +36,13 @@ def run(args):
         return tuple(binoculars.space.Space.fromfile(fn) for fn in filenames)
 
 
-def load(filename, key=None):
+def load(filename, key=None, lazy=False):
     ''' Parameters
         filename: string
             Only hdf5 files are acceptable
         key: a tuple with slices in as much dimensions as the space is
+        lazy: if True, return a LazySpace that reads the data only when it is needed,
+            after slicing and projecting, e.g. binoculars.load('test.hdf5', lazy=True).project('qx', 'qy')
 
         Returns
         A binoculars space
@@ -56,7 +58,7 @@ def load(filename, key=None):
     '''
     import binoculars.space
     if os.path.exists(filename):
-        return binoculars.space.Space.fromfile(filename, key=key)
+        return binoculars.space.Space.fromfile(filename, key=key, lazy=lazy)
     else:
         raise IOError("File '{0}' does not exist".format(filename))
 
@@ -1,7 +1,14 @@
-from . import util, errors, dispatcher
+import os
+import glob
+import json
+import hashlib
+
+from . import util, errors, dispatcher, space
 
 
 class ProjectionBase(util.ConfigurableObject):
+    edge_bounds = True  # the projected coordinates of a job are bounded by those of the edges of the detector, see InputBase.get_edge_params()
+
     def parse_config(self, config):
         super(ProjectionBase, self).parse_config(config)
         res = config.pop('resolution')  # or just give 1 number for all dimensions
@@ -17,6 +24,9 @@ class ProjectionBase(util.ConfigurableObject):
                 raise errors.ConfigError('dimension mismatch between projection axes ({0}) and resolution specification ({1}) in {2}'.format(labels, self.config.resolution, self.__class__.__name__))
         else:
             self.config.resolution = tuple([float(res)] * len(labels))
+        self.config.sparse = util.parse_bool(config.pop('sparse', 'false'))  # Optional, store only the occupied grid points, for high resolution spaces that are mostly empty
+        self.config.photons_dtype = util.parse_dtype(config.pop('photons_dtype', 'float64'))  # Optional, storage type of the photons of the output, e.g. float32 to halve the memory usage
+        self.config.contributions_dtype = util.parse_dtype(config.pop('contributions_dtype', 'float64'))  # Optional, storage type of the contributions of the output, e.g. uint32 or float32. Adding fractional weights or overflowing the type is an error
 
     def project(self, *args):
         raise NotImplementedError
@@ -27,11 +37,161 @@ class ProjectionBase(util.ConfigurableObject):
 
 class Job(object):
     weight = 1.  # estimate of job difficulty (arbitrary units)
+    pixels = 1  # number of pixels per point of the job, if known, see CostModel
 
     def __init__(self, **kwargs):
         self.__dict__.update(kwargs)
 
 
+class CostModel(object):
+    """Estimates the duration of Job()s in seconds, as Job.weight x Job.pixels x the number
+    of limit sets x the cost of one such unit for a combination of input and projection.
+
+    The unit cost is a moving average over the timings of earlier jobs, stored in a JSON
+    file under 'key' and a hash of 'context', the configuration of the input and projection,
+    such that it carries over between runs with the same settings. The timings are recorded
+    by the dispatcher in the main process, and save() writes them once per run. The number
+    of pixels per point of the last job is stored with it, for sizing jobs before they exist."""
+    smoothing = 0.2  # weight of the latest timing in the moving average
+
+    def __init__(self, filename, key, nlimits=1, context=''):
+        self.filename = os.path.expanduser(filename)
+        self.key = '{0}:{1}'.format(key, hashlib.sha1(context.encode('utf8')).hexdigest()[:12])
+        self.nlimits = nlimits
+        self.changed = False
+        entry = self.load().get(self.key, {})
+        self.unitcost = entry.get('unitcost')
+        self.pixels = entry.get('pixels', 1)
+
+    def load(self):
+        try:
+            with open(self.filename) as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def units(self, job):
+        return job.weight * job.pixels * self.nlimits
+
+    def estimate(self, job):
+        """Returns the expected duration of 'job' in seconds, or None if nothing is known yet."""
+        if self.unitcost is None:
+            return None
+        return self.units(job) * self.unitcost
+
+    def target_weight(self, duration, pixels=None):
+        """Returns the job weight that is expected to take 'duration' seconds with 'pixels' pixels
+        per point, by default as many as the last recorded job, or None if nothing is known yet."""
+        if not self.unitcost:
+            return None
+        if pixels is None:
+            pixels = self.pixels
+        return max(1, int(duration / (self.unitcost * pixels * self.nlimits)))
+
+    def record(self, job, seconds):
+        """Learn from the time 'job' took, kept in memory until save()."""
+        units = self.units(job)
+        if units <= 0:
+            return
+        if self.unitcost is None:
+            self.unitcost = seconds / units
+        else:
+            self.unitcost += self.smoothing * (seconds / units - self.unitcost)
+        self.pixels = job.pixels
+        self.changed = True
+
+    def save(self):
+        """Stores the learned cost in the file, next to the entries of other inputs and projections as they are in the file now."""
+        if not self.changed:
+            return
+        costs = self.load()
+        costs[self.key] = {'unitcost': self.unitcost, 'pixels': self.pixels}
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with util.atomic_write(self.filename) as tmpname:
+            with open(tmpname, 'w') as fp:
+                json.dump(costs, fp, indent=2, sort_keys=True)
+        self.changed = False
+
+
+class JobCache(object):
+    """On-disk cache of the Multiverse results of Job()s in 'directory'. An entry is keyed by
+    a hash of 'context' (the parsed input and projection configuration), the fields of the job
+    and the size and modification time of the files the job reads, or the digest of the part it
+    reads of a shared file, see InputBase.get_job_files().
+    Beyond 'maxsize' bytes the least recently used entries are removed. The size of the cache is
+    counted once and then kept up to date with the entries that are added, so entries added by
+    other processes are only seen when the directory is counted again at the next eviction."""
+
+    def __init__(self, directory, maxsize, context):
+        self.directory = os.path.expanduser(directory)
+        self.maxsize = maxsize
+        self.context = context
+        self.size = None  # bytes in the directory, counted by the first evict()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def get_filename(self, job, files):
+        key = hashlib.sha1(self.context.encode('utf8'))
+        key.update(repr(sorted(job.__dict__.items())).encode('utf8'))
+        for filename in files or ():
+            if isinstance(filename, tuple):  # (filename, digest) of the part of a shared file the job reads
+                key.update(repr(filename).encode('utf8'))
+                continue
+            try:
+                stat = os.stat(filename)
+                key.update(repr((filename, stat.st_size, stat.st_mtime)).encode('utf8'))
+            except OSError:
+                key.update(repr((filename, None)).encode('utf8'))
+        return os.path.join(self.directory, '{0}.hdf5'.format(key.hexdigest()))
+
+    def get(self, job, files):
+        """Returns the cached Multiverse of 'job', or None."""
+        filename = self.get_filename(job, files)
+        if not os.path.exists(filename):
+            return None
+        try:
+            verse = space.Multiverse.fromfile(filename)
+        except (errors.HDF5FileError, IOError, KeyError):
+            return None  # e.g. removed by another process
+        try:
+            os.utime(filename, None)  # mark as recently used
+        except OSError:
+            pass
+        return verse
+
+    def put(self, job, files, verse):
+        filename = self.get_filename(job, files)
+        verse.tofile(filename)
+        if self.size is not None:
+            try:
+                self.size += os.path.getsize(filename)
+            except OSError:
+                pass
+        if self.size is None or self.size > self.maxsize:
+            self.evict()
+
+    def evict(self):
+        """Counts the entries in the directory and removes the least recently used ones beyond maxsize."""
+        entries = []
+        for filename in glob.glob(os.path.join(self.directory, '*.hdf5')):
+            try:
+                entries.append((os.path.getmtime(filename), os.path.getsize(filename), filename))
+            except OSError:
+                continue
+        total = sum(size for (mtime, size, filename) in entries)
+        for mtime, size, filename in sorted(entries):
+            if total <= self.maxsize:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+        self.size = total
+
+
 class InputBase(util.ConfigurableObject):
     """Generate and process Job()s.
 
@@ -42,17 +202,91 @@ class InputBase(util.ConfigurableObject):
     def parse_config(self, config):
         super(InputBase, self).parse_config(config)
         self.config.target_weight = int(config.pop('target_weight', 1000))  # # approximate number of images per job, only useful when running on the oar cluster
+        self.config.prefetch = int(config.pop('prefetch', 0))  # Optional, number of images read and processed ahead in a background thread while the current one is projected, 0 (default) to read them in turn
+        self.config.prefetch_size = int(config.pop('prefetch_size', 256))  # Optional, size in MB of the images read ahead at most, 256 by default
 
     def generate_jobs(self, command):
         """Receives command from user, yields Job() instances"""
         raise NotImplementedError
 
+    def get_job_files(self, job):
+        """Returns the data files read by a Job(), such that cached results are recomputed when
+        these change (see JobCache), or None if unknown, then only the job and the configuration count.
+        Files of which a job reads only a part, e.g. a scan in a spec file that grows with every
+        scan, are given as a (filename, digest) pair with a hash of that part instead."""
+        return None
+
+    def split_job(self, job, parts):
+        """Split a Job() into at most 'parts' smaller Job()s, for load balancing. By default
+        jobs with firstpoint and lastpoint are split into consecutive ranges of points,
+        other jobs cannot be split and are returned as they are."""
+        if parts <= 1 or not hasattr(job, 'firstpoint') or not hasattr(job, 'lastpoint'):
+            return [job]
+        count = job.lastpoint - job.firstpoint + 1
+        jobs = []
+        for s in util.chunk_slicer(count, -(-count // parts)):
+            kwargs = dict(job.__dict__)
+            kwargs.update(firstpoint=job.firstpoint + s.start, lastpoint=job.firstpoint + s.stop - 1, weight=job.weight * (s.stop - s.start) / float(count))
+            jobs.append(job.__class__(**kwargs))
+        return jobs
+
+    def missing_jobs(self, jobs, done):
+        """Yields the part of 'jobs' that is not covered by 'done', the job descriptions stored
+        in the metadata of an existing output, see Destination.stored_jobs(). Jobs with firstpoint
+        and lastpoint are reduced to the ranges of points not processed before, other jobs are
+        skipped when a job with the same fields is done."""
+        finished = set()
+        points = {}
+        for fields in done:
+            fields = util.job_fields(fields)
+            if 'firstpoint' in fields and 'lastpoint' in fields:
+                first, last = int(fields.pop('firstpoint')), int(fields.pop('lastpoint'))
+                points.setdefault(util.job_key(fields), set()).update(range(first, last + 1))
+            else:
+                finished.add(util.job_key(fields))
+
+        for job in jobs:
+            fields = util.job_fields(job.__dict__)
+            if not hasattr(job, 'firstpoint') or not hasattr(job, 'lastpoint'):
+                if util.job_key(fields) not in finished:
+                    yield job
+                continue
+            del fields['firstpoint'], fields['lastpoint']
+            covered = points.get(util.job_key(fields), ())
+            missing = [point for point in range(job.firstpoint, job.lastpoint + 1) if point not in covered]
+            if len(missing) == job.lastpoint - job.firstpoint + 1:
+                yield job
+                continue
+            count = float(job.lastpoint - job.firstpoint + 1)
+            while missing:  # consecutive ranges of missing points
+                length = 1
+                while length < len(missing) and missing[length] == missing[0] + length:
+                    length += 1
+                kwargs = dict(job.__dict__)
+                kwargs.update(firstpoint=missing[0], lastpoint=missing[length - 1], weight=job.weight * length / count)
+                yield job.__class__(**kwargs)
+                missing = missing[length:]
+
+    def prefetch_job(self, job):
+        """Same as process_job(), but with prefetch set the images are read ahead in a
+        background thread, which overlaps reading and decoding with the projection."""
+        if self.config.prefetch > 0:
+            return util.Prefetcher(self.process_job(job), self.config.prefetch, self.config.prefetch_size * 2**20)
+        return self.process_job(job)
+
     def process_job(self, job):
         """Receives a Job() instance, yields (intensity, args_to_be_sent_to_a_Projection_instance)
 
         Job()s could have been pickle'd and distributed over a cluster"""
         self.metadata = util.MetaBase('job', job.__dict__)
 
+    def get_edge_params(self, job):
+        """Receives a Job() instance, yields per point a sequence of
+        args_to_be_sent_to_a_Projection_instance that together cover the edges
+        of the detector. Used to estimate the extent of the output of a job
+        before processing it. Returns None if the input does not support this."""
+        return None
+
     def get_destination_options(self, command):
         """Receives the same command as generate_jobs(), but returns
         dictionary that will be used to .format() the dispatcher:destination
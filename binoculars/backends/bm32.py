@@ -1,6 +1,5 @@
 import sys
 import os
-import glob
 import numpy
 import time
 
@@ -12,12 +11,13 @@ else:
     from itertools import izip as zip
 
 try:
-    from PyMca import specfilewrapper, EdfFile, SixCircle, specfile
+    from PyMca import specfilewrapper, SixCircle, specfile
 except ImportError:
-    from PyMca5.PyMca import specfilewrapper, EdfFile, SixCircle, specfile
+    from PyMca5.PyMca import specfilewrapper, SixCircle, specfile
 
 
-from .. import backend, errors, util
+from .. import backend, edf, errors, util
+from .id03 import get_specindex, get_folderindex
 
 
 class pixels(backend.ProjectionBase):
@@ -165,6 +165,7 @@ class BM32Input(backend.InputBase):
 
     dbg_scanno = None
     dbg_pointno = None
+    pixelcount = None
 
     def generate_jobs(self, command):
         scans = util.parse_multi_range(','.join(command).replace(' ', ','))
@@ -183,11 +184,20 @@ class BM32Input(backend.InputBase):
                 except specfile.error: # no points
                     continue
             next(self.get_images(scan, 0, pointcount-1, dry_run=True))# dryrun
+            pixels = self.get_pixelcount(scan, start)
             if pointcount > self.config.target_weight * 1.4:
                 for s in util.chunk_slicer(pointcount, self.config.target_weight):
-                    yield backend.Job(scan=scanno, firstpoint=start+s.start, lastpoint=start+s.stop-1, weight=s.stop-s.start)
+                    yield backend.Job(scan=scanno, firstpoint=start+s.start, lastpoint=start+s.stop-1, weight=s.stop-s.start, pixels=pixels)
             else:
-                yield backend.Job(scan=scanno, firstpoint=start, lastpoint=start+pointcount-1, weight=pointcount)
+                yield backend.Job(scan=scanno, firstpoint=start, lastpoint=start+pointcount-1, weight=pointcount, pixels=pixels)
+
+    def get_pixelcount(self, scan, point):
+        """Returns the number of pixels per point within xmask and ymask, from the shape of the image
+        of 'point' in 'scan'. All scans share the detector, so the image is only read once."""
+        if self.pixelcount is None:
+            shape = next(self.get_images(scan, point, point)).GetData(0).shape
+            self.pixelcount = self.apply_mask(numpy.empty(shape, dtype=bool), self.config.xmask, self.config.ymask).size
+        return self.pixelcount
 
     def process_job(self, job):
         super(BM32Input, self).process_job(job)
@@ -232,23 +242,16 @@ class BM32Input(backend.InputBase):
         return dict(first=min(scans), last=max(scans), range=','.join(str(scan) for scan in scans))
 
     # CONVENIENCE FUNCTIONS
-    _spec = None
     def get_scan(self, scannumber):
-        if self._spec is None:
-            self._spec = specfilewrapper.Specfile(self.config.specfile) 
-        return self._spec.select('{0}.1'.format(scannumber))
+        return get_specindex(self.config.specfile).get_scan(scannumber)
 
     def find_edfs(self, pattern):
-        files = glob.glob(pattern)
-        ret = {}
-        for file in files:
-            try:
-                filename = os.path.basename(file).split('.')[0]
-                imno = int(filename.split('_')[-1].split('-')[-1])
-                ret[imno] = file
-            except ValueError:
-                continue
-        return ret
+        return get_folderindex(os.path.dirname(pattern), self.parse_edf_name).get(None)
+
+    @staticmethod
+    def parse_edf_name(name):
+        # the image number is in the name, regardless of the scan
+        return None, int(name.split('.')[0].split('_')[-1].split('-')[-1])
 
     @staticmethod 
     def apply_mask(data, xmask, ymask):
@@ -274,10 +277,10 @@ class BM32Input(backend.InputBase):
             if dry_run:
                 yield
             else:
-                edf = EdfFile.EdfFile(self.config.background)
+                background = edf.EdfFile(self.config.background)
                 for i in range(first, last+1):
                     self.dbg_pointno = i
-                    yield edf
+                    yield background
         else:
             try:
                 uccdtagline = scan.header('M')[0].split()[-1]
@@ -294,8 +297,7 @@ class BM32Input(backend.InputBase):
             else:
                 for i in imagenos:
                     self.dbg_pointno = i
-                    edf = EdfFile.EdfFile(matches[i])
-                    yield edf
+                    yield edf.EdfFile(matches[i])
 
     def _get_pattern(self,UCCD):
        imagefolder = self.config.imagefolder
@@ -409,7 +411,7 @@ def load_matrix(filename):
         elif ext == '.npy':
             return numpy.array(numpy.load(filename), dtype = numpy.bool)
         elif ext == '.edf':
-            return numpy.array(EdfFile.EdfFile(filename).getData(0),dtype = numpy.bool)
+            return numpy.array(edf.EdfFile(filename).GetData(0),dtype = numpy.bool)
         else:
             raise ValueError('unknown extension {0}, unable to load matrix!\n'.format(ext))        
     else:
@@ -1,9 +1,9 @@
 import sys
 import os
 import itertools
-import glob
 import numpy
 import time
+import hashlib
 
 #python3 support
 PY3 = sys.version_info > (3,)
@@ -13,14 +13,16 @@ else:
     from itertools import izip as zip
 
 try:
-    from PyMca import specfilewrapper, EdfFile, SixCircle, specfile
+    from PyMca import specfilewrapper, SixCircle, specfile
 except ImportError:
-    from PyMca5.PyMca import specfilewrapper, EdfFile, SixCircle, specfile
+    from PyMca5.PyMca import specfilewrapper, SixCircle, specfile
 
-from .. import backend, errors, util
+from .. import backend, edf, errors, util
 
 
 class pixels(backend.ProjectionBase):
+    edge_bounds = False  # the pixel indices follow from the number of rows and columns, not from their angles
+
     def project(self, wavelength, UB, gamma, delta, theta, mu, chi, phi):
         y, x = numpy.mgrid[slice(None, gamma.shape[0]), slice(None, delta.shape[0])]
         return (y, x)
@@ -252,6 +254,7 @@ class ID03Input(backend.InputBase):
 
     dbg_scanno = None
     dbg_pointno = None
+    imageshape = None
 
     def generate_jobs(self, command):
         scans = util.parse_multi_range(','.join(command).replace(' ', ','))
@@ -274,11 +277,25 @@ class ID03Input(backend.InputBase):
                     except specfile.error:  # no points
                         continue
                 next(self.get_images(scan, 0, pointcount-1, dry_run=True))  # dryrun
+                pixels = self.get_pixelcount(scan, start)
                 if pointcount > self.config.target_weight * 1.4:
                     for s in util.chunk_slicer(pointcount, self.config.target_weight):
-                        yield backend.Job(scan=scanno, firstpoint=start+s.start, lastpoint=start+s.stop-1, weight=s.stop-s.start)
+                        yield backend.Job(scan=scanno, firstpoint=start+s.start, lastpoint=start+s.stop-1, weight=s.stop-s.start, pixels=pixels)
                 else:
-                    yield backend.Job(scan=scanno, firstpoint=start, lastpoint=start+pointcount-1, weight=pointcount)
+                    yield backend.Job(scan=scanno, firstpoint=start, lastpoint=start+pointcount-1, weight=pointcount, pixels=pixels)
+
+    def get_image_shape(self, scan, point):
+        """Returns the shape of the images, that of the mask if there is one or else that of the
+        image of 'point' in 'scan'. All scans share the detector, so the image is only read once."""
+        if self.config.maskmatrix is not None:
+            return self.config.maskmatrix.shape
+        if self.imageshape is None:
+            self.imageshape = next(self.get_images(scan, point, point)).shape
+        return self.imageshape
+
+    def get_pixelcount(self, scan, point):
+        """Returns the number of pixels per point within xmask and ymask, see get_image_shape()."""
+        return self.apply_mask(numpy.empty(self.get_image_shape(scan, point), dtype=bool), self.config.xmask, self.config.ymask).size
 
     def get_delayed_jobs(self, scanno):
         scan = self.get_delayed_scan(scanno)
@@ -293,26 +310,34 @@ class ID03Input(backend.InputBase):
         if self.is_zap(scan):  # wait until the scan is finished.
             if not self.wait_for_points(scanno, self.target(scan), timeout=self.config.timeout):  # wait for last datapoint
                 for s in util.chunk_slicer(pointcount, self.config.target_weight):
-                    yield backend.Job(scan=scanno, firstpoint=firstpoint+s.start, lastpoint=firstpoint+s.stop-1, weight=s.stop-s.start)
+                    yield backend.Job(scan=scanno, firstpoint=firstpoint+s.start, lastpoint=firstpoint+s.stop-1, weight=s.stop-s.start, pixels=self.get_delayed_pixelcount(scan, firstpoint))
             else:
                 raise errors.BackendError('Image collection timed out. Zapscan was probably aborted')
         elif lastpoint >= 0:  # scanlength is known
             for s in util.chunk_slicer(pointcount, self.config.target_weight):
                 if self.wait_for_points(scanno, firstpoint + s.stop, timeout=self.config.timeout):
                     stop = self.get_scan(scanno).lines()
-                    yield backend.Job(scan=scanno, firstpoint=firstpoint+s.start, lastpoint=stop-1, weight=s.stop-s.start)
+                    yield backend.Job(scan=scanno, firstpoint=firstpoint+s.start, lastpoint=stop-1, weight=s.stop-s.start, pixels=self.get_delayed_pixelcount(scan, firstpoint))
                     break
                 else:
-                    yield backend.Job(scan=scanno, firstpoint=firstpoint+s.start, lastpoint=firstpoint+s.stop-1, weight=s.stop-s.start)
+                    yield backend.Job(scan=scanno, firstpoint=firstpoint+s.start, lastpoint=firstpoint+s.stop-1, weight=s.stop-s.start, pixels=self.get_delayed_pixelcount(scan, firstpoint))
         else:  # scanlength is unknown
             step = int(self.config.target_weight / 1.4)
             for start, stop in zip(itertools.count(0, step), itertools.count(step, step)):
                 if self.wait_for_points(scanno, stop, timeout=self.config.timeout):
                     stop = self.get_scan(scanno).lines()
-                    yield backend.Job(scan=scanno, firstpoint=start, lastpoint=stop-1, weight=stop-start)
+                    yield backend.Job(scan=scanno, firstpoint=start, lastpoint=stop-1, weight=stop-start, pixels=self.get_delayed_pixelcount(scan, 0))
                     break
                 else:
-                    yield backend.Job(scan=scanno, firstpoint=start, lastpoint=stop-1, weight=stop-start)
+                    yield backend.Job(scan=scanno, firstpoint=start, lastpoint=stop-1, weight=stop-start, pixels=self.get_delayed_pixelcount(scan, 0))
+
+    def get_delayed_pixelcount(self, scan, point):
+        """As get_pixelcount(), but the images of a scan that is still running may not be written
+        yet, then the pixel count stays unknown (1) until a later job finds an image."""
+        try:
+            return self.get_pixelcount(scan, point)
+        except errors.FileError:
+            return backend.Job.pixels
 
     def process_job(self, job):
         super(ID03Input, self).process_job(job)
@@ -331,6 +356,27 @@ class ID03Input(backend.InputBase):
             raise
         self.metadata.add_section('id03_backend', self.metadict)
 
+    def get_edge_params(self, job):
+        scan = self.get_scan(job.scan)
+        metadict, self.metadict = getattr(self, 'metadict', {}), dict()
+        try:
+            scanparams = self.get_scan_params(scan)  # wavelength, UB
+        finally:
+            self.metadict = metadict  # get_scan_params() records into the metadata of the job being processed
+        pointparams = self.get_point_params(scan, job.firstpoint, job.lastpoint)
+        shape = self.get_image_shape(scan, job.firstpoint)
+
+        for pp in pointparams:
+            gamma_range, delta_range, theta, mu, chi, phi = self.get_ranges(pp, shape)
+            # the first and last row and column of pixels
+            yield (scanparams + (gamma_range[[0, -1]], delta_range, theta, mu, chi, phi),
+                   scanparams + (gamma_range, delta_range[[0, -1]], theta, mu, chi, phi))
+
+    def get_ranges(self, pointparams, shape):
+        """Returns the angles gamma and delta of the rows and columns of the pixels within
+        xmask and ymask for an image of 'shape', and the angles theta, mu, chi and phi."""
+        raise NotImplementedError
+
     def parse_config(self, config):
         super(ID03Input, self).parse_config(config)
         self.config.xmask = util.parse_multi_range(config.pop('xmask', None))  # Optional, select a subset of the image range in the x direction. all by default
@@ -347,7 +393,8 @@ class ID03Input(backend.InputBase):
             self.config.xmask = slice(None)
         if self.config.ymask is None:
             self.config.ymask = slice(None)
-        self.config.maskmatrix = load_matrix(config.pop('maskmatrix', None))  # Optional, if supplied pixels where the mask is 0 will be removed
+        self.config.maskfile = config.pop('maskmatrix', None)  # Optional, if supplied pixels where the mask is 0 will be removed
+        self.config.maskmatrix = load_matrix(self.config.maskfile)
         if self.config.pr:
             self.config.pr = util.parse_tuple(self.config.pr, length=2, type=int)
         self.config.sdd = float(config.pop('sdd'))  # sample to detector distance (mm)
@@ -364,15 +411,14 @@ class ID03Input(backend.InputBase):
 
     # CONVENIENCE FUNCTIONS
     def get_scan(self, scannumber):
-        spec = specfilewrapper.Specfile(self.config.specfile)
-        return spec.select('{0}.1'.format(scannumber))
+        return get_specindex(self.config.specfile).get_scan(scannumber)
 
     def get_delayed_scan(self, scannumber, timeout=None):
         delay = util.loop_delayer(5)
         start = time.time()
         while 1:
             try:
-                return self.get_scan(scannumber)  # reload entire specfile
+                return self.get_scan(scannumber)  # parses the specfile again once it changed
             except specfile.error:
                 if timeout is not None and time.time() - start > timeout:
                     raise errors.BackendError('Scan timed out. There is no data to process')
@@ -430,18 +476,13 @@ class ID03Input(backend.InputBase):
         return False
 
     def find_edfs(self, pattern, scanno):
-        files = glob.glob(pattern)
-        ret = {}
-        for file in files:
-            try:
-                filename = os.path.basename(file).split('.')[0]
-                scan, point, image = filename.split('_')[-3:]
-                scan, point, image = int(scan), int(point), int(image)
-                if scan == scanno and point not in list(ret.keys()):
-                    ret[point] = file
-            except ValueError:
-                continue
-        return ret
+        return get_folderindex(os.path.dirname(pattern), self.parse_edf_name).get(scanno)
+
+    @staticmethod
+    def parse_edf_name(name):
+        # <prefix>_<scan>_<point>_<image>.edf
+        scan, point, image = name.split('.')[0].split('_')[-3:]
+        return int(scan), int(point)
 
     @staticmethod
     def apply_mask(data, xmask, ymask):
@@ -459,19 +500,7 @@ class ID03Input(backend.InputBase):
         self.dbg_scanno = scan.number()
         if self.is_zap(scan):
             # zapscans don't contain the UB matrix, this needs to be fixed at ID03
-            scanno = scan.number()
-            UB = None
-            while 1:  # look back in spec file to locate a UB matrix
-                try:
-                    ubscan = self.get_scan(scanno)
-                except specfilewrapper.specfile.error:
-                    break
-                try:
-                    UB = numpy.array(ubscan.header('G')[2].split(' ')[-9:], dtype=numpy.float)
-                except:
-                    scanno -= 1
-                else:
-                    break
+            UB = get_specindex(self.config.specfile).get_ub(scan.number())  # looks back in spec file to locate a UB matrix
             if UB is None:
                 # fall back to UB matrix from the configfile
                 if not self.config.UB:
@@ -499,41 +528,24 @@ class ID03Input(backend.InputBase):
             if dry_run:
                 yield
             else:
-                edf = EdfFile.EdfFile(self.config.background)
+                background = edf.EdfFile(self.config.background)
                 for i in range(first, last+1):
                     self.dbg_pointno = i
-                    yield edf.GetData(0)
+                    yield background.GetData(0)
         else:
+            pattern, scanno, matches = self.find_scan_edfs(scan)
             if self.is_zap(scan):
-                scanheaderC = scan.header('C')
-                zapscanno = int(scanheaderC[2].split(' ')[-1])  # is different from scanno should be changed in spec!
-                try:
-                    uccdtagline = scanheaderC[0]
-                    UCCD = os.path.split(uccdtagline.split()[-1])
-                except:
-                    print('warning: UCCD tag not found, use imagefolder for proper file specification')
-                    UCCD = []
-                pattern = self._get_pattern(UCCD)
-                matches = self.find_edfs(pattern, zapscanno)
                 if 0 not in matches:
-                    raise errors.FileError('could not find matching edf for zapscannumber {0} using pattern {1}'.format(zapscanno, pattern))
+                    raise errors.FileError('could not find matching edf for zapscannumber {0} using pattern {1}'.format(scanno, pattern))
                 if dry_run:
                     yield
                 else:
-                    edf = EdfFile.EdfFile(matches[0])
+                    zap = edf.EdfFile(matches[0])
                     for i in range(first, last+1):
                         self.dbg_pointno = i
-                        yield edf.GetData(i)
+                        yield zap.GetData(i)
 
             else:
-                try:
-                    uccdtagline = scan.header('UCCD')[0]
-                    UCCD = os.path.split(os.path.dirname(uccdtagline.split()[-1]))
-                except:
-                    print('warning: UCCD tag not found, use imagefolder for proper file specification')
-                    UCCD = []
-                pattern = self._get_pattern(UCCD)
-                matches = self.find_edfs(pattern, scan.number())
                 if set(range(first, last + 1)) > set(matches.keys()):
                     raise errors.FileError("incorrect number of matches for scan {0} using pattern {1}".format(scan.number(), pattern))
                 if dry_run:
@@ -541,8 +553,45 @@ class ID03Input(backend.InputBase):
                 else:
                     for i in range(first, last+1):
                         self.dbg_pointno = i
-                        edf = EdfFile.EdfFile(matches[i])
-                        yield edf.GetData(0)
+                        yield edf.EdfFile(matches[i]).GetData(0)
+
+    def find_scan_edfs(self, scan):
+        """Returns the glob pattern, the image scan number and the edf files of 'scan' by point number.
+        A zapscan stores all its images in the file of point 0."""
+        if self.is_zap(scan):
+            scanheaderC = scan.header('C')
+            scanno = int(scanheaderC[2].split(' ')[-1])  # is different from scanno should be changed in spec!
+            try:
+                uccdtagline = scanheaderC[0]
+                UCCD = os.path.split(uccdtagline.split()[-1])
+            except:
+                print('warning: UCCD tag not found, use imagefolder for proper file specification')
+                UCCD = []
+        else:
+            scanno = scan.number()
+            try:
+                uccdtagline = scan.header('UCCD')[0]
+                UCCD = os.path.split(os.path.dirname(uccdtagline.split()[-1]))
+            except:
+                print('warning: UCCD tag not found, use imagefolder for proper file specification')
+                UCCD = []
+        pattern = self._get_pattern(UCCD)
+        return pattern, scanno, self.find_edfs(pattern, scanno)
+
+    def get_job_files(self, job):
+        # the motor positions come from the scan in the specfile, appending scans does not change it; the mask is only loaded by name in the configuration
+        files = [(self.config.specfile, get_specindex(self.config.specfile).get_digest(job.scan))]
+        if self.config.maskfile:
+            files.append(self.config.maskfile)
+        if self.config.background:
+            return files + [self.config.background]
+        scan = self.get_scan(job.scan)
+        pattern, scanno, matches = self.find_scan_edfs(scan)
+        if self.is_zap(scan):
+            points = [0]
+        else:
+            points = range(job.firstpoint, job.lastpoint + 1)
+        return files + [matches[point] for point in points if point in matches]
 
     def _get_pattern(self, UCCD):
         imagefolder = self.config.imagefolder
@@ -580,11 +629,6 @@ class EH1(ID03Input):
 
         weights = numpy.ones_like(image)
 
-        if self.config.hr:
-            zerohrx, zerohry = self.config.hr
-            chi = (hrx - zerohrx) / numpy.pi * 180. / 1000
-            phi = (hry - zerohry) / numpy.pi * 180. / 1000
-
         if self.config.background:
             data = image / mon
         else:
@@ -596,14 +640,7 @@ class EH1(ID03Input):
         util.status('{4}| gamma: {0}, delta: {1}, theta: {2}, mu: {3}'.format(gamma, delta, theta, mu, time.ctime(time.time())))
 
         # pixels to angles
-        pixelsize = numpy.array(self.config.pixelsize)
-        sdd = self.config.sdd
-
-        app = numpy.arctan(pixelsize / sdd) * 180 / numpy.pi
-
-        centralpixel = self.config.centralpixel  # (column, row) = (delta, gamma)
-        gamma_range = -app[1] * (numpy.arange(data.shape[1]) - centralpixel[1]) + gamma
-        delta_range = app[0] * (numpy.arange(data.shape[0]) - centralpixel[0]) + delta
+        gamma_range, delta_range, theta, mu, chi, phi = self.get_ranges(pointparams, data.shape)
 
         # masking
         if self.config.maskmatrix is not None:
@@ -611,8 +648,6 @@ class EH1(ID03Input):
                 raise errors.BackendError('The mask matrix does not have the same shape as the images')
             weights *= self.config.maskmatrix
 
-        gamma_range = gamma_range[self.config.ymask]
-        delta_range = delta_range[self.config.xmask]
         intensity = self.apply_mask(data, self.config.xmask, self.config.ymask)
         weights = self.apply_mask(weights, self.config.xmask, self.config.ymask)
 
@@ -623,6 +658,25 @@ class EH1(ID03Input):
 
         return intensity, weights, (wavelength, UB, gamma_range, delta_range, theta, mu, chi, phi)
 
+    def get_ranges(self, pointparams, shape):
+        gamma, delta, theta, chi, phi, mu, mon, transm, hrx, hry = pointparams
+
+        if self.config.hr:
+            zerohrx, zerohry = self.config.hr
+            chi = (hrx - zerohrx) / numpy.pi * 180. / 1000
+            phi = (hry - zerohry) / numpy.pi * 180. / 1000
+
+        pixelsize = numpy.array(self.config.pixelsize)
+        sdd = self.config.sdd
+
+        app = numpy.arctan(pixelsize / sdd) * 180 / numpy.pi
+
+        centralpixel = self.config.centralpixel  # (column, row) = (delta, gamma)
+        gamma_range = -app[1] * (numpy.arange(shape[1]) - centralpixel[1]) + gamma
+        delta_range = app[0] * (numpy.arange(shape[0]) - centralpixel[0]) + delta
+
+        return gamma_range[self.config.ymask], delta_range[self.config.xmask], theta, mu, chi, phi
+
     def get_point_params(self, scan, first, last):
         sl = slice(first, last+1)
 
@@ -710,12 +764,7 @@ class EH2(ID03Input):
         data *= (self.config.sdd / sdd)**2
 
         # pixels to angles
-        pixelsize = numpy.array(self.config.pixelsize)
-        app = numpy.arctan(pixelsize / sdd) * 180 / numpy.pi
-
-        centralpixel = self.config.centralpixel  # (row, column) = (gamma, delta)
-        gamma_range = - 1 * app[0] * (numpy.arange(data.shape[0]) - centralpixel[0]) + gamma
-        delta_range = app[1] * (numpy.arange(data.shape[1]) - centralpixel[1]) + delta
+        gamma_range, delta_range, theta, mu, chi, phi = self.get_ranges(pointparams, data.shape)
 
         # masking
         if self.config.maskmatrix is not None:
@@ -723,8 +772,6 @@ class EH2(ID03Input):
                 raise errors.BackendError('The mask matrix does not have the same shape as the images')
             weights *= self.config.maskmatrix
 
-        gamma_range = gamma_range[self.config.xmask]
-        delta_range = delta_range[self.config.ymask]
         intensity = self.apply_mask(data, self.config.xmask, self.config.ymask)
         weights = self.apply_mask(weights, self.config.xmask, self.config.ymask)
 
@@ -740,6 +787,19 @@ class EH2(ID03Input):
 
         return intensity, weights, (wavelength, UB, gamma_range, delta_range, theta, mu, chi, phi)
 
+    def get_ranges(self, pointparams, shape):
+        gamma, delta, theta, chi, phi, mu, mon, transm = pointparams
+
+        sdd = self.config.sdd / numpy.cos(gamma * numpy.pi / 180)
+        pixelsize = numpy.array(self.config.pixelsize)
+        app = numpy.arctan(pixelsize / sdd) * 180 / numpy.pi
+
+        centralpixel = self.config.centralpixel  # (row, column) = (gamma, delta)
+        gamma_range = - 1 * app[0] * (numpy.arange(shape[0]) - centralpixel[0]) + gamma
+        delta_range = app[1] * (numpy.arange(shape[1]) - centralpixel[1]) + delta
+
+        return gamma_range[self.config.xmask], delta_range[self.config.ymask], theta, mu, chi, phi
+
     def get_point_params(self, scan, first, last):
         sl = slice(first, last+1)
 
@@ -804,15 +864,9 @@ class GisaxsDetector(ID03Input):
         util.status('{4}| ccdy: {0}, ccdz: {1}, theta: {2}, mu: {3}'.format(ccdy, ccdz, theta, mu, time.ctime(time.time())))
 
         # pixels to angles
-        pixelsize = numpy.array(self.config.pixelsize)
         sdd = self.config.sdd
-
-        directbeam = (self.config.directbeam[0] - (ccdy - self.config.directbeam_coords[0]) * pixelsize[0], self.config.directbeam[1] - (ccdz - self.config.directbeam_coords[1]) * pixelsize[1])
-        gamma_distance = - pixelsize[1] * (numpy.arange(data.shape[1]) - directbeam[1])
-        delta_distance = - pixelsize[0] * (numpy.arange(data.shape[0]) - directbeam[0])
-
-        gamma_range = numpy.arctan2(gamma_distance, sdd) / numpy.pi * 180 - mu
-        delta_range = numpy.arctan2(delta_distance, sdd) / numpy.pi * 180
+        gamma_distance, delta_distance = self.get_distances(pointparams, data.shape)
+        gamma_range, delta_range, theta, mu, chi, phi = self.get_ranges(pointparams, data.shape)
 
         #sample pixel distance
         spd = numpy.sqrt(gamma_distance**2 + delta_distance**2 + sdd**2)
@@ -824,13 +878,29 @@ class GisaxsDetector(ID03Input):
                 raise errors.BackendError('The mask matrix does not have the same shape as the images')
             weights *= self.config.maskmatrix
 
-        gamma_range = gamma_range[self.config.ymask]
-        delta_range = delta_range[self.config.xmask]
         intensity = self.apply_mask(data, self.config.xmask, self.config.ymask)
         weights = self.apply_mask(weights, self.config.xmask, self.config.ymask)
 
         return intensity, weights, (wavelength, UB, gamma_range, delta_range, theta, mu, chi, phi)
 
+    def get_distances(self, pointparams, shape):
+        """Returns the distances of the columns and rows of pixels to the direct beam."""
+        ccdy, ccdz = pointparams[:2]
+        pixelsize = numpy.array(self.config.pixelsize)
+        directbeam = (self.config.directbeam[0] - (ccdy - self.config.directbeam_coords[0]) * pixelsize[0], self.config.directbeam[1] - (ccdz - self.config.directbeam_coords[1]) * pixelsize[1])
+        gamma_distance = - pixelsize[1] * (numpy.arange(shape[1]) - directbeam[1])
+        delta_distance = - pixelsize[0] * (numpy.arange(shape[0]) - directbeam[0])
+        return gamma_distance, delta_distance
+
+    def get_ranges(self, pointparams, shape):
+        ccdy, ccdz, theta, chi, phi, mu, mon, transm = pointparams
+        gamma_distance, delta_distance = self.get_distances(pointparams, shape)
+
+        gamma_range = numpy.arctan2(gamma_distance, self.config.sdd) / numpy.pi * 180 - mu
+        delta_range = numpy.arctan2(delta_distance, self.config.sdd) / numpy.pi * 180
+
+        return gamma_range[self.config.ymask], delta_range[self.config.xmask], theta, mu, chi, phi
+
     def parse_config(self, config):
         super(GisaxsDetector, self).parse_config(config)
         self.config.directbeam = util.parse_tuple(config.pop('directbeam'), length=2, type=int)
@@ -857,19 +927,11 @@ class GisaxsDetector(ID03Input):
         params[:, MU] = scan.datacol('mucnt')[sl]
         return params
 
-    def find_edfs(self, pattern, scanno):
-        files = glob.glob(pattern)
-        ret = {}
-        for file in files:
-            try:
-                filename = os.path.basename(file).split('.')[0]
-                scan, point = filename.split('_')[-2:]
-                scan, point = int(scan), int(point)
-                if scan == scanno and point not in list(ret.keys()):
-                    ret[point] = file
-            except ValueError:
-                continue
-        return ret
+    @staticmethod
+    def parse_edf_name(name):
+        # <prefix>_<scan>_<point>.edf
+        scan, point = name.split('.')[0].split('_')[-2:]
+        return int(scan), int(point)
 
 def load_matrix(filename):
     if filename == None:
@@ -881,8 +943,139 @@ def load_matrix(filename):
         elif ext == '.npy':
             return numpy.array(numpy.load(filename), dtype=numpy.bool)
         elif ext == '.edf':
-            return numpy.array(EdfFile.EdfFile(filename).getData(0), dtype=numpy.bool)
+            return numpy.array(edf.EdfFile(filename).GetData(0), dtype=numpy.bool)
         else:
             raise ValueError('unknown extension {0}, unable to load matrix!\n'.format(ext))
     else:
         raise IOError('filename: {0} does not exist. Can not load matrix'.format(filename))
+
+
+class SpecIndex(object):
+    """Parsed spec file that is shared by all inputs of a process, see get_specindex().
+    The file is only parsed again when its size or modification time changes, and when
+    it has grown Specfile.update() parses only the appended part, otherwise (rewritten or
+    changed in place) it is parsed from the start. Selected scans and the UB matrices found
+    in the G headers are kept until then; the UB matrices as long as the file only grows,
+    because the header of a scan does not change once written."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.stat = None
+        self.spec = None
+        self.scans = {}
+        self.ubs = {}
+
+    def refresh(self):
+        stat = os.stat(self.filename)
+        key = stat.st_size, stat.st_mtime
+        if key == self.stat:
+            return
+        if self.spec is not None and stat.st_size > self.stat[0] and hasattr(self.spec, 'update'):  # appended
+            self.spec.update()
+        else:
+            self.spec = specfilewrapper.Specfile(self.filename)
+            self.ubs.clear()
+        self.scans.clear()
+        self.stat = key
+
+    def get_scan(self, scannumber):
+        self.refresh()
+        if scannumber not in self.scans:
+            self.scans[scannumber] = self.spec.select('{0}.1'.format(scannumber))
+        return self.scans[scannumber]
+
+    def get_digest(self, scannumber):
+        """Returns a hash of the header and data lines of the scan and the UB matrix it uses,
+        which identifies the part of the file a job of the scan reads."""
+        scan = self.get_scan(scannumber)
+        digest = hashlib.sha1()
+        for line in scan.header(''):
+            digest.update(line.encode('utf8'))
+        digest.update(numpy.ascontiguousarray(scan.data()).tobytes())
+        UB = self.get_ub(scannumber)
+        if UB is not None:
+            digest.update(UB.tobytes())
+        return digest.hexdigest()
+
+    def get_ub(self, scannumber):
+        """Returns the UB matrix in the G header of the scan, or else of the closest scan
+        before it that has one. None if there is no such scan."""
+        self.refresh()
+        visited = []
+        UB = None
+        while scannumber not in self.ubs:
+            try:
+                scan = self.get_scan(scannumber)
+            except specfile.error:
+                break
+            visited.append(scannumber)
+            try:
+                UB = numpy.array(scan.header('G')[2].split(' ')[-9:], dtype=float)
+            except:
+                scannumber -= 1
+            else:
+                break
+        else:
+            UB = self.ubs[scannumber]
+        for number in visited:
+            self.ubs[number] = UB
+        return UB
+
+
+_specindices = {}
+
+
+def get_specindex(filename):
+    """Returns the SpecIndex of 'filename', shared by all inputs of the process."""
+    filename = os.path.abspath(filename)
+    if filename not in _specindices:
+        _specindices[filename] = SpecIndex(filename)
+    return _specindices[filename]
+
+
+class FolderIndex(object):
+    """Index of the image files in 'directory' by scan and point number, shared by all
+    inputs of a process, see get_folderindex(). parse(name) returns the scan and point
+    number of a file name, or raises ValueError for other files. The directory is only
+    listed again when its modification time changes, or while that is too recent to tell,
+    and then only the new names are parsed."""
+
+    def __init__(self, directory, parse):
+        self.directory = directory
+        self.parse = parse
+        self.mtime = None
+        self.names = set()
+        self.scans = {}
+
+    def refresh(self):
+        mtime = os.stat(self.directory).st_mtime
+        if mtime == self.mtime and time.time() - mtime > 2:  # file systems may store the mtime in whole seconds
+            return
+        names = set(name for name in os.listdir(self.directory) if not name.startswith('.'))
+        if not self.names <= names:  # files were removed
+            self.names = set()
+            self.scans = {}
+        for name in sorted(names - self.names):
+            try:
+                scan, point = self.parse(name)
+            except ValueError:
+                continue
+            self.scans.setdefault(scan, {}).setdefault(point, os.path.join(self.directory, name))
+        self.names = names
+        self.mtime = mtime
+
+    def get(self, scan):
+        """Returns the files of 'scan' by point number."""
+        self.refresh()
+        return dict(self.scans.get(scan, {}))
+
+
+_folderindices = {}
+
+
+def get_folderindex(directory, parse):
+    """Returns the FolderIndex of 'directory' for file names in the format of 'parse', shared by all inputs of the process."""
+    key = os.path.abspath(directory), parse
+    if key not in _folderindices:
+        _folderindices[key] = FolderIndex(key[0], parse)
+    return _folderindices[key]
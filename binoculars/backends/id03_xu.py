@@ -1,7 +1,7 @@
 """
 BINocular backend for beamline ID03:EH2 
 This backend should serve as a basic example of a backend based on
-xrayutilities [1]. It still uses PyMCA for parsing the spec,edf files.
+xrayutilities [1]. It still uses PyMCA for parsing the spec files.
 The 'original' ID03 backend was used as a template.
 
 Created on 2014-10-16
@@ -27,11 +27,11 @@ else:
     from itertools import izip as zip
 
 try:
-    from PyMca import specfilewrapper, EdfFile
+    from PyMca import specfilewrapper
 except ImportError:
-    from PyMca.PyMcaIO import specfilewrapper, EdfFile
+    from PyMca.PyMcaIO import specfilewrapper
 
-from .. import backend, errors, util
+from .. import backend, edf, errors, util
 
 class HKLProjection(backend.ProjectionBase):
     # scalars: mu, theta, [chi, phi, "omitted"] delta, gamR, gamT, ty, wavelength
@@ -165,8 +165,7 @@ class ID03Input(backend.InputBase):
             yield
         else:
             for i in range(first, last+1):
-                edf = EdfFile.EdfFile(matches[i])
-                yield edf.GetData(0)
+                yield edf.EdfFile(matches[i]).GetData(0)
 
     def _get_pattern(self,UCCD):
        imagefolder = self.config.imagefolder
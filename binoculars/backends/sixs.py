@@ -318,6 +318,7 @@ class SIXS(backend.InputBase):
 
     dbg_scanno = None
     dbg_pointno = None
+    pixelcount = None
 
     def generate_jobs(self, command):
         scans = util.parse_multi_range(','.join(command).replace(' ', ','))
@@ -331,18 +332,21 @@ class SIXS(backend.InputBase):
             else:
                 start = 0
                 pointcount = self.get_pointcount(scanno)
+            pixels = self.get_pixelcount(scanno)
             if pointcount > self.config.target_weight * 1.4:
                 for s in util.chunk_slicer(pointcount,
                                            self.config.target_weight):
                     yield backend.Job(scan=scanno,
                                       firstpoint=start+s.start,
                                       lastpoint=start+s.stop-1,
-                                      weight=s.stop-s.start)
+                                      weight=s.stop-s.start,
+                                      pixels=pixels)
             else:
                 yield backend.Job(scan=scanno,
                                   firstpoint=start,
                                   lastpoint=start+pointcount-1,
-                                  weight=pointcount)
+                                  weight=pointcount,
+                                  pixels=pixels)
 
     def process_job(self, job):
         super(SIXS, self).process_job(job)
@@ -350,9 +354,14 @@ class SIXS(backend.InputBase):
             self.metadict = dict()
             try:
                 for dataframe in dataframes(scan, self.HPATH):
-                    pixels = self.get_pixels(dataframe.detector)
-                    for index in range(job.firstpoint, job.lastpoint + 1):
-                        yield self.process_image(index, dataframe, pixels)
+                    detector = ALL_DETECTORS[dataframe.detector.name]()
+                    pixels = self.get_pixels(detector)
+                    mask = self.get_mask(detector)
+                    attenuations, values = self.get_values(slice(job.firstpoint, job.lastpoint + 1), dataframe.h5_nodes)
+                    images = self.get_images(dataframe.h5_nodes['image'], job.firstpoint, job.lastpoint)
+                    for i, image in enumerate(images):
+                        attenuation = None if attenuations is None else attenuations[i]
+                        yield self.process_image(job.firstpoint + i, dataframe, pixels, mask, image, attenuation, tuple(v[i] for v in values))
                 util.statuseol()
             except Exception as exc:
                 exc.args = errors.addmessage(exc.args, ', An error occured for scan {0} at point {1}. See above for more information'.format(self.dbg_scanno, self.dbg_pointno))
@@ -374,6 +383,7 @@ class SIXS(backend.InputBase):
         self.config.sdd = float(config.pop('sdd'))  # sample to detector distance (mm)
         self.config.centralpixel = util.parse_tuple(config.pop('centralpixel'), length=2, type=int)  # x,y
         self.config.maskmatrix = config.pop('maskmatrix', None)  # Optional, if supplied pixels where the mask is 0 will be removed
+        self.config.slabsize = int(config.pop('slabsize', 64))  # Optional, number of images read from the nexus file at once, rounded to whole chunks of the image dataset, 64 by default
         self.config.detrot = config.pop('detrot', None)  # detector rotation around x (1, 0, 0)
         if self.config.detrot is not None:
             try:
@@ -399,6 +409,14 @@ class SIXS(backend.InputBase):
         return dict(first=min(scans), last=max(scans), range=','.join(str(scan) for scan in scans))
 
     # CONVENIENCE FUNCTIONS
+    def get_pixelcount(self, scanno):
+        # the pixels of one image, the detector is the same for all scans so the file is only opened once
+        if self.pixelcount is None:
+            with tables.open_file(self.get_filename(scanno), 'r') as scan:
+                shape = get_nxclass(scan, "NXdata")._f_get_child(self.HPATH['image'].name).shape
+            self.pixelcount = int(numpy.prod(shape[1:]))
+        return self.pixelcount
+
     def get_filename(self, scanno):
         filename = self.config.nexusfile.format(scanno=str(scanno).zfill(5))
         if not os.path.exists(filename):
@@ -410,6 +428,24 @@ class SIXS(backend.InputBase):
         roi = data[ymask, :]
         return roi[:, xmask]
 
+    def get_mask(self, detector):
+        maskmatrix = load_matrix(self.config.maskmatrix)
+        if maskmatrix is not None:
+            return numpy.bitwise_or(detector.mask, maskmatrix)
+        return detector.mask
+
+    def get_images(self, node, first, last):
+        """Yields the images 'first' to 'last' of the image node, read in slabs of
+        about slabsize images that start and end on chunk boundaries."""
+        chunk = node.chunkshape[0] if node.chunkshape else 1
+        step = max(chunk, self.config.slabsize // chunk * chunk)
+        start = first
+        while start <= last:
+            stop = min((start // step + 1) * step, last + 1)
+            for image in node[start:stop]:
+                yield image
+            start = stop
+
 
 HItem = namedtuple("HItem", ["name", "optional"])
 
@@ -428,42 +464,30 @@ class FlyScanUHV(SIXS):
         with tables.open_file(self.get_filename(scanno), 'r') as scan:
             return get_nxclass(scan, "NXdata").xpad_image.shape[0]
 
-    def get_attenuation(self, index, h5_nodes, offset):
+    def get_attenuation(self, points, h5_nodes, offset):
         attenuation = None
         if self.config.attenuation_coefficient is not None:
-            try:
-                node = h5_nodes['attenuation']
-                if node is not None:
-                    attenuation = node[index + offset]
-                else:
-                    raise Exception("you asked for attenuation but the file does not contain attenuation informations.")
-            except IndexError:
-                attenuation = WRONG_ATTENUATION
+            node = h5_nodes['attenuation']
+            if node is None:
+                raise Exception("you asked for attenuation but the file does not contain attenuation informations.")
+            start, stop = points.start + offset, points.stop + offset
+            attenuation = numpy.empty(stop - start)
+            attenuation.fill(WRONG_ATTENUATION)  # for the points past the end of the attenuation data
+            values = node[start:stop]
+            attenuation[:len(values)] = values
         return attenuation
 
-    def get_values(self, index, h5_nodes):
-        image = h5_nodes['image'][index]
-        mu = h5_nodes['mu'][index]
-        omega = h5_nodes['omega'][index]
-        delta = h5_nodes['delta'][index]
-        gamma = h5_nodes['gamma'][index]
-        attenuation = self.get_attenuation(index, h5_nodes, 2)
+    def get_values(self, points, h5_nodes):
+        mu = h5_nodes['mu'][points]
+        omega = h5_nodes['omega'][points]
+        delta = h5_nodes['delta'][points]
+        gamma = h5_nodes['gamma'][points]
+        attenuation = self.get_attenuation(points, h5_nodes, 2)
 
-        return (image, attenuation, (mu, omega, delta, gamma))
+        return (attenuation, (mu, omega, delta, gamma))
 
-    def process_image(self, index, dataframe, pixels):
+    def process_image(self, index, dataframe, pixels, mask, intensity, attenuation, values):
         util.status(str(index))
-        detector = ALL_DETECTORS[dataframe.detector.name]()
-        maskmatrix = load_matrix(self.config.maskmatrix)
-        if maskmatrix is not None:
-            mask = numpy.bitwise_or(detector.mask, maskmatrix)
-        else:
-            mask = detector.mask
-
-        # extract the data from the h5 nodes
-
-        h5_nodes = dataframe.h5_nodes
-        intensity, attenuation, values = self.get_values(index, h5_nodes)
 
         # BEWARE in order to avoid precision problem we convert the
         # uint16 -> float32. (the size of the mantis is on 23 bits)
@@ -508,7 +532,6 @@ class FlyScanUHV(SIXS):
         return intensity, weights, (index, pdataframe)
 
     def get_pixels(self, detector):
-        detector = ALL_DETECTORS[detector.name]()
         y, x, _ = detector.calc_cartesian_positions()
         y0 = y[self.config.centralpixel[1], self.config.centralpixel[0]]
         x0 = x[self.config.centralpixel[1], self.config.centralpixel[0]]
@@ -541,15 +564,14 @@ class FlyMedH(FlyScanUHV):
         "attenuation": HItem("attenuation", True),
     }
 
-    def get_values(self, index, h5_nodes):
-        image = h5_nodes['image'][index]
-        pitch = h5_nodes['pitch'][index] if h5_nodes['pitch'] else 0.3
-        mu = h5_nodes['mu'][index]
-        gamma = h5_nodes['gamma'][index]
-        delta = h5_nodes['delta'][index]
-        attenuation = self.get_attenuation(index, h5_nodes, 2)
+    def get_values(self, points, h5_nodes):
+        mu = h5_nodes['mu'][points]
+        pitch = h5_nodes['pitch'][points] if h5_nodes['pitch'] else 0.3 * numpy.ones_like(mu)
+        gamma = h5_nodes['gamma'][points]
+        delta = h5_nodes['delta'][points]
+        attenuation = self.get_attenuation(points, h5_nodes, 2)
 
-        return (image, attenuation, (pitch, mu, gamma, delta))
+        return (attenuation, (pitch, mu, gamma, delta))
 
 
 class SBSMedH(FlyScanUHV):
@@ -567,15 +589,14 @@ class SBSMedH(FlyScanUHV):
         with tables.open_file(self.get_filename(scanno), 'r') as scan:
             return get_nxclass(scan, "NXdata").data_03.shape[0]
 
-    def get_values(self, index, h5_nodes):
-        image = h5_nodes['image'][index]
-        pitch = h5_nodes['pitch'][index]
-        mu = h5_nodes['mu'][index]
-        gamma = h5_nodes['gamma'][index]
-        delta = h5_nodes['delta'][index]
-        attenuation = self.get_attenuation(index, h5_nodes, 2)
+    def get_values(self, points, h5_nodes):
+        pitch = h5_nodes['pitch'][points]
+        mu = h5_nodes['mu'][points]
+        gamma = h5_nodes['gamma'][points]
+        delta = h5_nodes['delta'][points]
+        attenuation = self.get_attenuation(points, h5_nodes, 2)
 
-        return (image, attenuation, (pitch, mu, gamma, delta))
+        return (attenuation, (pitch, mu, gamma, delta))
 
 
 def load_matrix(filename):
@@ -1,18 +1,32 @@
 import sys
 import os
+import glob
 import time
 import itertools
 import subprocess
 import multiprocessing
+import traceback
+import tempfile
+import functools
+import collections
+import numpy
 
 from . import util, errors, space
 
 #python3 support
 PY3 = sys.version_info > (3,)
+if PY3:
+    import queue
+else:
+    import Queue as queue
 
 class Destination(object):
     type = filename = overwrite = value = config = limits = None
     opts = {}
+    layout = 'auto'
+    compression = 'gzip'
+    pyramid = 0
+    append = False
 
     def set_final_filename(self, filename, overwrite):
         self.type = 'final'
@@ -29,6 +43,14 @@ class Destination(object):
     def set_config(self, conf):
         self.config = conf
 
+    def set_storage(self, layout, compression, pyramid=0):
+        self.layout = layout
+        self.compression = compression
+        self.pyramid = pyramid
+
+    def set_append(self, append):
+        self.append = append
+
     def set_tmp_filename(self, filename):
         self.type = 'tmp'
         self.filename = filename
@@ -43,34 +65,122 @@ class Destination(object):
         if self.type == 'memory':
             self.value = verse
         elif self.type == 'tmp':
-            verse.tofile(self.filename)
+            if self.config is not None:
+                for sp in verse.spaces:
+                    sp.config = self.config  # identifies the run when resuming, see Oar.resume()
+            verse.tofile(self.filename, self.layout, self.compression)
         elif self.type == 'final':
             for sp, fn in zip(verse.spaces, self.final_filenames()):
                 sp.config = self.config
-                sp.tofile(fn)
+                if self.append:
+                    space.add_to_file(sp, fn, self.layout, self.compression, self.pyramid)
+                else:
+                    sp.tofile(fn, self.layout, self.compression, self.pyramid)
 
     def retrieve(self):
         if self.type == 'memory':
             return self.value
 
+    def stored_jobs(self):
+        """Returns the job descriptions in the metadata of the existing output, for
+        appending to it. Raises errors.ConfigError when the output was made with a
+        different projection or input configuration."""
+        jobs = []
+        for fn in self.final_filenames():
+            if not os.path.exists(fn):
+                continue
+            config, stored = stored_jobs(fn)
+            if config is not None and self.config is None:
+                raise errors.ConfigError("cannot append to '{0}' without the configuration of the current run to compare with".format(fn))
+            if config is not None and not same_config(config, self.config):
+                raise errors.ConfigError("cannot append to '{0}', its projection or input configuration differs from the current one".format(fn))
+            jobs.extend(stored)
+        return jobs
+
     def final_filenames(self):
         fns = []
         if not self.limits == None:
             base, ext = os.path.splitext(self.filename)
             for limlabel in util.limit_to_filelabel(self.limits):
                 fn = (base + '_' + limlabel + ext).format(**self.opts)
-                if not self.overwrite:
+                if not (self.overwrite or self.append):
                     fn = util.find_unused_filename(fn)
                 fns.append(fn)
         else:
             fn = self.filename.format(**self.opts)
-            if not self.overwrite:
+            if not (self.overwrite or self.append):
                 fn = util.find_unused_filename(fn)
             fns.append(fn)
         return fns
 
 
+class Checkpoint(object):
+    """Running sum of a run, stored in 'filename' by chunked_sum() at most every 'interval'
+    seconds, from which an interrupted run can be resumed. The jobs it holds are known from the
+    job metadata of its spaces, 'config' is stored along to recognize the run."""
+
+    def __init__(self, filename, interval, config):
+        self.filename = filename
+        self.interval = interval
+        self.config = config
+        self.last = time.time()
+
+    def due(self):
+        return time.time() - self.last >= self.interval
+
+    def write(self, verse):
+        for sp in verse.spaces:
+            sp.config = self.config
+        verse.tofile(self.filename)
+        self.last = time.time()
+
+    def load(self):
+        """Returns the stored Multiverse and the descriptions of the jobs in it."""
+        config, jobs = stored_jobs(self.filename)
+        if config is not None and not same_run(config, self.config):
+            raise errors.ConfigError("cannot resume from '{0}', it belongs to a run with a different command or configuration".format(self.filename))
+        return space.Multiverse.fromfile(self.filename), jobs
+
+    def remove(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+def stored_jobs(filename):
+    """Returns the configuration and the job descriptions in the metadata of a Space or
+    Multiverse file, the configuration is None when the file holds no data."""
+    config, jobs = None, []
+    with util.open_h5py(filename, 'r') as fp:
+        groups = [fp[label] for label in fp] if fp.attrs.get('type') == 'Multiverse' else [fp]
+        for group in groups:
+            if group.attrs.get('type') == 'Empty':
+                continue
+            config = util.ConfigFile.fromfile(group)
+            metadata = util.MetaData.fromfile(group)
+            jobs.extend(meta.job for meta in metadata.metas if 'job' in meta.sections)
+    return config, jobs
+
+
+def plain_section(section):
+    # configuration values read back from HDF5 can be bytes or numpy strings
+    return dict((key, value.decode('utf8') if isinstance(value, bytes) else str(value)) for (key, value) in section.items())
+
+
+def same_config(first, second):
+    """True when two ConfigFiles have the same projection and input configuration."""
+    return all(plain_section(getattr(first, section)) == plain_section(getattr(second, section)) for section in ('projection', 'input'))
+
+
+def same_run(first, second):
+    """True when two ConfigFiles have the same command as well as the same configuration."""
+    return same_config(first, second) and list(first.command) == list(second.command)
+
+
 class DispatcherBase(util.ConfigurableObject):
+    resumed = ()  # results restored by resume()
+    sums_results = True  # the results of the jobs are summed in this process by sum_verses(), which supports checkpoints
+    balance_tail = 2  # jobs per worker at the end of the queue that balance_jobs() reorders and splits
+
     def __init__(self, config, main):
         self.main = main
         super(DispatcherBase, self).__init__(config)
@@ -81,19 +191,46 @@ class DispatcherBase(util.ConfigurableObject):
         destination = config.pop('destination', 'output.hdf5')  # optional 'output.hdf5' by default
         overwrite = util.parse_bool(config.pop('overwrite', 'false'))  #by default: numbered files in the form output_  # .hdf5:
         self.config.destination.set_final_filename(destination, overwrite)  # explicitly parsing the options first helps with the debugging
+        layout = config.pop('layout', 'auto')  # Optional, chunk shape of the output: auto (default), cube or slab:<axis label> for output that is mostly read in thin slices across that axis
+        compression = config.pop('compression', 'gzip')  # Optional, compression of the output: gzip (default), lzf, lz4 (requires hdf5plugin) or none, prefix with shuffle+ to apply the shuffle filter first
+        try:
+            space.get_filters(compression)
+        except ValueError as e:
+            raise errors.ConfigError(str(e))
+        if not (layout in ('auto', 'cube') or layout.startswith('slab:')):
+            raise errors.ConfigError("unknown layout '{0}', expected auto, cube or slab:<axis label>".format(layout))
+        pyramid = int(config.pop('pyramid', 0))  # Optional, number of coarser levels (2x, 4x, 8x, ...) stored alongside the output for fast previews, 0 (default) for none
+        self.config.destination.set_storage(layout, compression, pyramid)
+        self.config.destination.set_append(util.parse_bool(config.pop('append', 'false')))  # Optional, add the jobs missing from an existing output to it instead of writing a new one, requires a destination without scan numbers in its name, false by default
         self.config.host = config.pop('host', None)  # ip adress of the running gui awaiting the spaces
         self.config.port = config.pop('port', None)  # port of the running gui awaiting the spaces
         self.config.send_to_gui = util.parse_bool(config.pop('send_to_gui', 'false'))  # previewing the data, if true, also specify host and port
+        self.config.estimate_bounds = util.parse_bool(config.pop('estimate_bounds', 'true'))  # Optional, size the output of a job up front by projecting the detector edges first, true by default
+        self.config.sum_threads = int(config.pop('sum_threads', 1))  # Optional, number of threads adding up the results, 0 for the number of cores, 1 by default
+        self.config.cost_file = config.pop('cost_file', None)  # Optional, JSON file in which the cost of the jobs is learned per input and projection, e.g. ~/.binoculars/costs.json. Enables target_time and balancing the jobs over the workers
+        self.config.target_time = float(config.pop('target_time', 0))  # Optional, desired duration of a job in seconds, overrides the target_weight of the input once the cost is known (requires cost_file)
+        self.config.cache = config.pop('cache', None)  # Optional, directory in which the results of the jobs are cached, such that a rerun only processes new or changed jobs
+        self.config.cache_size = int(config.pop('cache_size', 10240))  # Optional, size in MB above which the least recently used results are removed from the cache, 10240 by default
+        self.config.checkpoint = config.pop('checkpoint', None)  # Optional, file in which Local and SingleCore store the running sum every checkpoint_interval seconds, such that a run that dies can be continued with --resume. Cannot be combined with fan_in
+        self.config.checkpoint_interval = float(config.pop('checkpoint_interval', 600))  # Optional, seconds between checkpoints, 600 by default
+        self.config.fan_in = int(config.pop('fan_in', 0))  # Optional, number of partial results merged by every summation step, the Oar jobs or Local and SingleCore, which builds a reduction tree with one final merge at the root. 0 (default) merges everything at once, which Local and SingleCore need for a checkpoint
+        if self.config.fan_in > 1 and self.config.checkpoint is not None and self.sums_results:
+            raise errors.ConfigError('fan_in cannot be combined with checkpoint, only the running sum of a run without reduction tree is checkpointed')
+        self.config.resume = util.parse_bool(config.pop('resume', 'false'))  # Optional, continue an interrupted run from its checkpoint, or for Oar from the intermediate results in tmpdir. Set by the --resume flag of binoculars process
 
     def send(self, verses):  # provides the possiblity to send the results to the gui over the network
         if self.config.send_to_gui or (self.config.host is not None and self.config.host is not None):  # only continue of ip is specified and send_to_server is flagged
             for M in verses:
                 if self.config.destination.limits is None:
                     sp = M.spaces[0]
+                    if isinstance(sp, space.SparseSpace):
+                        sp = sp.todense()
                     if isinstance(sp, space.Space):
                         util.socket_send(self.config.host, int(self.config.port), util.serialize(sp, ','.join(self.main.config.command)))
                 else:
                     for sp, label in zip(M.spaces, util.limit_to_filelabel(self.config.destination.limits)):
+                        if isinstance(sp, space.SparseSpace):
+                            sp = sp.todense()
                         if isinstance(sp, space.Space):
                             util.socket_send(self.config.host, int(self.config.port), util.serialize(sp, '{0}_{1}'.format(','.join(self.main.config.command), label)))
                 yield M
@@ -104,6 +241,76 @@ class DispatcherBase(util.ConfigurableObject):
     def has_specific_task(self):
         return False
 
+    def record(self, verses):
+        """Passes on the Multiverses of the jobs, recording the timings they carry (see
+        main.Main.compute_job()) in the cost model of the main process."""
+        costmodel = self.main.costmodel
+        for verse in verses:
+            if costmodel is not None:
+                for job, seconds in getattr(verse, 'timings', ()):
+                    costmodel.record(job, seconds)
+            yield verse
+
+    def get_cost(self):
+        """Returns a function estimating the cost of a job, its duration when the cost model knows it or else its weight."""
+        costmodel = self.main.costmodel
+        if costmodel is not None and costmodel.unitcost is not None:
+            return costmodel.estimate
+        return lambda job: job.weight
+
+    def balance_jobs(self, jobs, nworkers):
+        """Returns the jobs with the tail of the queue, the last balance_tail jobs per worker,
+        ordered by decreasing cost, such that the short jobs fill up the end of the run. Jobs in
+        the tail that cost more than a fraction of its total per worker are split first, the jobs
+        before it are passed on as they come. Until the cost model has learned a cost, or while
+        the input waits for data that is still being acquired, 'jobs' is returned as it is."""
+        if self.main.costmodel is None or self.main.costmodel.unitcost is None:
+            return jobs
+        if getattr(self.main.input.config, 'wait_for_data', False):
+            return jobs
+        return self._balance_tail(iter(jobs), nworkers)
+
+    def _balance_tail(self, jobs, nworkers):
+        cost = self.get_cost()
+        tail = collections.deque()
+        for job in jobs:
+            tail.append(job)
+            if len(tail) > self.balance_tail * nworkers:
+                yield tail.popleft()
+        limit = sum(cost(job) for job in tail) / (2. * nworkers)
+        balanced = []
+        for job in tail:
+            parts = int(numpy.ceil(cost(job) / limit)) if limit > 0 else 1
+            balanced.extend(self.main.input.split_job(job, parts))
+        for job in sorted(balanced, key=cost, reverse=True):
+            yield job
+
+    def get_checkpoint(self):
+        if self.config.checkpoint is None:
+            return None
+        return Checkpoint(self.config.checkpoint, self.config.checkpoint_interval, self.main.config)
+
+    def resume(self, jobs):
+        """Returns the jobs that remain to be done when continuing an interrupted run. By
+        default the running sum is restored from the checkpoint and its jobs are skipped."""
+        checkpoint = self.get_checkpoint()
+        if checkpoint is None or not os.path.exists(checkpoint.filename):
+            return jobs
+        verse, done = checkpoint.load()
+        self.resumed = [verse]
+        return self.main.input.missing_jobs(jobs, done)
+
+    def discard_checkpoint(self):
+        checkpoint = self.get_checkpoint()
+        if checkpoint is not None:
+            checkpoint.remove()
+
+    def sum_verses(self, verses):
+        """Sums the Multiverses of the jobs, through a reduction tree when fan_in is set."""
+        if self.config.fan_in > 1:
+            return space.tree_sum(verses, self.config.fan_in, nthreads=self.config.sum_threads or None)
+        return space.chunked_sum(verses, nthreads=self.config.sum_threads or None, checkpoint=self.get_checkpoint())
+
     def process_jobs(self, jobs):
         raise NotImplementedError
 
@@ -119,7 +326,7 @@ class SingleCore(DispatcherBase):
             yield self.main.process_job(job)
 
     def sum(self, results):
-        return space.chunked_sum(self.send(results))
+        return self.sum_verses(itertools.chain(self.resumed, self.send(self.record(results))))
 
 
 # Base class for Dispatchers using subprocesses to do some work.
@@ -152,20 +359,76 @@ class Local(ReentrantBase):
         self.config.ncores = int(config.pop('ncores', 0))  # optionally, specify number of cores (autodetect by default)
         if self.config.ncores <= 0:
             self.config.ncores = multiprocessing.cpu_count()
+        self.config.worker_sum = util.parse_bool(config.pop('worker_sum', 'false'))  # Optional, let every worker sum the results of its own jobs and send back partial sums only, for when the main process cannot keep up, false by default
+        self.config.worker_sum_size = int(config.pop('worker_sum_size', 1024))  # Optional, size in MB above which a worker sends its partial sum early, 1024 by default
+        self.config.transport = config.pop('transport', 'pipe').lower()  # Optional, how the workers send back their results: pipe (default) pickles them, file passes the arrays through memory mapped scratch files in transport_dir
+        if self.config.transport not in ('pipe', 'file'):
+            raise errors.ConfigError("unknown transport '{0}', expected pipe or file".format(self.config.transport))
+        self.config.transport_dir = config.pop('transport_dir', '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())  # Optional, directory of the scratch files of the file transport, /dev/shm when available
 
     def process_jobs(self, jobs):
-        if self.config.ncores == 1 and not PY3:  # note: SingleCore will be marginally faster
-            map = itertools.imap
+        # the workers build the projection and input once and keep them (and their caches) for all their jobs
+        initializer, function = self.main.get_worker()
+        config = self.prepare_worker_config()
+        directory = self.config.transport_dir if self.config.transport == 'file' else None
+        if self.config.ncores > 1:
+            jobs = self.balance_jobs(jobs, self.config.ncores)
+        if self.config.worker_sum:
+            results = self.process_jobs_summed(jobs, initializer, function, config, directory)
+        elif self.config.ncores == 1 and not PY3:  # note: SingleCore will be marginally faster
+            initializer(config)
+            results = itertools.imap(function, jobs)
         else:
-            pool = multiprocessing.Pool(self.config.ncores)
-            map = pool.imap_unordered
-
-        configs = (self.prepare_config(job) for job in jobs)
-        for result in map(self.main.get_reentrant(), configs):
-            yield result
+            if directory is not None:
+                function = functools.partial(mapped_job, function, directory)
+            results = self.process_jobs_pool(jobs, initializer, function, config)
+        for result in results:
+            yield import_verse(result)
+
+    def process_jobs_pool(self, jobs, initializer, function, config):
+        pool = multiprocessing.Pool(self.config.ncores, initializer, (config, ))
+        try:
+            for result in pool.imap_unordered(function, jobs):
+                yield result
+        finally:
+            pool.close()
+
+    def process_jobs_summed(self, jobs, initializer, function, config, directory=None):
+        jobqueue = multiprocessing.Queue()
+        resultqueue = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=summing_worker, args=(initializer, function, config, jobqueue, resultqueue, self.config.worker_sum_size * 2**20, directory)) for i in range(self.config.ncores)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        try:
+            for job in jobs:
+                jobqueue.put(job)
+            for worker in workers:
+                jobqueue.put(None)
+
+            running = len(workers)
+            while running:
+                try:
+                    kind, value = resultqueue.get(timeout=1)
+                except queue.Empty:
+                    if any(worker.exitcode not in (None, 0) for worker in workers):
+                        raise errors.SubprocessError('a worker process died unexpectedly')
+                    continue
+                if kind == 'error':
+                    raise errors.SubprocessError('worker process failed:\n{0}'.format(value))
+                elif kind == 'done':
+                    running -= 1
+                else:
+                    yield value
+            for worker in workers:
+                worker.join()
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
 
     def sum(self, results):
-        return space.chunked_sum(self.send(results))
+        return self.sum_verses(itertools.chain(self.resumed, self.send(self.record(results))))
 
     def run_specific_task(self, command):
         if command:
@@ -182,23 +445,146 @@ class Local(ReentrantBase):
         config.dispatcher.job = job
         return config, ()
 
+    def prepare_worker_config(self):
+        config = self.main.clone_config()
+        config.dispatcher.destination.set_memory()
+        config.dispatcher.action = 'job'
+        return config
+
+class MappedSpace(object):
+    """Picklable stand-in for a Space whose arrays are passed through memory mapped scratch
+    files in 'directory' instead of being pickled, see Local option transport."""
+
+    def __init__(self, sp, directory):
+        self.axes = sp.axes
+        self.config = sp.config
+        self.metadata = sp.metadata
+        self.filenames = []
+        for array in (sp.photons, sp.contributions):
+            fd, filename = tempfile.mkstemp(prefix='binoculars-', suffix='.npy', dir=directory)
+            os.close(fd)
+            self.filenames.append(filename)
+            mapped = numpy.lib.format.open_memmap(filename, 'w+', array.dtype, array.shape)
+            mapped[...] = array
+            mapped.flush()
+            del mapped
+
+    def get(self):
+        """Returns the Space, backed by the scratch files. These are unlinked right away, the
+        mapping keeps the data available until the arrays are released."""
+        photons, contributions = (numpy.lib.format.open_memmap(filename, 'r+') for filename in self.filenames)
+        for filename in self.filenames:
+            os.remove(filename)
+        sp = space.Space(self.axes, self.config, self.metadata, photons.dtype, contributions.dtype)
+        sp.photons = photons
+        sp.contributions = contributions
+        return sp
+
+
+def export_verse(verse, directory):
+    exported = space.Multiverse(MappedSpace(sp, directory) if isinstance(sp, space.Space) else sp for sp in verse.spaces)
+    exported.timings = getattr(verse, 'timings', [])
+    return exported
+
+
+def import_verse(verse):
+    if not any(isinstance(sp, MappedSpace) for sp in verse.spaces):
+        return verse
+    imported = space.Multiverse(sp.get() if isinstance(sp, MappedSpace) else sp for sp in verse.spaces)
+    imported.timings = getattr(verse, 'timings', [])
+    return imported
+
+
+def mapped_job(function, directory, job):
+    return export_verse(function(job), directory)
+
+
+def summing_worker(initializer, function, config, jobs, results, maxsize, directory=None):
+    """Worker process of Local with worker_sum: processes jobs until it receives None, and
+    sends the sum of their results when it exceeds 'maxsize' bytes and after the last job.
+    With a 'directory' the sums are sent as MappedSpace. The timings of the jobs go along with the sums."""
+    def send(accumulators):
+        verse = space.Multiverse(accumulator.get() for accumulator in accumulators)
+        verse.timings = timings[:]
+        del timings[:]
+        return verse if directory is None else export_verse(verse, directory)
+
+    try:
+        initializer(config)
+        accumulators = []
+        timings = []
+        for job in iter(jobs.get, None):
+            verse = function(job)
+            timings.extend(getattr(verse, 'timings', ()))
+            if not accumulators:
+                accumulators = [space.Accumulator() for sp in verse.spaces]
+            for accumulator, sp in zip(accumulators, verse.spaces):
+                accumulator.add_space(sp)
+            if sum(accumulator.space.memory_size for accumulator in accumulators if accumulator.space is not None) > maxsize:
+                results.put(('result', send(accumulators)))
+                accumulators = []
+        if accumulators:
+            results.put(('result', send(accumulators)))
+        results.put(('done', None))
+    except Exception:
+        results.put(('error', traceback.format_exc()))
+
 # Dispatch many worker processes on an Oar cluster.
 
 
 class Oar(ReentrantBase):
     ### OFFICIAL API
     actions = 'user', 'process'
+    sums_results = False  # the OAR jobs sum the intermediates, see resume()
 
     def parse_config(self, config):
         super(Oar, self).parse_config(config)
         self.config.tmpdir = config.pop('tmpdir', os.getcwd())  # Optional, current directory by default
         self.config.oarsub_options = config.pop('oarsub_options', 'walltime=0:15')  # optionally, tweak oarsub parameters
-        self.config.executable = config.pop('executable', ' '.join(util.get_python_executable()))  # optionally, override default location of python and/or BINoculars installation
+        self.config.executable = config.pop('executable', None) or ' '.join(util.get_python_executable())  # optionally, override default location of python and/or BINoculars installation
+        self.config.poll_interval = float(config.pop('poll_interval', 30))  # Optional, seconds between the queries of the status of all jobs with a single oarstat, 30 by default. Finished jobs are noticed within a second from the files they write
+        self.config.unknown_timeout = float(config.pop('unknown_timeout', 600))  # Optional, seconds after which a job that oarstat does not report and that did not write its result is given up as lost, 600 by default
+
+    def resume(self, jobs):
+        """Reuses the intermediate results of an interrupted run with the same command and
+        configuration in tmpdir, only the jobs that are not in them are submitted again."""
+        self.resumed = []
+        done = []
+        candidates = []
+        for fn in sorted(glob.glob(os.path.join(self.config.tmpdir, 'binoculars-*-jobout.hdf5'))):
+            config, stored = stored_jobs(fn)
+            if config is not None and same_run(config, self.main.config):
+                candidates.append((fn, stored))
+        # the inputs of a summation job exist for a moment next to its result, the largest results win
+        keys = set()
+        for fn, stored in sorted(candidates, key=lambda candidate: len(candidate[1]), reverse=True):
+            stored_keys = set(util.job_key(util.job_fields(fields)) for fields in stored)
+            if stored_keys & keys:
+                continue
+            keys |= stored_keys
+            self.resumed.append(fn)
+            done.extend(stored)
+        if self.resumed:
+            util.status('{0}: resuming from {1} intermediate results'.format(time.ctime(), len(self.resumed)), eol=True)
+        return self.main.input.missing_jobs(jobs, done)
 
     def process_jobs(self, jobs):
         self.configfiles = []
-        self.intermediates = []
-        clusters = util.cluster_jobs2(jobs, self.main.input.config.target_weight)
+        self.intermediates = list(self.resumed)
+        self.markers = {}  # OAR job id: the file that the job writes when it is done
+        self.failed = []  # configuration files of the jobs that oarsub did not accept, their results are missing
+        self.orphans = []  # intermediates of which the summation job was not accepted, summed by the final job instead
+        summations = []  # jobs that sum intermediates, submitted by the reduction tree
+        tree = util.ReductionTree(self.config.fan_in, lambda group: self.submit_sum(group, summations))
+        for interm in self.resumed:
+            tree.add(interm)
+        if self.main.costmodel is not None and self.main.costmodel.unitcost is not None and self.config.target_time:
+            # split the jobs that would take longer than target_time and cluster the rest up to target_time
+            cost = self.get_cost()
+            jobs = itertools.chain.from_iterable(self.main.input.split_job(job, int(numpy.ceil(cost(job) / self.config.target_time))) for job in jobs)
+            clusters = util.cluster_jobs2(jobs, self.config.target_time, cost)
+        else:
+            clusters = util.cluster_jobs2(jobs, self.main.input.config.target_weight)
         for jobscluster in clusters:
             uniq = util.uniqid()
             jobconfig = os.path.join(self.config.tmpdir, 'binoculars-{0}-jobcfg.zpi'.format(uniq))
@@ -209,28 +595,75 @@ class Oar(ReentrantBase):
             self.intermediates.append(interm)
             config.dispatcher.destination.set_tmp_filename(interm)
             config.dispatcher.sum = ()
+            config.dispatcher.marker = None  # the intermediate itself appears atomically
 
             config.dispatcher.action = 'process'
             config.dispatcher.jobs = jobscluster
             util.zpi_save(config, jobconfig)
-            yield self.oarsub(jobconfig)
+            jobid = self.oarsub(jobconfig)
+            if not jobid:
+                self.failed.append(jobconfig)
+                self.intermediates.remove(interm)
+                continue
+            self.markers[jobid] = interm
+            yield jobid
+            tree.add(interm)
+            while summations:
+                yield summations.pop(0)
 
         #if all jobs are sent to the cluster send the process that sums all other jobs
         uniq = util.uniqid()
         jobconfig = os.path.join(self.config.tmpdir, 'binoculars-{0}-jobcfg.zpi'.format(uniq))
         self.configfiles.append(jobconfig)
+        marker = os.path.join(self.config.tmpdir, 'binoculars-{0}-done'.format(uniq))
+        config = self.main.clone_config()
+        config.dispatcher.sum = [interm for interm in tree.remaining() if interm is not None] + self.orphans
+        config.dispatcher.marker = marker
+        config.dispatcher.action = 'process'
+        config.dispatcher.jobs = ()
+        util.zpi_save(config, jobconfig)
+        jobid = self.oarsub(jobconfig)
+        if not jobid:
+            self.failed.append(jobconfig)
+            return
+        self.markers[jobid] = marker
+        yield jobid
+
+    def submit_sum(self, intermediates, jobids):
+        """Submits a job that sums 'intermediates' into a new intermediate as soon as they
+        exist, appends its OAR job id to 'jobids' and returns the filename of its result.
+        When oarsub fails the intermediates are left to the final job and None is returned."""
+        intermediates = [interm for interm in intermediates if interm is not None]
+        uniq = util.uniqid()
+        jobconfig = os.path.join(self.config.tmpdir, 'binoculars-{0}-jobcfg.zpi'.format(uniq))
+        self.configfiles.append(jobconfig)
+        interm = os.path.join(self.config.tmpdir, 'binoculars-{0}-jobout.hdf5'.format(uniq))
+        self.intermediates.append(interm)
+
         config = self.main.clone_config()
-        config.dispatcher.sum = self.intermediates
+        config.dispatcher.destination.set_tmp_filename(interm)
+        config.dispatcher.sum = intermediates
+        config.dispatcher.marker = None
         config.dispatcher.action = 'process'
         config.dispatcher.jobs = ()
         util.zpi_save(config, jobconfig)
-        yield self.oarsub(jobconfig)
+        jobid = self.oarsub(jobconfig)
+        if not jobid:
+            util.status('{0}: oarsub did not accept the summation of {1} intermediate results, the final job sums them instead'.format(time.ctime(), len(intermediates)), eol=True)
+            self.intermediates.remove(interm)
+            self.orphans.extend(intermediates)
+            return None
+        self.markers[jobid] = interm
+        jobids.append(jobid)
+        return interm
 
     def sum(self, results):
         jobs = list(results)
         jobscopy = jobs[:]
         self.oarwait(jobs)
         self.oar_cleanup(jobscopy)
+        if self.failed:
+            raise errors.SubprocessError('oarsub did not accept {0} job(s), their results are missing from the output. Their configuration is kept in: {1}'.format(len(self.failed), ', '.join(self.failed)))
         return True
 
     def run_specific_task(self, command):
@@ -239,15 +672,19 @@ class Oar(ReentrantBase):
 
         jobs = sum = space.EmptyVerse()
         if self.config.jobs:
-            jobs = space.verse_sum(self.send(self.main.process_job(job) for job in self.config.jobs))
+            jobs = space.verse_sum(self.send(self.record(self.main.process_job(job) for job in self.config.jobs)))
         if self.config.sum:
-            sum = space.chunked_sum(space.Multiverse.fromfile(src) for src in util.yield_when_exists(self.config.sum))
+            sum = space.chunked_sum((space.Multiverse.fromfile(src) for src in util.yield_when_exists(self.config.sum, delay=1)), nthreads=self.config.sum_threads or None)
         self.config.destination.store(jobs + sum)
+        for src in self.config.sum:  # kept until the output is stored, for resuming a run that fails
+            os.remove(src)
+        if self.config.marker:
+            open(self.config.marker, 'w').close()
 
     ### calling OAR
     @staticmethod
     def subprocess_run(*command):
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
         output, unused_err = process.communicate()
         retcode = process.poll()
         return retcode, output
@@ -264,57 +701,74 @@ class Oar(ReentrantBase):
                     return jobid.strip()
         return False
 
-    def oarstat(self, jobid):
-        # % oarstat -s -j 5651374
+    def oarstat(self, jobids):
+        # % oarstat -s -j 5651374 -j 5651375
         # 5651374: Running
-        # % oarstat -s -j 5651374
-        # 5651374: Finishing
-        ret, output = self.subprocess_run('oarstat', '-s', '-j', str(jobid))
+        # 5651375: Finishing
+        """Returns the states of the OAR jobs 'jobids' as a dict, queried with a single oarstat.
+        Jobs that oarstat does not report are 'Unknown'."""
+        states = dict((str(jobid), 'Unknown') for jobid in jobids)
+        if not states:
+            return states
+        ret, output = self.subprocess_run('oarstat', '-s', *itertools.chain.from_iterable(('-j', jobid) for jobid in states))
         if ret == 0:
-            for n in output.split('\n'):
-                if n.startswith(str(jobid)):
-                    job, status = n.split(':')
-            return status.strip()
-        else:
-            return 'Unknown'
+            for line in output.split('\n'):
+                jobid, sep, state = line.partition(':')
+                if sep and jobid.strip() in states:
+                    states[jobid.strip()] = state.strip()
+        return states
 
     def oarwait(self, jobs, remaining=0):
-        linelen = 0
+        """Waits until at most 'remaining' of the OAR jobs 'jobs' are left, removing the
+        finished ones from 'jobs'. A job is done as soon as its marker file (see process_jobs())
+        appears, which is checked every second. The others are queried with oarstat every
+        poll_interval seconds, to notice jobs that ended without writing their marker. A job
+        that oarstat does not report for unknown_timeout seconds raises a SubprocessError."""
         if len(jobs) > remaining:
             util.status('{0}: getting status of {1} jobs...'.format(time.ctime(), len(jobs)))
         else:
             return
 
-        delay = util.loop_delayer(30)
+        markers = getattr(self, 'markers', {})
+        delay = util.loop_delayer(1)
+        polltime = 0
+        states = {}
+        unknown = {}  # job id: time since which oarstat does not report it
         while len(jobs) > remaining:
             next(delay)
-            i = 0
-            R = 0
-            W = 0
-            U = 0
-
-            while i < len(jobs):
-                state = self.oarstat(jobs[i])
-                if state == 'Running':
-                    R += 1
-                elif state in ('Waiting', 'toLaunch', 'Launching'):
-                    W += 1
-                elif state == 'Unknown':
-                    U += 1
-                else:  # assume state == 'Finishing' or 'Terminated' but don't wait on something unknown
-                    del jobs[i]
-                    i -= 1  # otherwise it skips a job
-                i += 1
-            util.status('{0}: {1} jobs to go. {2} waiting, {3} running, {4} unknown.'.format(time.ctime(), len(jobs), W, R, U))
+            jobs[:] = [jobid for jobid in jobs if not (jobid in markers and os.path.exists(markers[jobid]))]
+            if time.time() - polltime >= self.config.poll_interval:
+                polltime = time.time()
+                states = self.oarstat(jobs)
+                # assume that states other than these are 'Finishing' or 'Terminated' but don't wait on something unknown
+                jobs[:] = [jobid for jobid in jobs if states[str(jobid)] in ('Running', 'Waiting', 'toLaunch', 'Launching', 'Unknown')]
+                for jobid in jobs:
+                    if states[str(jobid)] == 'Unknown':
+                        unknown.setdefault(jobid, polltime)
+                    else:
+                        unknown.pop(jobid, None)
+                lost = [jobid for jobid in jobs if jobid in unknown and polltime - unknown[jobid] >= self.config.unknown_timeout]
+                if lost:
+                    raise errors.SubprocessError('OAR job(s) {0} ended without writing their result, oarstat has not reported them for {1} seconds'.format(', '.join(str(jobid) for jobid in lost), self.config.unknown_timeout))
+            counts = [sum(1 for jobid in jobs if states.get(str(jobid)) in group) for group in (('Waiting', 'toLaunch', 'Launching'), ('Running', ), ('Unknown', ))]
+            util.status('{0}: {1} jobs to go. {2} waiting, {3} running, {4} unknown.'.format(time.ctime(), len(jobs), *counts))
         util.statuseol()
 
     def oar_cleanup(self, jobs):
-        # cleanup:
-        for f in itertools.chain(self.configfiles, self.intermediates):
+        # cleanup, the intermediates are removed by the job that sums them
+        for f in self.configfiles:
+            if f in self.failed:  # kept for inspection
+                continue
             try:
                 os.remove(f)
             except Exception as e:
                 print("unable to remove {0}: {1}".format(f, e))
+        for f in set(self.markers.values()) - set(self.intermediates):
+            if os.path.exists(f):
+                os.remove(f)
+        kept = [f for f in self.intermediates if os.path.exists(f)]
+        if kept:
+            print('{0} intermediate result(s) kept in {1}, rerun with --resume to reuse them'.format(len(kept), self.config.tmpdir))
 
         errorfn = []
 
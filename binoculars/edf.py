@@ -0,0 +1,149 @@
+"""Reader for ESRF data format (EDF) images.
+
+An EDF file is a sequence of frames, every frame an ASCII header of the form
+'{\\n key = value ;\\n ... }\\n', padded to a multiple of 512 bytes, followed by
+a binary data block of 'Size' bytes. The file is scanned once for the frame
+offsets; uncompressed frames are returned as read-only views on a memory map
+of the file, so no data is copied until it is used in a computation."""
+
+import gzip
+import re
+import zlib
+import numpy
+
+from . import errors
+
+
+BLOCKSIZE = 512
+
+DATATYPES = {
+    'unsignedbyte': 'u1', 'signedbyte': 'i1',
+    'unsignedshort': 'u2', 'signedshort': 'i2',
+    'unsignedinteger': 'u4', 'signedinteger': 'i4',
+    'unsignedlong': 'u4', 'signedlong': 'i4',
+    'unsigned64': 'u8', 'signed64': 'i8',
+    'floatvalue': 'f4', 'float': 'f4', 'realvalue': 'f4',
+    'doublevalue': 'f8', 'double': 'f8',
+}
+
+BYTEORDERS = {'lowbytefirst': '<', 'highbytefirst': '>'}
+
+COMPRESSIONS = {
+    'none': None, 'nocompression': None,
+    'gzip': 'gzip', 'gzipcompression': 'gzip',
+    'z': 'zlib', 'zlib': 'zlib', 'zcompression': 'zlib',
+}
+
+_size = re.compile(br'(?:^|[\s;{])Size\s*=\s*(\d+)\s*;')
+_field = re.compile(r'([^=;\s][^=;]*?)\s*=\s*([^;]*?)\s*;')
+
+
+def parse_header(text):
+    """Returns the 'key = value ;' fields of an EDF header as a dict of strings."""
+    return dict(_field.findall(text))
+
+
+class EdfFile(object):
+    """Random access to the frames of an EDF file. The frame methods follow the
+    names of PyMca's EdfFile, so this is a drop-in replacement for reading."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        if filename.endswith('.gz'):
+            with gzip.open(filename, 'rb') as fp:
+                self._buffer = numpy.frombuffer(fp.read(), dtype=numpy.uint8)
+        else:
+            try:
+                self._buffer = numpy.memmap(filename, dtype=numpy.uint8, mode='r')
+            except ValueError:  # numpy refuses to map an empty file
+                self._buffer = numpy.zeros(0, dtype=numpy.uint8)
+        self._frames = list(self._scan())
+        self._headers = [None] * len(self._frames)
+        self._decoded = None, None
+
+    def _scan(self):
+        """Yields (header start, header end, data offset, data size) for every frame."""
+        buf = self._buffer
+        offset = 0
+        while offset < buf.size:
+            block = buf[offset:offset + BLOCKSIZE].tobytes()
+            start = block.find(b'{')
+            if start == -1 or block[:start].strip():
+                if block.strip(b'\x00 \r\n'):
+                    raise errors.FileError('corrupt EDF file {0}: no header at byte {1}'.format(self.filename, offset))
+                return  # trailing padding
+            end = block.find(b'}')
+            while end == -1:
+                if offset + len(block) >= buf.size:
+                    raise errors.FileError('corrupt EDF file {0}: unterminated header at byte {1}'.format(self.filename, offset))
+                block += buf[offset + len(block):offset + len(block) + BLOCKSIZE].tobytes()
+                end = block.find(b'}')
+            data = end + 1
+            if block[data:data + 2] == b'\r\n':
+                data += 2
+            elif block[data:data + 1] == b'\n':
+                data += 1
+
+            match = _size.search(block[start:end])
+            if match:
+                size = int(match.group(1))
+            else:
+                size = self._blocksize(parse_header(block[start + 1:end].decode('latin-1')))
+
+            if offset + data + size > buf.size:
+                raise errors.FileError('truncated EDF file {0}: frame at byte {1} needs {2} bytes of data'.format(self.filename, offset, size))
+            yield offset + start + 1, offset + end, offset + data, size
+            offset += data + size
+
+    def _blocksize(self, header):
+        dtype, shape = self._layout(header)
+        return dtype.itemsize * int(numpy.prod(shape))
+
+    def _layout(self, header):
+        """Returns the numpy dtype and the (C-order) shape described by a frame header."""
+        try:
+            datatype = DATATYPES[header['DataType'].lower()]
+        except KeyError:
+            raise errors.FileError('unsupported or missing DataType {0!r} in EDF file {1}'.format(header.get('DataType'), self.filename))
+        byteorder = BYTEORDERS.get(header.get('ByteOrder', '').lower(), '<')
+        dims = []
+        while 'Dim_{0}'.format(len(dims) + 1) in header:
+            dims.append(int(header['Dim_{0}'.format(len(dims) + 1)]))
+        if not dims:
+            raise errors.FileError('missing Dim_1 in EDF file {0}'.format(self.filename))
+        return numpy.dtype(byteorder + datatype), tuple(reversed(dims))
+
+    def GetNumImages(self):
+        return len(self._frames)
+
+    def GetHeader(self, index):
+        """Returns the header fields of frame 'index' as a dict, parsed on first access."""
+        if self._headers[index] is None:
+            start, end, offset, size = self._frames[index]
+            self._headers[index] = parse_header(self._buffer[start:end].tobytes().decode('latin-1'))
+        return self._headers[index]
+
+    def GetData(self, index):
+        """Returns frame 'index' as a read-only array. Uncompressed frames are views on
+        the file mapping; a compressed frame is decoded once and kept until the next one is requested."""
+        header = self.GetHeader(index)
+        start, end, offset, size = self._frames[index]
+        dtype, shape = self._layout(header)
+        compression = header.get('Compression', 'None').lower()
+        if compression not in COMPRESSIONS:
+            raise errors.FileError('unsupported compression {0!r} in EDF file {1}'.format(header['Compression'], self.filename))
+        compression = COMPRESSIONS[compression]
+
+        if compression is None:
+            nbytes = dtype.itemsize * int(numpy.prod(shape))
+            if nbytes > size:
+                raise errors.FileError('frame {0} of EDF file {1} holds {2} bytes, expected {3}'.format(index, self.filename, size, nbytes))
+            data = self._buffer[offset:offset + nbytes]
+        else:
+            cached, data = self._decoded
+            if cached != index:
+                raw = self._buffer[offset:offset + size].tobytes()
+                wbits = zlib.MAX_WBITS | 16 if compression == 'gzip' else zlib.MAX_WBITS
+                data = numpy.frombuffer(zlib.decompress(raw, wbits), dtype=numpy.uint8)
+                self._decoded = index, data
+        return data.view(dtype).reshape(shape)
@@ -1,6 +1,9 @@
 import os
 import sys
+import time
 import argparse
+import itertools
+import numpy
 
 from . import space, backend, util, errors
 
@@ -8,6 +11,7 @@ from . import space, backend, util, errors
 def parse_args(args):
     parser = argparse.ArgumentParser(prog='binoculars process')
     parser.add_argument('-c', metavar='SECTION:OPTION=VALUE', action='append', type=parse_commandline_config_option, default=[], help='additional configuration option in the form section:option=value')
+    parser.add_argument('--resume', action='store_true', help='continue an interrupted run from its checkpoint or intermediate results, see the checkpoint option of the dispatcher')
     parser.add_argument('configfile', help='configuration file')
     parser.add_argument('command', nargs='*', default=[])
     return parser.parse_args(args)
@@ -28,6 +32,19 @@ def multiprocessing_main(xxx_todo_changeme):  # note the double parenthesis for
     return config.dispatcher.destination.retrieve()
 
 
+_worker = None
+
+
+def multiprocessing_init(config):
+    """Pool initializer, builds the pipeline of a worker process once for all its jobs."""
+    global _worker
+    _worker = Worker(config)
+
+
+def multiprocessing_job(job):
+    return _worker.process_job(job)
+
+
 class Main(object):
     def __init__(self, config, command):
         if isinstance(config, util.ConfigSectionGroup):
@@ -44,11 +61,17 @@ class Main(object):
         self.dispatcher = backend.get_dispatcher(config.dispatcher, self, default='local')
         self.projection = backend.get_projection(config.projection)
         self.input = backend.get_input(config.input)
+        self.costmodel = self.get_costmodel()
+        self.cache = self.get_cache()
+        if self.costmodel is not None and self.dispatcher.config.target_time:
+            weight = self.costmodel.target_weight(self.dispatcher.config.target_time)
+            if weight is not None:
+                self.input.config.target_weight = weight
 
         self.dispatcher.config.destination.set_final_options(self.input.get_destination_options(command))
         if 'limits' in self.config.projection:
             self.dispatcher.config.destination.set_limits(self.config.projection['limits'])
-        if command:
+        if command or self.dispatcher.config.destination.append:  # appending compares the configuration with that of the output
             self.dispatcher.config.destination.set_config(spaceconf)
         self.run(command)
 
@@ -66,7 +89,8 @@ class Main(object):
                 configobj = util.zpi_load(fp)
         if not configobj:
             # reopen args.configfile as text
-            configobj = util.ConfigFile.fromtxtfile(args.configfile, command=args.command, overrides=args.c)
+            overrides = args.c + [('dispatcher', 'resume', 'true')] if args.resume else args.c
+            configobj = util.ConfigFile.fromtxtfile(args.configfile, command=args.command, overrides=overrides)
         return cls(configobj, args.command)
 
     @classmethod
@@ -75,35 +99,128 @@ class Main(object):
         return cls(config, command)
 
     def run(self, command):
+        try:
+            self.run_jobs(command)
+        finally:
+            if self.costmodel is not None:
+                self.costmodel.save()
+
+    def run_jobs(self, command):
         if self.dispatcher.has_specific_task():
             self.dispatcher.run_specific_task(command)
         else:
             jobs = self.input.generate_jobs(command)
+            destination = self.dispatcher.config.destination
+            if destination.append:
+                jobs = self.input.missing_jobs(jobs, destination.stored_jobs())
+            if self.dispatcher.config.resume:
+                jobs = self.dispatcher.resume(jobs)
             tokens = self.dispatcher.process_jobs(jobs)
             self.result = self.dispatcher.sum(tokens)
             if self.result is True:
                 pass
+            elif destination.append and isinstance(self.result, space.EmptyVerse):
+                sys.stderr.write('nothing to append, all jobs are in the output already\n')
             elif isinstance(self.result, space.EmptySpace):
                 sys.stderr.write('error: output is an empty dataset\n')
             else:
-                self.dispatcher.config.destination.store(self.result)
+                destination.store(self.result)
+                self.dispatcher.discard_checkpoint()
 
     def process_job(self, job):
-        def generator():
-            res = self.projection.config.resolution
-            labels = self.projection.get_axis_labels()
-            for intensity, weights, params in self.input.process_job(job):
-                coords = self.projection.project(*params)
-                if self.projection.config.limits == None:
-                    yield space.Multiverse((space.Space.from_image(res, labels, coords, intensity, weights=weights), ))
-                else:
-                    yield space.Multiverse(space.Space.from_image(res, labels, coords, intensity, weights=weights, limits=limits) for limits in self.projection.config.limits)
-        jobverse = space.chunked_sum(generator(), chunksize=25)
+        if self.cache is None:
+            return self.compute_job(job)
+        files = self.input.get_job_files(job)
+        jobverse = self.cache.get(job, files)
+        if jobverse is None:
+            jobverse = self.compute_job(job)
+            self.cache.put(job, files, jobverse)
+        return jobverse
+
+    def compute_job(self, job):
+        starttime = time.time()
+        res = self.projection.config.resolution
+        labels = self.projection.get_axis_labels()
+        if self.projection.config.limits == None:
+            limitsets = [None]
+        else:
+            limitsets = self.projection.config.limits
+        bounds = None
+        if self.dispatcher.config.estimate_bounds:
+            bounds = self.get_bounds(job)
+        if bounds is None:
+            bounds = [None] * len(limitsets)
+        accumulators = [space.Accumulator(res, labels, limits=limits, axes=axes, sparse=self.projection.config.sparse, photons_dtype=self.projection.config.photons_dtype, contributions_dtype=self.projection.config.contributions_dtype) for limits, axes in zip(limitsets, bounds)]
+        for intensity, weights, params in self.input.prefetch_job(job):
+            coords = self.projection.project(*params)
+            for accumulator in accumulators:
+                accumulator.add_image(coords, intensity, weights)
+        jobverse = space.Multiverse(accumulator.get() for accumulator in accumulators)
         for sp in jobverse.spaces:
-            if isinstance(sp, space.Space):
+            if isinstance(sp, (space.Space, space.SparseSpace)):
                 sp.metadata.add_dataset(self.input.metadata)
+        jobverse.timings = [(job, time.time() - starttime)]  # recorded in the cost model by the dispatcher, see DispatcherBase.record()
         return jobverse
 
+    def get_cache(self):
+        """Returns the backend.JobCache for this input and projection configuration, or None if the dispatcher has no cache."""
+        if not self.dispatcher.config.cache:
+            return None
+        return backend.JobCache(self.dispatcher.config.cache, self.dispatcher.config.cache_size * 2**20, self.get_context())
+
+    def get_context(self):
+        """Returns a string describing the input and projection configuration, leaving out the
+        options that only affect how jobs are generated and read, not their results."""
+        ignored = 'target_weight', 'prefetch', 'prefetch_size'
+        return repr([sorted((key, value) for (key, value) in section.__dict__.items() if key not in ignored) for section in (self.input.config, self.projection.config)])
+
+    def get_costmodel(self):
+        """Returns the backend.CostModel of this input and projection and their configuration (ROI,
+        resolution, detector...), or None if the dispatcher has no cost_file."""
+        if not self.dispatcher.config.cost_file:
+            return None
+        key = '{0.__module__}.{0.__name__}:{1.__module__}.{1.__name__}'.format(self.input.__class__, self.projection.__class__)
+        nlimits = 1 if self.projection.config.limits is None else len(self.projection.config.limits)
+        return backend.CostModel(self.dispatcher.config.cost_file, key, nlimits, self.get_context())
+
+    def get_bounds(self, job):
+        """Estimate the Axes of the output of 'job' from a projection of the detector edges only.
+
+        Returns a list with Axes per limit set (None if no data is expected
+        within the limits), or None if the input or the projection does not support this."""
+        if not self.projection.edge_bounds:
+            return None
+        edges = self.input.get_edge_params(job)
+        if edges is None:
+            return None
+
+        labels = self.projection.get_axis_labels()
+        lower = [numpy.inf] * len(labels)
+        upper = [-numpy.inf] * len(labels)
+        for params in itertools.chain.from_iterable(edges):
+            for i, coord in enumerate(self.projection.project(*params)):
+                coord = numpy.asarray(coord)
+                coord = coord[numpy.isfinite(coord)]
+                if coord.size:
+                    lower[i] = min(lower[i], coord.min())
+                    upper[i] = max(upper[i], coord.max())
+        if not all(numpy.isfinite(lower)) or not all(numpy.isfinite(upper)):
+            return None
+
+        if self.projection.config.limits == None:
+            limitsets = [[slice(None)] * len(labels)]
+        else:
+            limitsets = self.projection.config.limits
+        bounds = []
+        for limits in limitsets:
+            mins = tuple(lo if lim.start is None else max(lo, lim.start) for lo, lim in zip(lower, limits))
+            maxs = tuple(up if lim.stop is None else min(up, lim.stop) for up, lim in zip(upper, limits))
+            if any(mi > ma for mi, ma in zip(mins, maxs)):
+                bounds.append(None)
+            else:
+                bounds.append(space.Axes(space.Axis(mi, ma, res, label) for mi, ma, res, label in zip(mins, maxs, self.projection.config.resolution, labels)))
+        return bounds
+
     def clone_config(self):
         config = util.ConfigSectionGroup()
         config.configfile = self.config
@@ -115,6 +232,25 @@ class Main(object):
     def get_reentrant(self):
         return multiprocessing_main
 
+    def get_worker(self):
+        return multiprocessing_init, multiprocessing_job
+
+
+class Worker(Main):  # sets up the dispatcher, projection and input once, then processes any number of jobs
+    def __init__(self, config):
+        if isinstance(config, util.ConfigSectionGroup):
+            self.config = config.configfile.copy()
+        elif isinstance(config, util.ConfigFile):
+            self.config = config.copy()
+        else:
+            raise ValueError('Configfile is the wrong type')
+
+        self.dispatcher = backend.get_dispatcher(config.dispatcher, self, default='local')
+        self.projection = backend.get_projection(config.projection)
+        self.input = backend.get_input(config.input)
+        self.costmodel = None  # the timings of the jobs go back with their results to the dispatcher of the main process
+        self.cache = self.get_cache()
+
 
 class Split(Main):  # completely ignores the dispatcher, just yields a space per image
     def __init__(self, config, command):
@@ -133,7 +269,7 @@ class Split(Main):  # completely ignores the dispatcher, just yields a space per
     def process_job(self, job):
         res = self.projection.config.resolution
         labels = self.projection.get_axis_labels()
-        for intensity, weights, params in self.input.process_job(job):
+        for intensity, weights, params in self.input.prefetch_job(job):
             coords = self.projection.project(*params)
             if self.projection.config.limits == None:
                 yield space.Space.from_image(res, labels, coords, intensity, weights=weights)
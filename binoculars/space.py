@@ -1,13 +1,23 @@
 from __future__ import unicode_literals
 
+import os
+import shutil
 import numbers
 import numpy
 import h5py
 import sys
+import tempfile
+import multiprocessing
+import multiprocessing.pool
 from itertools import chain
 
 from . import util, errors
 
+try:
+    import hdf5plugin  # registers additional HDF5 filters, such as LZ4
+except ImportError:
+    hdf5plugin = None
+
 #python3 support
 PY3 = sys.version_info > (3,)
 if PY3:
@@ -152,9 +162,11 @@ class Axis(object):
         return self.__class__(min, max, self.res, self.label)
 
     def rebin(self, factor):
-        # for integers the following relations hold: a // b == floor(a / b), -(-a // b) == ceil(a / b)
-        new = self.__class__(self.imin // factor, -(-self.imax // factor), factor*self.res, self.label)
-        return self.imin % factor, -self.imax % factor, new
+        # bin j of the new axis is centred on index j * factor and holds the indices within factor / 2 of it, for an even factor
+        # the two indices at exactly factor / 2 are shared with the neighbouring bins (see block_sum()); a // b == floor(a / b)
+        half = factor // 2
+        new = self.__class__(-((half - self.imin) // factor), (self.imax + half) // factor, factor*self.res, self.label)
+        return self.imin - (new.imin * factor - half), new.imax * factor + half - self.imax, new
 
     def __repr__(self):
         return '{0.__class__.__name__} {0.label} (min={0.min}, max={0.max}, res={0.res}, count={1})'.format(self, len(self))
@@ -206,8 +218,8 @@ class Axes(object):
 
     @property
     def memory_size(self):
-        # assuming double precision floats for photons, 32 bit integers for contributions
-        return (8+4) * self.npoints
+        # assuming the default double precision floats for photons and contributions
+        return (8+8) * self.npoints
 
     @classmethod
     def fromfile(cls, filename):
@@ -305,22 +317,22 @@ class EmptySpace(object):
         self.metadata = metadata
 
     def __add__(self, other):
-        if not isinstance(other, Space) and not isinstance(other, EmptySpace):
+        if not isinstance(other, (Space, SparseSpace, EmptySpace)):
             return NotImplemented
         return other
 
     def __radd__(self, other):
-        if not isinstance(other, Space) and not isinstance(other, EmptySpace):
+        if not isinstance(other, (Space, SparseSpace, EmptySpace)):
             return NotImplemented
         return other
 
     def __iadd__(self, other):
-        if not isinstance(other, Space) and not isinstance(other, EmptySpace):
+        if not isinstance(other, (Space, SparseSpace, EmptySpace)):
             return NotImplemented
         return other
 
-    def tofile(self, filename):
-        """Store EmptySpace in HDF5 file."""
+    def tofile(self, filename, layout='auto', compression='gzip', pyramid=0):
+        """Store EmptySpace in HDF5 file, layout, compression and pyramid are ignored."""
         with util.atomic_write(filename) as tmpname:
             with util.open_h5py(tmpname, 'w') as fp:
                 fp.attrs['type'] = 'Empty'
@@ -339,9 +351,19 @@ class Space(object):
         axes             Axes instances describing range and stepsizes of each of the dimensions
         photons          n-dimension numpy float array, total intensity per grid point
         contribitions    n-dimensional numpy integer array, number of original datapoints (pixels) per grid point
-        dimension        n"""
+        dimension        n
+
+    The storage types of photons and contributions default to double precision
+    floats and can be reduced with photons_dtype and contributions_dtype.
+    Additions that overflow the storage type, or store fractional or inexact
+    contributions, raise ValueError, see checked_cast().
 
-    def __init__(self, axes, config=None, metadata=None):
+    With tmpdir, photons and contributions are numpy.memmap arrays in
+    temporary files in that directory, for spaces that do not fit in memory.
+    Operations producing a Space of the same size (copy, addition, trim) keep
+    using tmpdir, projections and slices are returned in memory."""
+
+    def __init__(self, axes, config=None, metadata=None, photons_dtype=numpy.float64, contributions_dtype=numpy.float64, tmpdir=None):
         if not isinstance(axes, Axes):
             self.axes = Axes(axes)
         else:
@@ -349,9 +371,11 @@ class Space(object):
 
         self.config = config
         self.metadata = metadata
+        self.tmpdir = tmpdir
 
-        self.photons = numpy.zeros([len(ax) for ax in self.axes], order='C')
-        self.contributions = numpy.zeros(self.photons.shape, order='C')
+        shape = tuple(len(ax) for ax in self.axes)
+        self.photons = allocate(shape, photons_dtype, tmpdir)
+        self.contributions = allocate(shape, contributions_dtype, tmpdir)
 
     @property
     def dimension(self):
@@ -397,7 +421,7 @@ class Space(object):
 
     def copy(self):
         """Returns a copy of self. Numpy data is not shared, but the Axes object is."""
-        new = self.__class__(self.axes, self.config, self.metadata)
+        new = self.__class__(self.axes, self.config, self.metadata, self.photons.dtype, self.contributions.dtype, self.tmpdir)
         new.photons[:] = self.photons
         new.contributions[:] = self.contributions
         return new
@@ -489,12 +513,13 @@ class Space(object):
             new = self.copy()
             new.photons += other * self.contributions
             return new
-        if not isinstance(other, Space):
+        if not isinstance(other, (Space, SparseSpace)):
             return NotImplemented
         if not len(self.axes) == len(other.axes) or not all(a.is_compatible(b) for (a, b) in zip(self.axes, other.axes)):
             raise ValueError('cannot add spaces with different dimensionality or resolution')
 
-        new = self.__class__([a | b for (a, b) in zip(self.axes, other.axes)])
+        tmpdir = self.tmpdir or getattr(other, 'tmpdir', None)
+        new = self.__class__([a | b for (a, b) in zip(self.axes, other.axes)], photons_dtype=numpy.promote_types(self.photons.dtype, other.photons.dtype), contributions_dtype=numpy.promote_types(self.contributions.dtype, other.contributions.dtype), tmpdir=tmpdir)
         new += self
         new += other
         return new
@@ -503,7 +528,7 @@ class Space(object):
         if isinstance(other, numbers.Number):
             self.photons += other * self.contributions
             return self
-        if not isinstance(other, Space):
+        if not isinstance(other, (Space, SparseSpace)):
             return NotImplemented
         if not len(self.axes) == len(other.axes) or not all(a.is_compatible(b) for (a, b) in zip(self.axes, other.axes)):
             raise ValueError('cannot add spaces with different dimensionality or resolution')
@@ -511,9 +536,17 @@ class Space(object):
         if not all(other_ax in self_ax for (self_ax, other_ax) in zip(self.axes, other.axes)):
             return self.__add__(other)
 
+        if isinstance(other, SparseSpace):
+            # the flat indices are unique, so fancy indexing adds every point exactly once
+            index = numpy.unravel_index(reindex(other.indices, other.axes, self.axes), self.photons.shape)
+            checked_add(self.photons, index, other.photons)
+            checked_add(self.contributions, index, other.contributions, exact=True)
+            self.metadata += other.metadata
+            return self
+
         index = tuple(slice(self_ax.get_index(other_ax.min), self_ax.get_index(other_ax.min) + len(other_ax)) for (self_ax, other_ax) in zip(self.axes, other.axes))
-        self.photons[index] += other.photons
-        self.contributions[index] += other.contributions
+        checked_add(self.photons, index, other.photons)
+        checked_add(self.contributions, index, other.contributions, exact=True)
         self.metadata += other.metadata
         return self
 
@@ -538,26 +571,65 @@ class Space(object):
         """Reduce total size of Space by trimming zero-contribution data points on the boundaries."""
         mask = self.contributions > 0
         lims = (numpy.flatnonzero(sum_onto(mask, i)) for (i, ax) in enumerate(self.axes))
-        lims = tuple((i.min(), i.max()) for i in lims)
+        lims = tuple((int(i.min()), int(i.max())) for i in lims)
         self.axes = Axes(ax.rebound(min + ax.imin, max + ax.imin) for (ax, (min, max)) in zip(self.axes, lims))
         slices = tuple(slice(min, max+1) for (min, max) in lims)
-        self.photons = self.photons[slices].copy()
-        self.contributions = self.contributions[slices].copy()
+        photons = allocate(tuple(len(ax) for ax in self.axes), self.photons.dtype, self.tmpdir)
+        photons[...] = self.photons[slices]
+        contributions = allocate(photons.shape, self.contributions.dtype, self.tmpdir)
+        contributions[...] = self.contributions[slices]
+        self.photons, self.contributions = photons, contributions
+
+    def crop(self, axes):
+        """Returns a copy of the part of the Space within 'axes', which should be contained in the Axes of the Space."""
+        index = tuple(slice(ax.imin - spaceax.imin, ax.imax - spaceax.imin + 1) for (ax, spaceax) in zip(axes, self.axes))
+        newspace = self.__class__(axes, self.config, self.metadata)
+        newspace.photons = self.photons[index].copy()
+        newspace.contributions = self.contributions[index].copy()
+        return newspace
 
-    def rebin(self, resolutions):
-        """Change bin size.
+    def tosparse(self):
+        """Returns a SparseSpace holding the occupied grid points of the Space."""
+        return SparseSpace.fromdense(self)
 
-        resolution    n-tuple of floats, new resolution of each axis"""
-        if not len(resolutions) == len(self.axes):
+    def rebin(self, factors):
+        """Change bin size by summing blocks of grid points, see block_rebin().
+
+        factors    n-tuple of integers, number of grid points per new bin along each axis"""
+        if not len(factors) == len(self.axes):
             raise ValueError('cannot rebin space with different dimensionality')
-        if resolutions == tuple(ax.res for ax in self.axes):
+        if any(factor < 1 for factor in factors):
+            raise ValueError('rebin factors should be positive integers, got {0}'.format(factors))
+        if all(factor == 1 for factor in factors):
             return self
+        return block_rebin(self, tuple(int(factor) for factor in factors))
 
-        # gather data and transform
-        coords = self.get_grid()
-        intensity = self.get()
-        weights = self.contributions
-        return self.from_image(resolutions, labels, coords, intensity, weights)
+    def resample(self, resolutions):
+        """Change bin size to arbitrary resolutions. Photons and contributions of each old bin
+        are divided over the new bins in proportion to their overlap, see overlap_matrix().
+
+        resolutions    n-tuple of floats, new resolution of each axis"""
+        if not len(resolutions) == len(self.axes):
+            raise ValueError('cannot resample space with different dimensionality')
+        if tuple(resolutions) == tuple(ax.res for ax in self.axes):
+            return self
+
+        photons, contributions = self.photons, self.contributions
+        axes = []
+        for index, (ax, res) in enumerate(zip(self.axes, resolutions)):
+            if res == ax.res:
+                axes.append(ax)
+                continue
+            newax = Axis(int(numpy.floor((ax.imin - 0.5) * ax.res / res + 0.5)), int(numpy.ceil((ax.imax + 0.5) * ax.res / res - 0.5)), res, ax.label)
+            weights = overlap_matrix(ax, newax)
+            photons = numpy.rollaxis(numpy.tensordot(weights, photons, axes=(1, index)), 0, index + 1)
+            contributions = numpy.rollaxis(numpy.tensordot(weights, contributions, axes=(1, index)), 0, index + 1)
+            axes.append(newax)
+
+        newspace = self.__class__(axes, self.config, self.metadata, self.photons.dtype, numpy.promote_types(self.contributions.dtype, numpy.float32))
+        newspace.photons = checked_cast(photons, self.photons.dtype)
+        newspace.contributions = checked_cast(contributions, newspace.contributions.dtype)
+        return newspace
 
     def reorder(self, labels):
         """Change order of axes."""
@@ -569,18 +641,32 @@ class Space(object):
         new.contributions = numpy.transpose(self.contributions, axes=newindices)
         return new
 
-    def transform_coordinates(self, resolutions, labels, transformation):
-        # gather data and transform
-        coords = self.get_grid()
-        transcoords = transformation(*coords)
-        intensity = self.get()
-        weights = self.contributions
-
-        # get rid of invalid coords
-        valid = reduce(numpy.bitwise_and, chain((numpy.isfinite(t) for t in transcoords)), (weights > 0))
-        transcoords = tuple(t[valid] for t in transcoords)
-
-        return self.from_image(resolutions, labels, transcoords, intensity[valid], weights[valid])
+    def transform_coordinates(self, resolutions, labels, transformation, chunksize=2**20):
+        """Rebin the occupied grid points onto new axes.
+
+        resolutions     n-tuple of resolutions of the new axes
+        labels          n-tuple of labels of the new axes
+        transformation  callable mapping the coordinate arrays of the axes onto those of
+                        the new axes, see util.transformation_from_expressions()
+        chunksize       approximate number of grid points transformed at once, this bounds
+                        the memory used for coordinates and temporaries"""
+        accumulator = Accumulator(tuple(resolutions), tuple(labels))
+        step = max(1, chunksize // max(1, int(numpy.prod(self.photons.shape[1:]))))
+        for start in range(0, self.photons.shape[0], step):
+            contributions = self.contributions[start:start + step]
+            occupied = numpy.nonzero(contributions > 0)
+            if not occupied[0].size:
+                continue
+            offsets = (start, ) + (0, ) * (self.dimension - 1)
+            coords = tuple((index + offset + ax.imin) * ax.res for (index, offset, ax) in zip(occupied, offsets, self.axes))
+            transcoords = transformation(*coords)
+            weights = contributions[occupied]
+            intensity = self.photons[start:start + step][occupied] / weights
+
+            # get rid of invalid coords
+            valid = reduce(numpy.bitwise_and, (numpy.isfinite(t) for t in transcoords))
+            accumulator.add_image(tuple(t[valid] for t in transcoords), intensity[valid], weights[valid])
+        return accumulator.get()
 
     def process_image(self, coordinates, intensity, weights):
         """Load image data into Space.
@@ -593,18 +679,23 @@ class Space(object):
 
         intensity = numpy.nan_to_num(intensity).flatten()  # invalids can be handeled by setting weight to 0, this ensures the weights can do that
         weights = weights.flatten()
+        if intensity.size == 0:
+            return
 
-        indices = numpy.array(tuple(ax.get_index(coord) for (ax, coord) in zip(self.axes, coordinates)))
-        for i in range(0, len(self.axes)):
-            for j in range(i+1, len(self.axes)):
-                indices[i, :] *= len(self.axes[j])
-        indices = indices.sum(axis=0).astype(int).flatten()
+        # bin into the bounding box of the image only, this keeps the bincount
+        # small when the image covers a fraction of a large Space
+        indices = tuple(ax.get_index(coord).flatten() for (ax, coord) in zip(self.axes, coordinates))
+        lower = tuple(int(index.min()) for index in indices)
+        shape = tuple(int(index.max()) - low + 1 for (index, low) in zip(indices, lower))
+        flatindices = numpy.ravel_multi_index(tuple(index - low for (index, low) in zip(indices, lower)), shape)
+        size = numpy.prod(shape)
 
-        photons = numpy.bincount(indices, weights=intensity * weights)
-        contributions = numpy.bincount(indices, weights=weights)
+        photons = numpy.bincount(flatindices, weights=intensity * weights, minlength=size)
+        contributions = numpy.bincount(flatindices, weights=weights, minlength=size)
 
-        self.photons.ravel()[:photons.size] += photons
-        self.contributions.ravel()[:contributions.size] += contributions
+        box = tuple(slice(low, low + length) for (low, length) in zip(lower, shape))
+        checked_add(self.photons, box, photons.reshape(shape))
+        checked_add(self.contributions, box, contributions.reshape(shape), exact=True)
 
     @classmethod
     def from_image(cls, resolutions, labels, coordinates, intensity, weights, limits=None):
@@ -616,48 +707,71 @@ class Space(object):
         intensity     data intensity array"""
 
         if limits is not None:
-            invalid = numpy.zeros(intensity.shape).astype(numpy.bool)
-            for coord, sl in zip(coordinates, limits):
-                if sl.start is None and sl.stop is not None:
-                    invalid += coord > sl.stop
-                elif sl.start is not None and sl.stop is None:
-                    invalid += coord < sl.start
-                elif sl.start is not None and sl.stop is not None:
-                    invalid += numpy.bitwise_or(coord < sl.start, coord > sl.stop)
-
-            if numpy.all(invalid == True):
+            coordinates, intensity, weights = apply_limits(coordinates, intensity, weights, limits)
+            if intensity.size == 0:
                 return EmptySpace()
-            coordinates = tuple(coord[~invalid] for coord in coordinates)
-            intensity = intensity[~invalid]
-            weights = weights[~invalid]
 
         axes = tuple(Axis(coord.min(), coord.max(), res, label) for res, label, coord in zip(resolutions, labels, coordinates))
         newspace = cls(axes)
         newspace.process_image(coordinates, intensity, weights)
         return newspace
 
-    def tofile(self, filename):
-        """Store Space in HDF5 file."""
+    def tofile(self, filename, layout='auto', compression='gzip', pyramid=0):
+        """Store Space in HDF5 file.
+
+        filename     filename string or h5py.Group instance
+        layout       chunk shape of the datasets, see get_chunks()
+        compression  compression filter of the datasets, see get_filters()
+        pyramid      number of coarser levels to store as well, each rebinned by
+                     2 along every axis with respect to the previous one, see block_rebin()"""
+        filters = get_filters(compression)
         with util.atomic_write(filename) as tmpname:
             with util.open_h5py(tmpname, 'w') as fp:
                 fp.attrs['type'] = 'Space'
+                fp.attrs['layout'] = layout  # hint for readers, the chunk shape itself is stored with the datasets
+                fp.attrs['compression'] = compression
                 self.config.tofile(fp)
                 self.axes.tofile(fp)
                 self.metadata.tofile(fp)
-                fp.create_dataset('counts', self.photons.shape, dtype=self.photons.dtype, compression='gzip').write_direct(self.photons)
-                fp.create_dataset('contributions', self.contributions.shape, dtype=self.contributions.dtype, compression='gzip').write_direct(self.contributions)
+                fp.create_dataset('counts', self.photons.shape, dtype=self.photons.dtype, chunks=get_chunks(self.axes, layout, self.photons.dtype.itemsize), **filters).write_direct(self.photons)
+                fp.create_dataset('contributions', self.contributions.shape, dtype=self.contributions.dtype, chunks=get_chunks(self.axes, layout, self.contributions.dtype.itemsize), **filters).write_direct(self.contributions)
+                if pyramid:
+                    levels = fp.create_group('pyramid')
+                    level = self
+                    for index in range(1, pyramid + 1):
+                        if all(len(ax) == 1 for ax in level.axes):
+                            break
+                        level = block_rebin(level, (2, ) * level.dimension)
+                        level.config, level.metadata = None, None  # only stored once, at the top
+                        level.tofile(levels.create_group('level_{0}'.format(index)), layout, compression)
 
     @classmethod
-    def fromfile(cls, file, key=None):
+    def fromfile(cls, file, key=None, tmpdir=None, lazy=False, npoints=None, labels=None):
         """Load Space from HDF5 file.
 
         file      filename string or h5py.Group instance
-        key       sliced (subset) loading, should be an n-tuple of slice()s in data coordinates"""
+        key       sliced (subset) loading, should be an n-tuple of slice()s in data coordinates
+        tmpdir    load into memory mapped temporary files in this directory, see Space.__init__()
+        lazy      return a LazySpace that only reads the data when it is needed
+        npoints   load the coarsest pyramid level with at least this number of points, see pyramid_level()
+        labels    count the points of npoints along these axes only, e.g. the axes that will be plotted"""
+        if npoints is not None:
+            level = pyramid_level(file, key, npoints, labels)
+            if level is not None:
+                with util.open_h5py(file, 'r') as fp:
+                    space = cls.fromfile(fp[level], key, tmpdir, lazy)
+                    space.config = util.ConfigFile.fromfile(fp)
+                    space.metadata = util.MetaData.fromfile(fp)
+                return space
+        if lazy:
+            return LazySpace.fromfile(file, key)
         try:
             with util.open_h5py(file, 'r') as fp:
                 if 'type' in fp.attrs.keys():
                     if fp.attrs['type'] == 'Empty':
                         return EmptySpace()
+                    if fp.attrs['type'] == 'SparseSpace':
+                        return SparseSpace.fromfile(fp, key).todense(tmpdir)
 
                 axes = Axes.fromfile(fp)
                 config = util.ConfigFile.fromfile(fp)
@@ -672,8 +786,8 @@ class Space(object):
                     axes = tuple(ax[k] for k, ax in zip(key, axes) if isinstance(k, slice))
                 else:
                     key = Ellipsis
-                space = cls(axes, config, metadata)
                 try:
+                    space = cls(axes, config, metadata, fp['counts'].dtype, fp['contributions'].dtype, tmpdir)
                     fp['counts'].read_direct(space.photons, key)
                     fp['contributions'].read_direct(space.contributions, key)
                 except (KeyError, TypeError) as e:
@@ -684,6 +798,628 @@ class Space(object):
         return space
 
 
+class SparseSpace(object):
+    """Space that only stores the occupied grid points, for mostly empty spaces
+    such as high resolution rod scans. Supports the basic operations of Space
+    and converts from and to it with fromdense() / todense().
+
+    Important attributes:
+        axes             Axes instances describing range and stepsizes of each of the dimensions
+        indices          sorted 1D numpy integer array, flat (C order) grid indices of the occupied points
+        photons          1D numpy float array, total intensity per occupied grid point
+        contribitions    1D numpy float array, number of original datapoints (pixels) per occupied grid point
+        dimension        n
+
+    The storage types of photons and contributions are handled as in Space."""
+
+    def __init__(self, axes, config=None, metadata=None, photons_dtype=numpy.float64, contributions_dtype=numpy.float64):
+        if not isinstance(axes, Axes):
+            self.axes = Axes(axes)
+        else:
+            self.axes = axes
+
+        self.config = config
+        self.metadata = metadata
+
+        self.indices = numpy.zeros(0, dtype=numpy.int64)
+        self.photons = numpy.zeros(0, dtype=photons_dtype)
+        self.contributions = numpy.zeros(0, dtype=contributions_dtype)
+
+    config = Space.config
+    metadata = Space.metadata
+
+    @property
+    def dimension(self):
+        return self.axes.dimension
+
+    @property
+    def shape(self):
+        return tuple(len(ax) for ax in self.axes)
+
+    @property
+    def npoints(self):
+        return self.axes.npoints
+
+    @property
+    def memory_size(self):
+        """Returns approximate memory consumption of this SparseSpace.
+        Only considers size of .indices, .photons and .contributions, does not take into account the overhead."""
+        return self.indices.nbytes + self.photons.nbytes + self.contributions.nbytes
+
+    def copy(self):
+        """Returns a copy of self. Numpy data is not shared, but the Axes object is."""
+        new = self.__class__(self.axes, self.config, self.metadata)
+        new.indices = self.indices.copy()
+        new.photons = self.photons.copy()
+        new.contributions = self.contributions.copy()
+        return new
+
+    def todense(self, tmpdir=None):
+        """Returns a Space with the same data, see Space.__init__() for 'tmpdir'."""
+        new = Space(self.axes, self.config, self.metadata, self.photons.dtype, self.contributions.dtype, tmpdir)
+        index = numpy.unravel_index(self.indices, new.photons.shape)
+        new.photons[index] = self.photons
+        new.contributions[index] = self.contributions
+        return new
+
+    @classmethod
+    def fromdense(cls, space):
+        """Create SparseSpace from the occupied grid points of a Space."""
+        new = cls(space.axes, space.config, space.metadata)
+        mask = (space.contributions != 0) | (space.photons != 0)
+        new.indices = numpy.flatnonzero(mask).astype(numpy.int64)
+        new.photons = space.photons[mask]
+        new.contributions = space.contributions[mask]
+        return new
+
+    def get(self):
+        """Returns normalized photon count as a dense array."""
+        return self.todense().get()
+
+    def get_masked(self):
+        """Returns photons/contributions as a dense array, but with divide-by-zero's masked out."""
+        return self.todense().get_masked()
+
+    def __repr__(self):
+        return '{0.__class__.__name__} ({0.dimension} dimensions, {0.npoints} points, {1} occupied, {2}) {{\n    {3}\n}}'.format(self, self.indices.size, util.format_bytes(self.memory_size), '\n    '.join(repr(ax) for ax in self.axes))
+
+    def __getitem__(self, key):
+        """Slicing only, see Space.__getitem__()."""
+        newkey = self.get_key(key)
+        multi = numpy.unravel_index(self.indices, self.shape)
+        mask = numpy.ones(self.indices.shape, dtype=bool)
+        newaxes = []
+        newmulti = []
+        for k, ax, index in zip(newkey, self.axes, multi):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(len(ax))
+                mask &= (index >= start) & (index < stop)
+                newaxes.append(ax[start:stop])
+                newmulti.append(index - start)
+            else:
+                mask &= index == k
+        if not newaxes:
+            return self.photons[mask].sum() / self.contributions[mask].sum()
+        newspace = self.__class__(newaxes, self.config, self.metadata)
+        newspace.indices = numpy.ravel_multi_index(tuple(index[mask] for index in newmulti), newspace.shape)
+        newspace.photons = self.photons[mask]
+        newspace.contributions = self.contributions[mask]
+        return newspace
+
+    def get_key(self, key):
+        """Convert the n-dimensional interval described by key (as used by e.g. __getitem__()) from data coordinates to indices."""
+        if isinstance(key, numbers.Number) or isinstance(key, slice):
+            if not len(self.axes) == 1:
+                raise IndexError('dimension mismatch')
+            else:
+                key = [key]
+        elif not (isinstance(key, tuple) or isinstance(key, list)) or not len(key) == len(self.axes):
+            raise IndexError('dimension mismatch')
+        return tuple(ax.get_index(k) for k, ax in zip(key, self.axes))
+
+    def project(self, axis, *more_axes):
+        """Reduce dimensionality of SparseSpace by projecting onto 'axis', see Space.project()."""
+        index = self.axes.index(axis)
+        newaxes = list(self.axes)
+        newaxes.pop(index)
+        multi = list(numpy.unravel_index(self.indices, self.shape))
+        multi.pop(index)
+
+        newspace = self.__class__(newaxes, self.config, self.metadata)
+        if newaxes:
+            indices = numpy.ravel_multi_index(multi, newspace.shape)
+        else:
+            indices = numpy.zeros(self.indices.shape, dtype=numpy.int64)
+        unique, inverse = numpy.unique(indices, return_inverse=True)
+        newspace.indices = unique
+        newspace.photons = numpy.bincount(inverse, weights=self.photons, minlength=unique.size)
+        newspace.contributions = numpy.bincount(inverse, weights=self.contributions, minlength=unique.size)
+        if more_axes:
+            return newspace.project(more_axes[0], *more_axes[1:])
+        else:
+            return newspace
+
+    def slice(self, axis, key):
+        """Single-axis slice, see Space.slice()."""
+        axindex = self.axes.index(axis)
+        newkey = list(slice(None) for ax in self.axes)
+        newkey[axindex] = key
+        return self.__getitem__(tuple(newkey))
+
+    def _merge(self, indices, photons, contributions):
+        """Add data for the sorted, unique flat 'indices' in the grid of the SparseSpace."""
+        if not self.indices.size:
+            self.indices = indices
+            self.photons = checked_cast(photons, self.photons.dtype)
+            self.contributions = checked_cast(contributions, self.contributions.dtype, exact=True)
+            return
+        position = numpy.searchsorted(self.indices, indices)
+        found = position < self.indices.size
+        found[found] = self.indices[position[found]] == indices[found]
+        checked_add(self.photons, position[found], photons[found])
+        checked_add(self.contributions, position[found], contributions[found], exact=True)
+
+        new = ~found
+        if new.any():
+            self.indices = numpy.insert(self.indices, position[new], indices[new])
+            self.photons = numpy.insert(self.photons, position[new], checked_cast(photons[new], self.photons.dtype))
+            self.contributions = numpy.insert(self.contributions, position[new], checked_cast(contributions[new], self.contributions.dtype, exact=True))
+
+    def __add__(self, other):
+        if isinstance(other, numbers.Number):
+            new = self.copy()
+            new.photons += other * self.contributions
+            return new
+        if not isinstance(other, (Space, SparseSpace)):
+            return NotImplemented
+        if not len(self.axes) == len(other.axes) or not all(a.is_compatible(b) for (a, b) in zip(self.axes, other.axes)):
+            raise ValueError('cannot add spaces with different dimensionality or resolution')
+
+        new = self.__class__([a | b for (a, b) in zip(self.axes, other.axes)], photons_dtype=numpy.promote_types(self.photons.dtype, other.photons.dtype), contributions_dtype=numpy.promote_types(self.contributions.dtype, other.contributions.dtype))
+        new += self
+        new += other
+        return new
+
+    def __iadd__(self, other):
+        if isinstance(other, numbers.Number):
+            self.photons += other * self.contributions
+            return self
+        if isinstance(other, Space):
+            other = other.tosparse()
+        if not isinstance(other, SparseSpace):
+            return NotImplemented
+        if not len(self.axes) == len(other.axes) or not all(a.is_compatible(b) for (a, b) in zip(self.axes, other.axes)):
+            raise ValueError('cannot add spaces with different dimensionality or resolution')
+
+        if not all(other_ax in self_ax for (self_ax, other_ax) in zip(self.axes, other.axes)):
+            # growing is cheap, only the indices change
+            axes = Axes(a | b for (a, b) in zip(self.axes, other.axes))
+            self.indices = reindex(self.indices, self.axes, axes)
+            self.axes = axes
+
+        self._merge(reindex(other.indices, other.axes, self.axes), other.photons.copy(), other.contributions.copy())
+        self.metadata += other.metadata
+        return self
+
+    def __sub__(self, other):
+        return self.__add__(other * -1)
+
+    def __isub__(self, other):
+        return self.__iadd__(other * -1)
+
+    def __mul__(self, other):
+        if isinstance(other, numbers.Number):
+            new = self.__class__(self.axes, self.config, self.metadata)
+            new.indices = self.indices.copy()
+            new.photons = self.photons / other
+            new.contributions = self.contributions / other**2
+            return new
+        else:
+            return NotImplemented
+
+    def trim(self):
+        """Reduce total size of SparseSpace by trimming zero-contribution data points on the boundaries."""
+        multi = numpy.unravel_index(self.indices, self.shape)
+        mask = self.contributions > 0
+        lims = tuple((int(index[mask].min()), int(index[mask].max())) for index in multi)
+        inside = numpy.ones(self.indices.shape, dtype=bool)
+        for index, (min, max) in zip(multi, lims):
+            inside &= (index >= min) & (index <= max)
+        self.axes = Axes(ax.rebound(min + ax.imin, max + ax.imin) for (ax, (min, max)) in zip(self.axes, lims))
+        self.indices = numpy.ravel_multi_index(tuple(index[inside] - min for (index, (min, max)) in zip(multi, lims)), self.shape)
+        self.photons = self.photons[inside]
+        self.contributions = self.contributions[inside]
+
+    def crop(self, axes):
+        """Returns a copy of the part of the SparseSpace within 'axes', which should be contained in the Axes of the SparseSpace."""
+        multi = numpy.unravel_index(self.indices, self.shape)
+        inside = numpy.ones(self.indices.shape, dtype=bool)
+        for index, ax, spaceax in zip(multi, axes, self.axes):
+            inside &= (index >= ax.imin - spaceax.imin) & (index <= ax.imax - spaceax.imin)
+        newspace = self.__class__(axes, self.config, self.metadata)
+        newspace.indices = numpy.ravel_multi_index(tuple(index[inside] - (ax.imin - spaceax.imin) for (index, ax, spaceax) in zip(multi, axes, self.axes)), newspace.shape)
+        newspace.photons = self.photons[inside]
+        newspace.contributions = self.contributions[inside]
+        return newspace
+
+    def process_image(self, coordinates, intensity, weights):
+        """Load image data into SparseSpace, see Space.process_image()."""
+        if len(coordinates) != len(self.axes):
+            raise ValueError('dimension mismatch between coordinates and axes')
+
+        intensity = numpy.nan_to_num(intensity).flatten()
+        weights = weights.flatten()
+        if intensity.size == 0:
+            return
+
+        indices = numpy.ravel_multi_index(tuple(ax.get_index(coord).flatten() for (ax, coord) in zip(self.axes, coordinates)), self.shape)
+        unique, inverse = numpy.unique(indices, return_inverse=True)
+        photons = numpy.bincount(inverse, weights=intensity * weights, minlength=unique.size)
+        contributions = numpy.bincount(inverse, weights=weights, minlength=unique.size)
+        self._merge(unique.astype(numpy.int64), photons, contributions)
+
+    @classmethod
+    def from_image(cls, resolutions, labels, coordinates, intensity, weights, limits=None):
+        """Create SparseSpace from image data, see Space.from_image()."""
+        if limits is not None:
+            coordinates, intensity, weights = apply_limits(coordinates, intensity, weights, limits)
+            if intensity.size == 0:
+                return EmptySpace()
+
+        axes = tuple(Axis(coord.min(), coord.max(), res, label) for res, label, coord in zip(resolutions, labels, coordinates))
+        newspace = cls(axes)
+        newspace.process_image(coordinates, intensity, weights)
+        return newspace
+
+    def tofile(self, filename, layout='auto', compression='gzip', pyramid=0):
+        """Store SparseSpace in HDF5 file, see Space.tofile(). The flat arrays are always chunked automatically, without pyramid."""
+        filters = get_filters(compression) if self.indices.size else {}  # HDF5 cannot chunk empty datasets
+        with util.atomic_write(filename) as tmpname:
+            with util.open_h5py(tmpname, 'w') as fp:
+                fp.attrs['type'] = 'SparseSpace'
+                fp.attrs['compression'] = compression
+                self.config.tofile(fp)
+                self.axes.tofile(fp)
+                self.metadata.tofile(fp)
+                fp.create_dataset('indices', data=self.indices, **filters)
+                fp.create_dataset('counts', data=self.photons, **filters)
+                fp.create_dataset('contributions', data=self.contributions, **filters)
+
+    @classmethod
+    def fromfile(cls, file, key=None):
+        """Load SparseSpace from HDF5 file, dense Space files are converted.
+
+        file      filename string or h5py.Group instance
+        key       sliced (subset) loading, should be an n-tuple of slice()s in data coordinates"""
+        try:
+            with util.open_h5py(file, 'r') as fp:
+                if 'type' in fp.attrs.keys():
+                    if fp.attrs['type'] == 'Empty':
+                        return EmptySpace()
+                    if fp.attrs['type'] != 'SparseSpace':
+                        return Space.fromfile(fp, key).tosparse()
+
+                axes = Axes.fromfile(fp)
+                config = util.ConfigFile.fromfile(fp)
+                metadata = util.MetaData.fromfile(fp)
+                space = cls(axes, config, metadata)
+                try:
+                    space.indices = fp['indices'][...]
+                    space.photons = fp['counts'][...]
+                    space.contributions = fp['contributions'][...]
+                except (KeyError, TypeError) as e:
+                    raise errors.HDF5FileError('unable to load SparseSpace from HDF5 file {0}, is it a valid BINoculars file? (original error: {1!r})'.format(file, e))
+
+        except IOError as e:
+            raise errors.HDF5FileError("unable to open '{0}' as HDF5 file (original error: {1!r})".format(file, e))
+        if key:
+            if len(axes) != len(key):
+                raise ValueError("dimensionality of 'key' does not match dimensionality of Space in HDF5 file {0}".format(file))
+            return space[key]
+        return space
+
+
+class LazySpace(object):
+    """Space in an HDF5 file of which only the axes, config and metadata are
+    loaded. Slicing, projecting and reordering are recorded and carried out when
+    the data is needed (compute(), photons, get(), tofile(), ...), reading the
+    file in blocks such that the memory usage is proportional to the result
+    instead of to the file. Use Space.fromfile(filename, lazy=True).
+
+    Important attributes:
+        axes        Axes instance of the result
+        file        filename string
+        path        name of the HDF5 group in the file holding the Space, if not at the top"""
+
+    def __init__(self, file, fileaxes, config=None, metadata=None, path=None):
+        self.file = file
+        self.path = path
+        self.fileaxes = fileaxes
+        self.config = config
+        self.metadata = metadata
+        self.key = tuple(slice(0, len(ax)) for ax in fileaxes)  # index range or single index per axis in the file
+        self.projected = ()  # file axes that are summed
+        self.order = tuple(range(len(fileaxes)))  # file axes of the result, in order
+        self._space = None
+
+    config = Space.config
+    metadata = Space.metadata
+
+    @property
+    def axes(self):
+        return Axes(self.fileaxes[index][self.key[index]] for index in self.order)
+
+    @property
+    def dimension(self):
+        return len(self.order)
+
+    @property
+    def npoints(self):
+        return self.axes.npoints
+
+    def __repr__(self):
+        return '{0.__class__.__name__} ({0.dimension} dimensions, {0.npoints} points, from {0.file}) {{\n    {1}\n}}'.format(self, '\n    '.join(repr(ax) for ax in self.axes))
+
+    def derive(self, key=None, projected=None, order=None):
+        """Returns a new LazySpace on the same file with the given selection."""
+        new = self.__class__(self.file, self.fileaxes, self.config, self.metadata, self.path)
+        new.key = self.key if key is None else tuple(key)
+        new.projected = self.projected if projected is None else tuple(projected)
+        new.order = self.order if order is None else tuple(order)
+        return new
+
+    def __getitem__(self, key):
+        """Slicing only, see Space.__getitem__(). Nothing is read until the data is needed."""
+        newkey = list(self.key)
+        order = []
+        for k, index, ax in zip(self.get_key(key), self.order, self.axes):
+            offset = self.key[index].start
+            if isinstance(k, slice):
+                start, stop, step = k.indices(len(ax))
+                if start >= stop:
+                    raise KeyError('key results in empty space')
+                newkey[index] = slice(offset + start, offset + stop)
+                order.append(index)
+            else:
+                newkey[index] = offset + int(k)
+        new = self.derive(key=newkey, order=order)
+        if not order:
+            space = new.compute()
+            return space.photons / space.contributions
+        return new
+
+    def get_key(self, key):
+        """Convert the n-dimensional interval described by key (as used by e.g. __getitem__()) from data coordinates to indices."""
+        if isinstance(key, numbers.Number) or isinstance(key, slice):
+            if not self.dimension == 1:
+                raise IndexError('dimension mismatch')
+            else:
+                key = [key]
+        elif not (isinstance(key, tuple) or isinstance(key, list)) or not len(key) == self.dimension:
+            raise IndexError('dimension mismatch')
+        return tuple(ax.get_index(k) for k, ax in zip(key, self.axes))
+
+    def slice(self, axis, key):
+        """Single-axis slice, see Space.slice()."""
+        axindex = self.axes.index(axis)
+        newkey = list(slice(None) for index in self.order)
+        newkey[axindex] = key
+        return self.__getitem__(tuple(newkey))
+
+    def project(self, axis, *more_axes):
+        """Reduce dimensionality by projecting onto 'axis', see Space.project()."""
+        index = self.order[self.axes.index(axis)]
+        new = self.derive(projected=self.projected + (index, ), order=tuple(i for i in self.order if i != index))
+        if more_axes:
+            return new.project(more_axes[0], *more_axes[1:])
+        else:
+            return new
+
+    def reorder(self, labels):
+        """Change order of axes."""
+        if not self.dimension == len(labels):
+            raise ValueError('dimension mismatch')
+        axes = self.axes
+        return self.derive(order=tuple(self.order[axes.index(label)] for label in labels))
+
+    def compute(self, blocksize=2**22):
+        """Read the selection from the file and return it as a Space.
+
+        blocksize    maximum number of grid points read from the file at once"""
+        if self._space is not None:
+            return self._space
+
+        kept = tuple(index for (index, k) in enumerate(self.key) if isinstance(k, slice))
+        remaining = tuple(index for index in kept if index not in self.projected)
+        summed = tuple(kept.index(index) for index in self.projected)
+        with util.open_h5py(self.file, 'r') as fp:
+            if self.path is not None:
+                fp = fp[self.path]
+            try:
+                counts, contributions = fp['counts'], fp['contributions']
+            except KeyError as e:
+                raise errors.HDF5FileError('unable to load Space from HDF5 file {0}, is it a valid BINoculars file? (original error: {1!r})'.format(self.file, e))
+            space = Space(tuple(self.fileaxes[index][self.key[index]] for index in remaining), self.config, self.metadata, counts.dtype, contributions.dtype)
+
+            # read in blocks along the first axis of the selection, projected axes are summed per block
+            block = kept[0] if kept else None
+            rows = 1
+            if block is not None:
+                rows = max(1, blocksize // int(numpy.prod([self.key[index].stop - self.key[index].start for index in kept if index != block])))
+            start, stop = (self.key[block].start, self.key[block].stop) if block is not None else (0, 1)
+            for blockstart in range(start, stop, rows):
+                blockstop = min(blockstart + rows, stop)
+                key = list(self.key)
+                target = Ellipsis
+                if block is not None:
+                    key[block] = slice(blockstart, blockstop)
+                    if block not in self.projected:
+                        target = slice(blockstart - start, blockstop - start)
+                for dataset, array, exact in ((counts, space.photons, False), (contributions, space.contributions, True)):
+                    data = dataset[tuple(key)]
+                    if summed:
+                        data = data.sum(axis=summed)
+                    checked_add(array, target, data, exact)
+
+        if self.order != remaining:
+            space = space.reorder(tuple(space.axes[remaining.index(index)].label for index in self.order))
+        self._space = space
+        return space
+
+    @property
+    def photons(self):
+        return self.compute().photons
+
+    @property
+    def contributions(self):
+        return self.compute().contributions
+
+    def get(self):
+        """Returns normalized photon count."""
+        return self.compute().get()
+
+    def get_masked(self):
+        """Returns photons/contributions, but with divide-by-zero's masked out."""
+        return self.compute().get_masked()
+
+    def get_variance(self):
+        return self.compute().get_variance()
+
+    def get_grid(self):
+        """Returns the data coordinates of each grid point, see Space.get_grid()."""
+        return self.compute().get_grid()
+
+    def __add__(self, other):
+        return self.compute() + other
+
+    def __radd__(self, other):
+        return other + self.compute()
+
+    def __sub__(self, other):
+        return self.compute() - other
+
+    def tofile(self, filename, layout='auto', compression='gzip', pyramid=0):
+        """Store the result in HDF5 file, see Space.tofile()."""
+        self.compute().tofile(filename, layout, compression, pyramid)
+
+    @classmethod
+    def fromfile(cls, file, key=None):
+        """Open Space in HDF5 file without loading the data, see Space.fromfile()."""
+        try:
+            with util.open_h5py(file, 'r') as fp:
+                if 'type' in fp.attrs.keys():
+                    if fp.attrs['type'] == 'Empty':
+                        return EmptySpace()
+                    if fp.attrs['type'] == 'SparseSpace':
+                        return SparseSpace.fromfile(fp, key).todense()
+                if isinstance(file, h5py.Group):
+                    space = cls(file.file.filename, Axes.fromfile(fp), util.ConfigFile.fromfile(fp), util.MetaData.fromfile(fp), file.name)
+                else:
+                    space = cls(file, Axes.fromfile(fp), util.ConfigFile.fromfile(fp), util.MetaData.fromfile(fp))
+        except IOError as e:
+            raise errors.HDF5FileError("unable to open '{0}' as HDF5 file (original error: {1!r})".format(file, e))
+        if key:
+            if len(space.axes) != len(key):
+                raise ValueError("dimensionality of 'key' does not match dimensionality of Space in HDF5 file {0}".format(file))
+            return space[key]
+        return space
+
+
+class Accumulator(object):
+    """Bins images directly into a single Space, instead of creating a Space
+    per image and summing those. The Space is reallocated only when an image
+    falls outside of it, in which case it grows geometrically so the number of
+    reallocations stays small. get() returns the data cut to the exact extent
+    of the binned images, identical to summing Space.from_image() results.
+
+    resolutions   n-tuple of axis resolutions
+    labels        n-tuple of axis labels
+    limits        optional n-tuple of slice()s in data coordinates, see Space.from_image()
+    axes          optional initial Axes, for example an estimate of the final extent
+    growth        minimum relative growth of an axis when reallocating
+    sparse        bin into a SparseSpace instead of a Space
+    photons_dtype, contributions_dtype
+                  storage types of the Space, see Space.__init__()
+
+    Resolutions and labels are only needed for add_image(), add_space() takes
+    them from the Space that is added."""
+
+    def __init__(self, resolutions=None, labels=None, limits=None, axes=None, growth=0.5, sparse=False, photons_dtype=numpy.float64, contributions_dtype=numpy.float64):
+        self.resolutions = resolutions
+        self.labels = labels
+        self.limits = limits
+        self.growth = growth
+        self.spacetype = SparseSpace if sparse else Space
+        self.dtypes = photons_dtype, contributions_dtype
+        self.extent = None
+        self.space = None
+        if axes is not None:
+            self.space = self.spacetype(axes, None, None, *self.dtypes)
+
+    def add_image(self, coordinates, intensity, weights):
+        """Bin image data, see Space.process_image()."""
+        if self.limits is not None:
+            coordinates, intensity, weights = apply_limits(coordinates, intensity, weights, self.limits)
+        if intensity.size == 0:
+            return
+
+        axes = Axes(Axis(coord.min(), coord.max(), res, label) for res, label, coord in zip(self.resolutions, self.labels, coordinates))
+        if self.extent is None:
+            self.extent = axes
+        else:
+            self.extent = Axes(a | b for (a, b) in zip(self.extent, axes))
+
+        if self.space is None:
+            self.space = self.spacetype(axes, None, None, *self.dtypes)
+        elif not all(ax in spaceax for (ax, spaceax) in zip(axes, self.space.axes)):
+            self.grow(axes)
+        self.space.process_image(coordinates, intensity, weights)
+
+    def add_space(self, space):
+        """Add a Space, growing geometrically when it does not fit. Takes ownership of 'space'."""
+        if isinstance(space, EmptySpace):
+            return
+        if self.space is None:
+            self.space = space
+            self.extent = space.axes
+            return
+
+        if self.extent is None:
+            self.extent = space.axes
+        else:
+            self.extent = Axes(a | b for (a, b) in zip(self.extent, space.axes))
+        if not all(ax in spaceax for (ax, spaceax) in zip(space.axes, self.space.axes)):
+            self.grow(space.axes)
+        self.space += space
+
+    def grow(self, axes):
+        """Reallocate the Space such that it contains 'axes'."""
+        newaxes = []
+        for ax, spaceax, limit in zip(axes, self.space.axes, self.limits or [slice(None)] * len(axes)):
+            pad = int(numpy.ceil(len(spaceax) * self.growth))
+            imin, imax = spaceax.imin, spaceax.imax
+            if ax.imin < imin:
+                imin = min(ax.imin, imin - pad)
+                if limit.start is not None:
+                    imin = max(imin, int(numpy.floor(limit.start / spaceax.res)))
+            if ax.imax > imax:
+                imax = max(ax.imax, imax + pad)
+                if limit.stop is not None:
+                    imax = min(imax, int(numpy.ceil(limit.stop / spaceax.res)))
+            newaxes.append(spaceax.rebound(min(imin, ax.imin), max(imax, ax.imax)))
+        newspace = self.space.__class__(newaxes, None, None, self.space.photons.dtype, self.space.contributions.dtype)
+        newspace += self.space
+        self.space = newspace
+
+    def get(self):
+        """Returns the binned data as a Space trimmed to the extent of the images, or EmptySpace if nothing was binned."""
+        if self.extent is None:
+            return EmptySpace()
+        if self.extent == self.space.axes:
+            return self.space
+        return self.space.crop(self.extent)
+
+
 class Multiverse(object):
     """A collection of spaces with basic support for addition.
        Only to be used when processing data. This makes it possible to
@@ -712,13 +1448,13 @@ class Multiverse(object):
             self.spaces[index] += o
         return self
 
-    def tofile(self, filename):
+    def tofile(self, filename, layout='auto', compression='gzip'):
         with util.atomic_write(filename) as tmpname:
             with util.open_h5py(tmpname, 'w') as fp:
                 fp.attrs['type'] = 'Multiverse'
                 for index, sp in enumerate(self.spaces):
                     spacegroup = fp.create_group('space_{0}'.format(index))
-                    sp.tofile(spacegroup)
+                    sp.tofile(spacegroup, layout, compression)
 
     @classmethod
     def fromfile(cls, file):
@@ -727,7 +1463,8 @@ class Multiverse(object):
             with util.open_h5py(file, 'r') as fp:
                 if 'type' in fp.attrs:
                     if fp.attrs['type'] == 'Multiverse':
-                        return cls(tuple(Space.fromfile(fp[label]) for label in fp))
+                        labels = sorted(fp, key=lambda label: int(label.rsplit('_', 1)[-1]))  # space_10 comes after space_9
+                        return cls(tuple((SparseSpace if fp[label].attrs.get('type') == 'SparseSpace' else Space).fromfile(fp[label]) for label in labels))
                     else:
                         raise TypeError('This is not a multiverse')
                 else:
@@ -758,6 +1495,195 @@ class EmptyVerse(object):
         return other
 
 
+def apply_limits(coordinates, intensity, weights, limits):
+    """Discard the datapoints outside of 'limits', an n-tuple of slice()s in data coordinates.
+    Returns the remaining (coordinates, intensity, weights) as flat arrays."""
+    invalid = numpy.zeros(intensity.shape, dtype=bool)
+    for coord, sl in zip(coordinates, limits):
+        if sl.start is None and sl.stop is not None:
+            invalid |= coord > sl.stop
+        elif sl.start is not None and sl.stop is None:
+            invalid |= coord < sl.start
+        elif sl.start is not None and sl.stop is not None:
+            invalid |= numpy.bitwise_or(coord < sl.start, coord > sl.stop)
+    return tuple(coord[~invalid] for coord in coordinates), intensity[~invalid], weights[~invalid]
+
+
+def block_sum(array, factors, paddings):
+    """Sum 'array' over blocks of 'factors' elements per axis, after padding it with
+    zeros by 'paddings', a (before, after) pair per axis as returned by Axis.rebin().
+    Along an axis with an even factor a block spans factor + 1 elements, of which the
+    first and the last count for one half, so that every block stays centred on its grid point."""
+    if any(any(padding) for padding in paddings):
+        array = numpy.pad(array, paddings, 'constant')
+    shared = 0
+    for index, factor in enumerate(factors):
+        if factor % 2 == 0:
+            before = (slice(None), ) * index
+            array = array[before + (slice(None, -1), )] + array[before + (slice(1, None), )]
+            shared += 1
+    shape = tuple(chain.from_iterable((length // factor, factor) for (length, factor) in zip(array.shape, factors)))
+    array = array.reshape(shape).sum(axis=tuple(range(1, len(shape), 2)))
+    if shared:
+        array = array * 0.5 ** shared
+    return array
+
+
+def block_rebin(space, factors):
+    """Returns 'space' rebinned by integer 'factors' along each axis. Photons and contributions
+    are both summed over the blocks, such that the normalised intensity stays exact. Every new
+    bin is centred on the grid point it is labelled with, see Axis.rebin(); with an even factor
+    the contributions can become fractional, so integer contributions dtypes are promoted to float."""
+    paddings = []
+    axes = []
+    for ax, factor in zip(space.axes, factors):
+        left, right, newax = ax.rebin(factor)
+        paddings.append((left, right))
+        axes.append(newax)
+    photons_dtype, contributions_dtype = space.photons.dtype, space.contributions.dtype
+    if any(factor % 2 == 0 for factor in factors):
+        photons_dtype = numpy.promote_types(photons_dtype, numpy.float32)
+        contributions_dtype = numpy.promote_types(contributions_dtype, numpy.float32)
+    newspace = Space(axes, space.config, space.metadata, photons_dtype, contributions_dtype)
+    newspace.photons = checked_cast(block_sum(space.photons, factors, paddings), photons_dtype)
+    newspace.contributions = checked_cast(block_sum(space.contributions, factors, paddings), contributions_dtype, exact=True)
+    return newspace
+
+
+def overlap_matrix(old, new):
+    """Returns the (len(new), len(old)) matrix of the fraction of each bin of Axis 'old' that
+    falls within each bin of Axis 'new'. The bins of both are centered on the grid points."""
+    oldedges = (numpy.arange(old.imin, old.imax + 2) - 0.5) * old.res
+    newedges = (numpy.arange(new.imin, new.imax + 2) - 0.5) * new.res
+    low = numpy.maximum.outer(newedges[:-1], oldedges[:-1])
+    high = numpy.minimum.outer(newedges[1:], oldedges[1:])
+    return numpy.clip(high - low, 0, None) / old.res
+
+
+def pyramid_level(file, key=None, npoints=None, labels=None):
+    """Returns the name of the coarsest level of the pyramid in 'file' (see Space.tofile())
+    that still has at least 'npoints' grid points within 'key', counted along the axes in
+    'labels' only if given. Returns None if the full resolution is needed or there is no pyramid.
+
+    The other axes are summed over by the caller, but a window that 'key' cuts out of them
+    is widened to whole coarse bins, so the resolution lost there counts as well: the level
+    needs 'npoints' times the relative loss of points within those windows. A single value
+    in 'key' for such an axis can only be read at full resolution."""
+    def windows(axes):
+        counted, cut = 1, 1
+        for index, ax in enumerate(axes):
+            k = key[index] if key else slice(None)
+            if labels is None or ax.label in labels:
+                counted *= len(range(*ax.get_index(k).indices(len(ax))))
+            elif isinstance(k, slice):
+                if k.start is not None or k.stop is not None:
+                    cut *= len(range(*ax.get_index(k).indices(len(ax))))
+            else:
+                cut = None
+        return counted, cut
+
+    with util.open_h5py(file, 'r') as fp:
+        if 'pyramid' not in fp:
+            return None
+        counted, cut = windows(Axes.fromfile(fp))
+        if counted < npoints or cut is None:
+            return None
+        level = None
+        for name in sorted(fp['pyramid'], key=lambda name: int(name.split('_')[-1])):
+            levelcounted, levelcut = windows(Axes.fromfile(fp['pyramid'][name]))
+            if levelcounted * levelcut < npoints * cut:
+                break
+            level = 'pyramid/{0}'.format(name)
+        return level
+
+
+def get_filters(compression):
+    """Returns the create_dataset() keyword arguments for 'compression', one of
+    'gzip', 'lzf', 'lz4' (requires the hdf5plugin package) or 'none', optionally
+    prefixed with 'shuffle+' to apply the shuffle filter first."""
+    filters = {}
+    if compression.startswith('shuffle+'):
+        filters['shuffle'] = True
+        compression = compression[len('shuffle+'):]
+    if compression == 'lz4':
+        if hdf5plugin is None:
+            raise ValueError("compression 'lz4' requires the hdf5plugin package")
+        filters.update(hdf5plugin.LZ4())
+    elif compression in ('gzip', 'lzf'):
+        filters['compression'] = compression
+    elif compression != 'none':
+        raise ValueError("unknown compression '{0}', expected gzip, lzf, lz4 or none".format(compression))
+    return filters
+
+
+def get_chunks(axes, layout, itemsize, chunksize=2**20):
+    """Returns the HDF5 chunk shape of a dataset on 'axes', for create_dataset().
+
+    layout     'auto' leaves the choice to h5py, 'cube' gives chunks with a similar
+               number of grid points along every axis and 'slab:<label>' gives chunks of
+               a single grid point thick along that axis, for reading thin slices across it
+    itemsize   size of a single value in bytes
+    chunksize  maximum size of a chunk in bytes"""
+    if layout == 'auto':
+        return True
+    chunks = list(len(ax) for ax in axes)
+    if layout.startswith('slab:'):
+        chunks[axes.index(layout[len('slab:'):])] = 1
+    elif layout != 'cube':
+        raise ValueError("unknown layout '{0}', expected auto, cube or slab:<label>".format(layout))
+    while numpy.prod(chunks) * itemsize > chunksize and max(chunks) > 1:
+        index = chunks.index(max(chunks))
+        chunks[index] = (chunks[index] + 1) // 2
+    return tuple(chunks)
+
+
+def allocate(shape, dtype, tmpdir=None):
+    """Returns a zero filled array, memory mapped to a temporary file in 'tmpdir' if given."""
+    if tmpdir is None or not numpy.prod(shape):
+        return numpy.zeros(shape, dtype=dtype, order='C')
+    return numpy.memmap(tempfile.TemporaryFile(dir=tmpdir), dtype=dtype, mode='w+', shape=shape)
+
+
+def checked_cast(values, dtype, exact=False):
+    """Cast 'values' to 'dtype', raising ValueError when they overflow it or
+    when an integer dtype would drop fractional values. With 'exact', float
+    dtypes also refuse integers they cannot represent exactly, which is what
+    is needed for contributions."""
+    dtype = numpy.dtype(dtype)
+    values = numpy.asarray(values)
+    if values.dtype == dtype or not values.size:
+        return values.astype(dtype, copy=False)
+    if dtype.kind in 'iu':
+        info = numpy.iinfo(dtype)
+        if values.min() < info.min or values.max() > info.max:
+            raise ValueError('values between {0} and {1} overflow {2}'.format(values.min(), values.max(), dtype))
+        if values.dtype.kind == 'f' and (numpy.mod(values, 1) != 0).any():
+            raise ValueError('cannot store fractional values as {0}'.format(dtype))
+    else:
+        finite = values[numpy.isfinite(values)]
+        largest = numpy.abs(finite).max() if finite.size else 0
+        info = numpy.finfo(dtype)
+        if largest > info.max:
+            raise ValueError('values up to {0} overflow {1}'.format(largest, dtype))
+        if exact and largest > 2 ** (info.nmant + 1):
+            raise ValueError('values up to {0} cannot be stored exactly as {1}'.format(largest, dtype))
+    return values.astype(dtype)
+
+
+def checked_add(target, index, values, exact=False):
+    """target[index] += values, checked with checked_cast() unless target has double precision."""
+    if target.dtype == numpy.float64:
+        target[index] += values
+    else:
+        target[index] = checked_cast(numpy.add(target[index], values, dtype=numpy.float64), target.dtype, exact)
+
+
+def reindex(indices, fromaxes, toaxes):
+    """Convert flat indices in the grid of 'fromaxes' to flat indices in the grid of 'toaxes', which should contain 'fromaxes'."""
+    multi = numpy.unravel_index(indices, tuple(len(ax) for ax in fromaxes))
+    return numpy.ravel_multi_index(tuple(index + (fromax.imin - toax.imin) for (index, fromax, toax) in zip(multi, fromaxes, toaxes)), tuple(len(ax) for ax in toaxes))
+
+
 def union_axes(axes):
     axes = tuple(axes)
     if len(axes) == 1:
@@ -766,8 +1692,8 @@ def union_axes(axes):
         raise TypeError('not all objects are Axis instances')
     if len(set(ax.res for ax in axes)) != 1 or len(set(ax.label for ax in axes)) != 1:
         raise ValueError('cannot unite axes with different resolution/label')
-    mi = min(ax.min for ax in axes)
-    ma = max(ax.max for ax in axes)
+    mi = min(ax.imin for ax in axes)
+    ma = max(ax.imax for ax in axes)
     first = axes[0]
     return first.__class__(mi, ma, first.res, first.label)
 
@@ -787,8 +1713,10 @@ def union_unequal_axes(axes):
     return first.__class__(mi, ma, res, first.label)
 
 
-def sum(spaces):
-    """Calculate sum of iterable of Space instances."""
+def sum(spaces, tmpdir=None, nthreads=1):
+    """Calculate sum of iterable of Space instances.
+    With 'tmpdir' the sum is a memory mapped Space, see Space.__init__().
+    With 'nthreads' other than 1 the dense spaces are added in parallel, see add_slabs()."""
     spaces = tuple(space for space in spaces if not isinstance(space, EmptySpace))
     if len(spaces) == 0:
         return EmptySpace()
@@ -799,28 +1727,238 @@ def sum(spaces):
 
     first = spaces[0]
     axes = tuple(union_axes(space.axes[i] for space in spaces) for i in range(first.dimension))
-    newspace = first.__class__(axes)
+    photons_dtype = reduce(numpy.promote_types, (space.photons.dtype for space in spaces))
+    contributions_dtype = reduce(numpy.promote_types, (space.contributions.dtype for space in spaces))
+    if tmpdir is None:
+        newspace = first.__class__(axes, photons_dtype=photons_dtype, contributions_dtype=contributions_dtype)
+    else:
+        newspace = Space(axes, photons_dtype=photons_dtype, contributions_dtype=contributions_dtype, tmpdir=tmpdir)
+    if nthreads != 1 and isinstance(newspace, Space):
+        dense = tuple(space for space in spaces if isinstance(space, Space))
+        add_slabs(newspace, dense, nthreads)
+        for space in dense:
+            newspace.metadata += space.metadata
+        spaces = tuple(space for space in spaces if not isinstance(space, Space))
     for space in spaces:
         newspace += space
     return newspace
 
 
-def verse_sum(verses):
+def add_slabs(target, spaces, nthreads=None, slabsize=2**22):
+    """Add the data of Spaces 'spaces' into Space 'target', whose axes contain all of theirs.
+    The first axis of 'target' is split into slabs of about 'slabsize' grid points, which
+    are filled from all spaces by 'nthreads' threads (the number of cores by default).
+    numpy releases the GIL during the additions, so this scales with the number of cores."""
+    if nthreads is None:
+        nthreads = multiprocessing.cpu_count()
+    length = len(target.axes[0])
+    rows = max(1, slabsize * length // target.axes.npoints)
+    offsets = [tuple(ax.imin - targetax.imin for (ax, targetax) in zip(space.axes, target.axes)) for space in spaces]
+
+    def add(start):
+        stop = min(start + rows, length)
+        for space, offset in zip(spaces, offsets):
+            low, high = max(start, offset[0]), min(stop, offset[0] + len(space.axes[0]))
+            if low >= high:
+                continue
+            index = (slice(low, high), ) + tuple(slice(o, o + len(ax)) for (o, ax) in zip(offset[1:], space.axes[1:]))
+            source = slice(low - offset[0], high - offset[0])
+            checked_add(target.photons, index, space.photons[source])
+            checked_add(target.contributions, index, space.contributions[source], exact=True)
+
+    pool = multiprocessing.pool.ThreadPool(nthreads)
+    try:
+        pool.map(add, range(0, length, rows))
+    finally:
+        pool.close()
+
+
+def sum_files(filenames, tmpdir=None, slabsize=2**24, nthreads=1):
+    """Calculate sum of the Spaces in HDF5 files without loading them completely.
+    The files are added in slabs along the first axis of at most 'slabsize'
+    grid points, with 'tmpdir' the sum itself is memory mapped as well.
+
+    filenames  iterable of filenames of Space or SparseSpace files with compatible axes
+    tmpdir     see Space.__init__()
+    slabsize   maximum number of grid points read at once
+    nthreads   number of threads filling disjoint slabs of the sum, None for the number of cores.
+               h5py serializes the reading itself, the additions run in parallel"""
+    filenames = tuple(filenames)
+    axes = []
+    dtypes = []
+    for filename in filenames:
+        with util.open_h5py(filename, 'r') as fp:
+            if fp.attrs.get('type') == 'Empty':
+                continue
+            axes.append(Axes.fromfile(fp))
+            dtypes.append((fp['counts'].dtype, fp['contributions'].dtype))
+    if not axes:
+        return EmptySpace()
+    first = axes[0]
+    if not all(len(ax) == len(first) and all(a.is_compatible(b) for (a, b) in zip(ax, first)) for ax in axes):
+        raise ValueError('cannot add spaces with different dimensionality or resolution')
+
+    photons_dtype, contributions_dtype = (reduce(numpy.promote_types, dtype) for dtype in zip(*dtypes))
+    newspace = Space(Axes(reduce(lambda a, b: a | b, ax) for ax in zip(*axes)), photons_dtype=photons_dtype, contributions_dtype=contributions_dtype, tmpdir=tmpdir)
+    config = None
+    dense = []
+    for filename in filenames:
+        with util.open_h5py(filename, 'r') as fp:
+            kind = fp.attrs.get('type')
+            if kind == 'Empty':
+                continue
+            if config is None:
+                config = newspace.config = util.ConfigFile.fromfile(fp)
+            if kind == 'SparseSpace':
+                newspace += SparseSpace.fromfile(fp)
+                continue
+            dense.append((filename, Axes.fromfile(fp)))
+            newspace.metadata += util.MetaData.fromfile(fp)
+
+    length = len(newspace.axes[0])
+    rows = max(1, slabsize * length // newspace.axes.npoints)
+
+    def add(start):
+        # every call fills its own slab of the sum, so the threads never write to the same grid points
+        stop = min(start + rows, length)
+        for filename, fileaxes in dense:
+            offsets = tuple(ax.imin - newax.imin for (newax, ax) in zip(newspace.axes, fileaxes))
+            low, high = max(start, offsets[0]), min(stop, offsets[0] + len(fileaxes[0]))
+            if low >= high:
+                continue
+            index = (slice(low, high), ) + tuple(slice(offset, offset + len(ax)) for (offset, ax) in zip(offsets[1:], fileaxes[1:]))
+            with util.open_h5py(filename, 'r') as fp:
+                checked_add(newspace.photons, index, fp['counts'][low - offsets[0]:high - offsets[0]])
+                checked_add(newspace.contributions, index, fp['contributions'][low - offsets[0]:high - offsets[0]], exact=True)
+
+    starts = range(0, length, rows)
+    if nthreads == 1:
+        for start in starts:
+            add(start)
+    else:
+        pool = multiprocessing.pool.ThreadPool(nthreads or multiprocessing.cpu_count())
+        try:
+            pool.map(add, starts)
+        finally:
+            pool.close()
+    return newspace
+
+
+def add_to_file(space, filename, layout='auto', compression='gzip', pyramid=0, slabsize=2**24):
+    """Add a Space or SparseSpace to the one stored in an HDF5 file, for appending
+    new data to an existing output. When the file holds a dense Space without
+    pyramid whose axes contain those of 'space', the datasets of a copy of the file
+    are updated in place in slabs of at most 'slabsize' grid points, the metadata
+    sections of 'space' are added to those already in the file (MetaData.tofile()
+    keeps existing sections) and the copy replaces the file, so an update that is
+    interrupted leaves the file as it was. Otherwise the file is rewritten with the
+    sum, which reallocates the datasets to the union of the axes. A missing file is
+    simply written.
+
+    space        Space, SparseSpace or EmptySpace to add
+    filename     HDF5 file written by Space.tofile() or SparseSpace.tofile()
+    layout, compression, pyramid  storage of a rewritten file, see Space.tofile()"""
+    if not os.path.exists(filename):
+        space.tofile(filename, layout, compression, pyramid)
+        return
+    if isinstance(space, EmptySpace):
+        return
+
+    with util.open_h5py(filename, 'r') as fp:
+        kind = fp.attrs.get('type')
+        inplace = kind == 'Space' and not pyramid and 'pyramid' not in fp
+        if inplace:
+            fileaxes = Axes.fromfile(fp)
+            inplace = len(fileaxes) == len(space.axes) and all(ax in fileax for (fileax, ax) in zip(fileaxes, space.axes))
+
+    if not inplace:
+        if kind == 'SparseSpace':
+            total = SparseSpace.fromfile(filename)
+        else:
+            total = sum_files([filename])
+        config = getattr(total, 'config', None) or space.config
+        total += space
+        total.config = config
+        total.tofile(filename, layout, compression, pyramid)
+        return
+
+    shape = tuple(len(ax) for ax in space.axes)
+    stride = int(space.axes.npoints) // shape[0]
+    rows = max(1, slabsize // stride)
+    offsets = tuple(ax.imin - fileax.imin for (fileax, ax) in zip(fileaxes, space.axes))
+    with util.atomic_write(filename) as tmpname:
+        shutil.copyfile(filename, tmpname)
+        with util.open_h5py(tmpname, 'r+') as fp:
+            for start in range(0, shape[0], rows):
+                stop = min(start + rows, shape[0])
+                if isinstance(space, SparseSpace):
+                    # the sorted flat indices of a range of rows are contiguous
+                    low, high = numpy.searchsorted(space.indices, (start * stride, stop * stride))
+                    if low == high:
+                        continue
+                    photons = numpy.zeros(((stop - start) * stride, ), dtype=space.photons.dtype)
+                    contributions = numpy.zeros(((stop - start) * stride, ), dtype=space.contributions.dtype)
+                    photons[space.indices[low:high] - start * stride] = space.photons[low:high]
+                    contributions[space.indices[low:high] - start * stride] = space.contributions[low:high]
+                    photons, contributions = photons.reshape((stop - start, ) + shape[1:]), contributions.reshape((stop - start, ) + shape[1:])
+                else:
+                    photons, contributions = space.photons[start:stop], space.contributions[start:stop]
+                index = (slice(offsets[0] + start, offsets[0] + stop), ) + tuple(slice(offset, offset + length) for (offset, length) in zip(offsets[1:], shape[1:]))
+                for name, values, exact in (('counts', photons, False), ('contributions', contributions, True)):
+                    block = fp[name][index]
+                    checked_add(block, Ellipsis, values, exact)
+                    fp[name][index] = block
+            space.metadata.tofile(fp)
+
+
+def verse_sum(verses, nthreads=1):
     i = iter(M.spaces for M in verses)
-    return Multiverse(sum(spaces) for spaces in zip(*i))
+    return Multiverse(sum(spaces, nthreads=nthreads) for spaces in zip(*i))
 
 # hybrid sum() / __iadd__()
 
 
-def chunked_sum(verses, chunksize=10):
+def chunked_sum(verses, chunksize=10, nthreads=1, checkpoint=None):
     """Calculate sum of iterable of Multiverse instances. Creates intermediate sums to avoid growing a large space at every summation.
+    The intermediate sums are added into an Accumulator, which grows to the union of the axes seen so far when a chunk does not fit,
+    so the result needs no cropping. The chunks already cover many jobs, so there are few reallocations to save by growing further.
+
+    verses      iterable of Multiverse instances
+    chunksize   number of Multiverse instances in each intermediate sum
+    nthreads    number of threads adding up each intermediate sum, see sum()
+    checkpoint  optional object with due() and write(verse) methods, after every
+                chunk the running sum is written when it is due, see dispatcher.Checkpoint"""
+    accumulators = []
+    for chunk in util.grouper(iter(verses), chunksize):
+        verse = verse_sum((M for M in chunk), nthreads)
+        if not accumulators:
+            accumulators = [Accumulator(growth=0) for sp in verse.spaces]
+        elif len(accumulators) != verse.dimension:
+            raise ValueError('cannot add multiverses with different dimensionality')
+        for accumulator, sp in zip(accumulators, verse.spaces):
+            accumulator.add_space(sp)
+        if checkpoint is not None and checkpoint.due():
+            checkpoint.write(Multiverse(accumulator.get() for accumulator in accumulators))
+    if not accumulators:
+        return EmptyVerse()
+    return Multiverse(accumulator.get() for accumulator in accumulators)
+
+
+def tree_sum(verses, fanin, nthreads=1):
+    """Calculate sum of iterable of Multiverse instances as a tree of partial sums, see
+    util.ReductionTree: every 'fanin' partial sums at one level are added into one at the
+    next, such that the spaces that are added are of similar size.
 
     verses     iterable of Multiverse instances
-    chunksize  number of Multiverse instances in each intermediate sum"""
-    result = EmptyVerse()
-    for chunk in util.grouper(verses, chunksize):
-        result += verse_sum(M for M in chunk)
-    return result
+    fanin      number of partial sums added at once
+    nthreads   number of threads adding up each partial sum, see sum()"""
+    tree = util.ReductionTree(fanin, lambda group: verse_sum(group, nthreads))
+    for verse in verses:
+        tree.add(verse)
+    remaining = tree.remaining()
+    if not remaining:
+        return EmptyVerse()
+    return verse_sum(remaining, nthreads)
 
 
 def iterate_over_axis(space, axis, resolution=None):
@@ -902,11 +2040,12 @@ def bkgsubtract(space, bkg):
 
 
 def make_compatible(spaces):
-    if not numpy.alen(numpy.unique(len(space.axes) for space in spaces)) == 1:
+    if not len(set(len(space.axes) for space in spaces)) == 1:
         raise ValueError('cannot make spaces with different dimensionality compatible')
     ax0 = tuple(ax.label for ax in spaces[0].axes)
-    resmax = tuple(numpy.vstack(tuple(ax.res for ax in space.reorder(ax0).axes) for space in spaces).max(axis=0))
-    resmin = tuple(numpy.vstack(tuple(ax.res for ax in space.reorder(ax0).axes) for space in spaces).min(axis=0))
+    resolutions = numpy.vstack([tuple(ax.res for ax in space.reorder(ax0).axes) for space in spaces])
+    resmax = tuple(resolutions.max(axis=0))
+    resmin = tuple(resolutions.min(axis=0))
     if not resmax == resmin:
         print('Warning: Not all spaces have the same resolution. Resolution will be changed to: {0}'.format(resmax))
-    return tuple(space.reorder(ax0).rebin2(resmax) for space in spaces)
+    return tuple(space.reorder(ax0).resample(resmax) for space in spaces)
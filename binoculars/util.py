@@ -13,12 +13,15 @@ import contextlib
 import argparse
 import h5py
 import glob
+import warnings
 from . import errors
 import struct
 import json
 import socket
 import binascii
 import re
+import threading
+import collections
 
 ### ARGUMENT HANDLING
 
@@ -335,6 +338,16 @@ def parse_bool(s):
     raise ValueError("invalid input for boolean: '{0}'".format(s))
 
 
+def parse_dtype(s):
+    try:
+        dtype = numpy.dtype(str(s))
+    except TypeError:
+        raise ValueError("invalid input for dtype: '{0}'".format(s))
+    if dtype.kind not in 'iuf':
+        raise ValueError("invalid input for dtype, expected an integer or float type: '{0}'".format(s))
+    return dtype
+
+
 def parse_pairs(s):
     if not s:
         return s
@@ -465,14 +478,14 @@ class MetaData(object): # a collection of metadata objects
                 meta = MetaBase()
                 for section in list(metadata[label].keys()):
                     group = metadata[label][section]
-                    setattr(meta, section, dict((key, group[key].value) for key in group))
+                    setattr(meta, section, dict((key, group[key][()]) for key in group))
                     meta.sections.append(section)
                 metadataobj.metas.append(meta)
         return metadataobj
 
     def tofile(self, filename):
         with open_h5py(filename, 'w') as fp:
-            metadata = fp.create_group('metadata')
+            metadata = fp.require_group('metadata')  # appends to the metadata already in the file
             for meta in self.metas:
                 label = find_unused_label('metasection', list(metadata.keys()))
                 metabase = metadata.create_group(label)
@@ -523,10 +536,11 @@ class ConfigFile(MetaBase):
             try:
                 config = fp['configuration']
                 if 'command' in config.attrs:
-                    configobj.command = json.loads(config.attrs['command'].decode('utf8'))
+                    command = config.attrs['command']
+                    configobj.command = json.loads(command.decode('utf8') if isinstance(command, bytes) else command)
                 for section in config:
                     if isinstance(config[section],  h5py.Group):  # new
-                        setattr(configobj, section, dict((key, config[section][key].value) for key in config[section]))
+                        setattr(configobj, section, dict((key, config[section][key][()]) for key in config[section]))
                     else:  # old
                         setattr(configobj, section, dict(config[section]))
             except KeyError as e:
@@ -657,14 +671,14 @@ def find_unused_label(label, labellist):
             return l
 
 
-def yield_when_exists(filelist, timeout=None):
+def yield_when_exists(filelist, timeout=None, delay=5):
     """Wait for files in 'filelist' to appear, for a maximum of 'timeout' seconds,
-    yielding them in arbitrary order as soon as they appear.
+    yielding them in arbitrary order as soon as they appear, checking every 'delay' seconds.
     If 'filelist' is a set, it will be modified in place, and on timeout it will
     contain the files that have not appeared yet."""
     if not isinstance(filelist, set):
         filelist = set(filelist)
-    delay = loop_delayer(5)
+    delay = loop_delayer(delay)
     start = time.time()
     while filelist:
         next(delay)
@@ -719,7 +733,7 @@ def open_h5py(fn, mode):
             if mode == 'w':
                 fp.create_group('binoculars')
                 yield fp['binoculars']
-            if mode == 'r':
+            if mode in ('r', 'r+'):
                 if 'binoculars' in fp:
                     yield fp['binoculars']
                 else:
@@ -776,20 +790,139 @@ def cluster_jobs(jobs, target_weight):
         yield cluster
 
 
-def cluster_jobs2(jobs, target_weight):
+def job_fields(fields):
+    # the fields that identify a job, as plain python values, also when read back from HDF5
+    plain = {}
+    for key, value in fields.items():
+        if key in ('weight', 'pixels'):
+            continue
+        if isinstance(value, bytes):
+            value = value.decode('utf8')
+        elif isinstance(value, (numpy.ndarray, numpy.generic)):
+            value = value.tolist()
+        plain[key] = value
+    return plain
+
+
+def job_key(fields):
+    return json.dumps(fields, sort_keys=True, default=repr)
+
+
+def cluster_jobs2(jobs, target_weight, weight=lambda job: job.weight):
     """Taking the first n jobs that together add up to target_weight.
        Here as opposed to cluster_jobs the total number of jobs does not have to be known beforehand
+       weight returns the weight of a job, e.g. its estimated duration instead of Job.weight
     """
     jobslist = []
     for job in jobs:
         jobslist.append(job)
-        if sum(j.weight for j in jobslist) >= target_weight:
+        if sum(weight(j) for j in jobslist) >= target_weight:
             yield jobslist[:]
             jobslist = []
     if len(jobslist) > 0:  # yield the remainder of the jobs
         yield jobslist[:]
 
 
+class ReductionTree(object):
+    """Plans the summation of a stream of partial results as a tree with fan-in 'fanin':
+    as soon as 'fanin' items are added at one level, reduce() merges them into a single
+    item at the next level. After the last item, remaining() returns the items that are
+    left at all levels, for one final merge at the root. With a fanin below 2 nothing
+    is merged before the root.
+
+    reduce  function taking a list of items and returning their merged item, for example
+            the sum of a list of Multiverses or the filename of a job that sums a list of files"""
+
+    def __init__(self, fanin, reduce):
+        self.fanin = fanin
+        self.reduce = reduce
+        self.levels = []
+
+    def add(self, item, level=0):
+        while len(self.levels) <= level:
+            self.levels.append([])
+        self.levels[level].append(item)
+        if self.fanin > 1 and len(self.levels[level]) >= self.fanin:
+            group, self.levels[level] = self.levels[level], []
+            self.add(self.reduce(group), level + 1)
+
+    def remaining(self):
+        return list(itertools.chain.from_iterable(self.levels))
+
+
+def nbytes(item):
+    """Returns the size of the numpy arrays in 'item', also inside (nested) tuples and lists."""
+    if isinstance(item, numpy.ndarray):
+        return item.nbytes
+    if isinstance(item, (tuple, list)):
+        return sum(nbytes(i) for i in item)
+    return 0
+
+
+class Prefetcher(object):
+    """Iterates over 'iterable' in a background thread, such that the next items are
+    produced while the current one is used. At most 'depth' items are kept ahead, and
+    fewer when the numpy arrays in them exceed 'maxbytes'. Exceptions in 'iterable'
+    are raised again in the consumer, after the items before them.
+
+    Example:
+    for intensity, weights, params in Prefetcher(input.process_job(job), 4):
+        ...
+    """
+
+    def __init__(self, iterable, depth, maxbytes=None):
+        self.iterable = iterable
+        self.depth = max(1, depth)
+        self.maxbytes = maxbytes
+        self.buffer = collections.deque()
+        self.bytes = 0
+        self.done = self.stopped = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def produce(self):
+        try:
+            for item in self.iterable:
+                size = nbytes(item)
+                with self.condition:
+                    while not self.stopped and self.buffer and (len(self.buffer) >= self.depth or (self.maxbytes and self.bytes + size > self.maxbytes)):
+                        self.condition.wait()
+                    if self.stopped:
+                        return
+                    self.buffer.append((item, size))
+                    self.bytes += size
+                    self.condition.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    def __iter__(self):
+        thread = threading.Thread(target=self.produce)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                with self.condition:
+                    while not self.buffer and not self.done:
+                        self.condition.wait()
+                    if not self.buffer:
+                        break
+                    item, size = self.buffer.popleft()
+                    self.bytes -= size
+                    self.condition.notify_all()
+                yield item
+            if self.error is not None:
+                raise self.error
+        finally:
+            with self.condition:
+                self.stopped = True
+                self.condition.notify_all()
+            thread.join()
+
+
 def loop_delayer(delay):
     """Delay a loop such that it runs at most once every 'delay' seconds. Usage example:
     delay = loop_delayer(5)
@@ -808,12 +941,46 @@ def loop_delayer(delay):
     return generator()
 
 
+_numpy_namespace = None
+_expression_cache = {}
+
+
+def compile_expression(expr):
+    """Returns the code object of a transformation expression, compiled only once per expression."""
+    try:
+        return _expression_cache[expr]
+    except KeyError:
+        try:
+            code = compile(expr, '<transformation>', 'eval')
+        except SyntaxError as e:
+            raise ValueError("invalid transformation expression '{0}' ({1})".format(expr, e))
+        _expression_cache[expr] = code
+        return code
+
+
+class Transformation(object):
+    """Coordinate transformation defined by expressions in terms of the axis labels.
+    All numpy functions are available without the 'numpy.' prefix."""
+
+    def __init__(self, labels, exprs):
+        self.labels = tuple(labels)
+        self.exprs = tuple(exprs)
+        self.codes = tuple(compile_expression(expr) for expr in self.exprs)
+
+    def __call__(self, *coords):
+        global _numpy_namespace
+        if _numpy_namespace is None:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')  # deprecated numpy aliases
+                _numpy_namespace = dict((i, getattr(numpy, i)) for i in dir(numpy))
+        ns = dict(_numpy_namespace)
+        ns.update(zip(self.labels, coords))
+        shape = numpy.broadcast(*coords).shape if coords else ()
+        return tuple(numpy.broadcast_to(eval(code, ns), shape) for code in self.codes)
+
+
 def transformation_from_expressions(space, exprs):
-    def transformation(*coords):
-        ns = dict((i, getattr(numpy, i)) for i in dir(numpy))
-        ns.update(**dict((ax.label, coord) for ax, coord in zip(space.axes, coords)))
-        return tuple(eval(expr, ns) for expr in exprs)
-    return transformation
+    return Transformation((ax.label for ax in space.axes), exprs)
 
 
 def format_bytes(bytes):
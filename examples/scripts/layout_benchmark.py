@@ -0,0 +1,73 @@
+from __future__ import print_function, division
+
+# Compares the HDF5 storage layouts of Space.tofile(): for every combination of layout and
+# compression the space is written once, and then read back in thin slices across every axis,
+# the way the fitaid and 'binoculars fit' read rods. Usage:
+#
+#     python layout_benchmark.py [space.hdf5] [--layouts auto cube slab:l] [--compressions gzip lzf]
+#
+# Without an input file a synthetic rod-like space is used.
+
+import os
+import time
+import argparse
+import tempfile
+import numpy
+
+import binoculars.space
+
+
+def synthetic_space():
+    axes = binoculars.space.Axes([binoculars.space.Axis(-0.5, 0.5, 0.005, 'h'), binoculars.space.Axis(-0.5, 0.5, 0.005, 'k'), binoculars.space.Axis(0.1, 4.0, 0.02, 'l')])
+    space = binoculars.space.Space(axes)
+    h, k, l = (grid.astype(numpy.float32) for grid in numpy.ogrid[tuple(slice(0, len(ax)) for ax in axes)])
+    space.contributions[...] = 1
+    space.photons[...] = 1000 / (1 + ((h - 100) ** 2 + (k - 100) ** 2) / 4) * (1 + numpy.cos(l / 10) ** 2)
+    return space
+
+
+def benchmark(space, layout, compression, filename, nslices=20):
+    t0 = time.time()
+    space.tofile(filename, layout=layout, compression=compression)
+    write = time.time() - t0
+
+    results = [os.path.getsize(filename), space.memory_size / write]
+    for ax in space.axes:
+        values = list(ax)[:-1]
+        step = max(1, len(values) // nslices)
+        t0 = time.time()
+        nbytes = 0
+        for value in values[::step]:
+            key = tuple(slice(value, value + ax.res) if other is ax else slice(None) for other in space.axes)
+            nbytes += binoculars.space.Space.fromfile(filename, key).memory_size
+        results.append(nbytes / (time.time() - t0))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('infile', nargs='?', help='space to benchmark, a synthetic space by default')
+    parser.add_argument('--layouts', nargs='+', default=None, help='layouts to compare, auto, cube and a slab across every axis by default')
+    parser.add_argument('--compressions', nargs='+', default=['gzip', 'lzf', 'shuffle+lzf', 'shuffle+lz4', 'none'])
+    parser.add_argument('--tmpdir', default=None, help='directory for the benchmark files')
+    args = parser.parse_args()
+
+    space = binoculars.space.Space.fromfile(args.infile) if args.infile else synthetic_space()
+    layouts = args.layouts or ['auto', 'cube'] + ['slab:{0}'.format(ax.label) for ax in space.axes]
+    print(space)
+
+    header = ['layout', 'compression', 'size (MB)', 'write (MB/s)'] + ['slice {0} (MB/s)'.format(ax.label) for ax in space.axes]
+    print(''.join('{0:>18}'.format(h) for h in header))
+    filename = os.path.join(args.tmpdir or tempfile.gettempdir(), 'binoculars-layout-benchmark.hdf5')
+    try:
+        for layout in layouts:
+            for compression in args.compressions:
+                try:
+                    results = benchmark(space, layout, compression, filename)
+                except ValueError as e:  # e.g. lz4 without hdf5plugin
+                    print('{0:>18}{1:>18}  skipped: {2}'.format(layout, compression, e))
+                    continue
+                print('{0:>18}{1:>18}'.format(layout, compression) + ''.join('{0:>18.1f}'.format(r / 1e6) for r in results))
+    finally:
+        if os.path.exists(filename):
+            os.remove(filename)
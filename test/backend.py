@@ -0,0 +1,245 @@
+import binoculars.backend
+import binoculars.dispatcher
+import binoculars.errors
+import binoculars.space
+import binoculars.util
+import numpy
+import os
+import json
+import time
+import tempfile
+import shutil
+
+import unittest
+
+
+class Input(binoculars.backend.InputBase):  # only the job handling of InputBase, without configuration
+    def __init__(self):
+        self.config = binoculars.util.ConfigSection()
+
+
+class Main(object):  # the parts of binoculars.main.Main that the dispatchers use
+    def __init__(self, costmodel=None):
+        self.costmodel = costmodel
+        self.input = Input()
+        self.config = binoculars.util.ConfigFile(command=['1-25'])
+        self.config.input = {'type': 'test:Input'}
+        self.config.projection = {'type': 'test:Projection', 'resolution': '1'}
+        self.processed = []
+
+    def process_job(self, job):
+        self.processed.append(job.scan)
+        return compute_job(job)
+
+    def clone_config(self):
+        config = binoculars.util.ConfigSectionGroup()
+        config.configfile = self.config
+        config.dispatcher = self.dispatcher.config.copy()
+        return config
+
+    def get_worker(self):
+        return init_worker, compute_job
+
+
+def init_worker(config):
+    pass
+
+
+def compute_job(job):
+    """Returns a Multiverse with a Space per limit set, like main.Main.compute_job()."""
+    spaces = []
+    for offset in (0, 100):
+        space = binoculars.space.Space(binoculars.space.Axes([binoculars.space.Axis(offset + job.scan, offset + job.scan + 9, 1., 'x'), binoculars.space.Axis(0, 2, 1., 'y')]))
+        space.photons[...] = numpy.arange(30.).reshape(10, 3) * job.scan + offset
+        space.contributions[...] = job.scan % 3
+        space.metadata.add_dataset(binoculars.util.MetaBase('job', dict(job.__dict__)))
+        spaces.append(space)
+    verse = binoculars.space.Multiverse(spaces)
+    verse.timings = [(job, 0.1 * job.weight)]
+    return verse
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.costfile = os.path.join(self.tmpdir, 'costs.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_costmodel(self):
+        costmodel = binoculars.backend.CostModel(self.costfile, 'input:projection', nlimits=2, context='roi')
+        job = binoculars.backend.Job(scan=1, firstpoint=0, lastpoint=99, weight=100, pixels=50)
+        self.assertEqual(costmodel.estimate(job), None)
+        self.assertEqual(costmodel.target_weight(10), None)
+
+        costmodel.record(job, 20.)
+        self.assertAlmostEqual(costmodel.unitcost, 20. / (100 * 50 * 2))
+        self.assertAlmostEqual(costmodel.estimate(job), 20.)
+        costmodel.record(job, 30.)
+        self.assertAlmostEqual(costmodel.estimate(job), 22.)  # moving average with smoothing 0.2
+        self.assertFalse(os.path.exists(self.costfile))  # kept in memory until saved
+        costmodel.save()
+
+        reloaded = binoculars.backend.CostModel(self.costfile, 'input:projection', nlimits=2, context='roi')
+        self.assertAlmostEqual(reloaded.unitcost, costmodel.unitcost)
+        self.assertEqual(reloaded.target_weight(11.), 50)  # with the pixels of the recorded job
+        self.assertEqual(reloaded.target_weight(11., pixels=25), 100)
+        self.assertEqual(reloaded.target_weight(1e-9), 1)
+
+        other = binoculars.backend.CostModel(self.costfile, 'input:projection', nlimits=2, context='another roi')
+        self.assertEqual(other.unitcost, None)
+        with open(self.costfile) as fp:
+            self.assertEqual(len(json.load(fp)), 1)
+
+    def test_costmodel_local(self):
+        jobs = [binoculars.backend.Job(scan=scan, firstpoint=0, lastpoint=9, weight=10) for scan in range(1, 6)]
+        for config in ({}, {'worker_sum': 'true'}, {'transport': 'file'}, {'worker_sum': 'true', 'transport': 'file'}):
+            costmodel = binoculars.backend.CostModel(self.costfile, 'input:projection')
+            main = Main(costmodel)
+            main.dispatcher = local = binoculars.dispatcher.Local(dict(config, ncores='2', transport_dir=self.tmpdir), main)
+            local.sum(local.process_jobs(iter(jobs)))
+            self.assertAlmostEqual(costmodel.unitcost, 0.1, msg=config)  # learned in the main process from the timings of the workers
+            self.assertFalse(os.path.exists(self.costfile))
+        costmodel.save()
+        self.assertAlmostEqual(binoculars.backend.CostModel(self.costfile, 'input:projection').unitcost, 0.1)
+
+    def test_balance_jobs(self):
+        costmodel = binoculars.backend.CostModel(self.costfile, 'input:projection')
+        local = binoculars.dispatcher.Local({'ncores': '2'}, Main(costmodel))
+        jobs = (binoculars.backend.Job(scan=scan, firstpoint=0, lastpoint=count - 1, weight=count) for scan, count in enumerate((10, 100, 30)))
+        self.assertTrue(local.balance_jobs(jobs, 2) is jobs)  # nothing learned yet, the jobs stay a generator
+        self.assertEqual(next(jobs).scan, 0)
+
+        costmodel.unitcost = 1.
+        jobs = [binoculars.backend.Job(scan=scan, firstpoint=0, lastpoint=count - 1, weight=count) for scan, count in enumerate((10, 100, 30))]
+        balanced = list(local.balance_jobs(jobs, 2))
+        costs = [job.weight for job in balanced]
+        self.assertEqual(costs, sorted(costs, reverse=True))
+        self.assertTrue(max(costs) <= 140 / 4.)
+        self.assertEqual(sum(costs), 140)
+        self.assertEqual(sorted((job.firstpoint, job.lastpoint) for job in balanced if job.scan == 1), [(0, 33), (34, 67), (68, 99)])
+
+        generated = []
+
+        def get_jobs():
+            for scan, count in enumerate((500, 10, 20, 30, 40, 100)):
+                generated.append(scan)
+                yield binoculars.backend.Job(scan=scan, firstpoint=0, lastpoint=count - 1, weight=count)
+
+        balanced = local.balance_jobs(get_jobs(), 2)
+        self.assertEqual(next(balanced).weight, 500)  # before the tail, passed on without waiting for the rest
+        self.assertEqual(generated, [0, 1, 2, 3, 4])
+        self.assertEqual([job.weight for job in balanced], [10, 40, 34, 34, 32, 30, 20])  # the last 2 jobs per worker are balanced
+
+        local.main.input.config.wait_for_data = True
+        jobs = iter([])
+        self.assertTrue(local.balance_jobs(jobs, 2) is jobs)  # the data is still being acquired
+
+    def test_resume(self):
+        checkpoint = os.path.join(self.tmpdir, 'checkpoint.hdf5')
+        config = {'checkpoint': checkpoint, 'checkpoint_interval': '0'}
+
+        def get_jobs(interrupt=None):
+            for scan in range(1, 26):
+                if scan == interrupt:
+                    raise KeyboardInterrupt
+                yield binoculars.backend.Job(scan=scan, firstpoint=0, lastpoint=9, weight=10)
+
+        main = Main()
+        dispatcher = binoculars.dispatcher.SingleCore({}, main)
+        full = dispatcher.sum(dispatcher.process_jobs(get_jobs())).spaces[0]
+
+        main = Main()
+        dispatcher = binoculars.dispatcher.SingleCore(dict(config), main)
+        self.assertRaises(KeyboardInterrupt, dispatcher.sum, dispatcher.process_jobs(get_jobs(interrupt=24)))
+        self.assertTrue(os.path.exists(checkpoint))  # holds the first 20 jobs, summed in chunks of 10
+
+        main = Main()
+        dispatcher = binoculars.dispatcher.SingleCore(dict(config, resume='true'), main)
+        resumed = dispatcher.sum(dispatcher.process_jobs(dispatcher.resume(get_jobs()))).spaces[0]
+        self.assertEqual(main.processed, list(range(21, 26)))
+        self.assertEqual(resumed.axes, full.axes)
+        self.assertTrue(numpy.allclose(resumed.photons, full.photons))
+        self.assertTrue(numpy.allclose(resumed.contributions, full.contributions))
+        self.assertEqual(sorted(set(int(job['scan']) for job in binoculars.dispatcher.stored_jobs(checkpoint)[1])), list(range(1, 26)))  # listed in every space
+
+        dispatcher.discard_checkpoint()
+        self.assertFalse(os.path.exists(checkpoint))
+        self.assertRaises(binoculars.errors.ConfigError, binoculars.dispatcher.SingleCore, dict(config, fan_in='4'), main)  # a reduction tree is not checkpointed
+        self.assertRaises(binoculars.errors.ConfigError, binoculars.dispatcher.Local, dict(config, fan_in='4'), main)
+        main = Main()
+        dispatcher = binoculars.dispatcher.SingleCore(dict(config, resume='true'), main)
+        dispatcher.sum(dispatcher.process_jobs(dispatcher.resume(get_jobs())))
+        self.assertEqual(main.processed, list(range(1, 26)))  # nothing to resume from, a full run
+
+    def test_append_without_config(self):
+        destination = binoculars.dispatcher.Destination()
+        destination.set_final_filename(os.path.join(self.tmpdir, 'output.hdf5'), False)
+        destination.set_append(True)
+        self.assertEqual(destination.stored_jobs(), [])  # nothing to append to yet
+        compute_job(binoculars.backend.Job(scan=1)).spaces[0].tofile(destination.filename)
+        self.assertRaises(binoculars.errors.ConfigError, destination.stored_jobs)
+
+    def test_local(self):
+        jobs = [binoculars.backend.Job(scan=scan, firstpoint=0, lastpoint=9, weight=10) for scan in range(1, 26)]
+        main = Main()
+        singlecore = binoculars.dispatcher.SingleCore({}, main)
+        expected = singlecore.sum(singlecore.process_jobs(jobs))
+
+        for config in ({}, {'worker_sum': 'true'}, {'worker_sum': 'true', 'worker_sum_size': '0'}, {'transport': 'file'}, {'worker_sum': 'true', 'transport': 'file', 'worker_sum_size': '0'}, {'fan_in': '3'}, {'sum_threads': '2'}):
+            config = dict(config, ncores='2', transport_dir=self.tmpdir)
+            main.dispatcher = local = binoculars.dispatcher.Local(dict(config), main)
+            result = local.sum(local.process_jobs(iter(jobs)))
+            for space, other in zip(result.spaces, expected.spaces):
+                self.assertEqual(space.axes, other.axes, config)
+                self.assertTrue(numpy.allclose(space.photons, other.photons), config)
+                self.assertTrue((space.contributions == other.contributions).all(), config)
+            self.assertEqual(os.listdir(self.tmpdir), [])  # no scratch files left
+
+    def get_verse(self, value):
+        space = binoculars.space.Space(binoculars.space.Axes([binoculars.space.Axis(0, 99, 1., 'x')]))
+        space.photons[...] = value
+        space.contributions[...] = 1
+        return binoculars.space.Multiverse([space])
+
+    def test_jobcache(self):
+        directory = os.path.join(self.tmpdir, 'cache')
+        datafile = os.path.join(self.tmpdir, 'scan.edf')
+        with open(datafile, 'w') as fp:
+            fp.write('first')
+        cache = binoculars.backend.JobCache(directory, 2**20, 'roi')
+        job = binoculars.backend.Job(scan=1, firstpoint=0, lastpoint=9, weight=10)
+
+        self.assertEqual(cache.get(job, [datafile]), None)  # miss
+        cache.put(job, [datafile], self.get_verse(3.))
+        self.assertTrue((cache.get(job, [datafile]).spaces[0].photons == 3.).all())  # hit
+        self.assertEqual(cache.get(binoculars.backend.Job(scan=1, firstpoint=0, lastpoint=8, weight=9), [datafile]), None)
+        self.assertEqual(binoculars.backend.JobCache(directory, 2**20, 'another roi').get(job, [datafile]), None)
+
+        with open(datafile, 'w') as fp:
+            fp.write('second frame')
+        self.assertEqual(cache.get(job, [datafile]), None)  # the data changed
+        os.remove(datafile)
+        self.assertEqual(cache.get(job, [datafile]), None)
+
+    def test_jobcache_evict(self):
+        directory = os.path.join(self.tmpdir, 'cache')
+        cache = binoculars.backend.JobCache(directory, 2**20, '')
+        jobs = [binoculars.backend.Job(scan=scan, weight=1) for scan in range(4)]
+        now = time.time()
+        for index, job in enumerate(jobs[:3]):
+            cache.put(job, None, self.get_verse(index))
+            os.utime(cache.get_filename(job, None), (now - 100 + index, now - 100 + index))
+        entrysize = os.path.getsize(cache.get_filename(jobs[0], None))
+        self.assertEqual(cache.size, 3 * entrysize)  # counted once, then kept up to date
+        self.assertTrue(cache.get(jobs[0], None) is not None)  # now the most recently used
+
+        cache = binoculars.backend.JobCache(directory, 2.5 * entrysize, '')
+        cache.put(jobs[3], None, self.get_verse(3))  # beyond maxsize, the least recently used are removed
+        self.assertEqual(cache.size, 2 * entrysize)
+        self.assertEqual(len(os.listdir(directory)), 2)
+        self.assertEqual([cache.get(job, None) is None for job in jobs], [False, True, True, False])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import binoculars.main
+import binoculars.space
+import binoculars.backend
+import numpy
+
+import unittest
+
+try:
+    from binoculars.backends import id03
+except ImportError:  # PyMca is not installed
+    id03 = None
+
+
+class Scan(object):  # a synthetic scan instead of the spec file and the images
+    shape = 40, 50
+    npoints = 7
+
+    def get_scan(self, scannumber):
+        return scannumber
+
+    def get_scan_params(self, scan):
+        self.metadict['wavelength'] = 0.5
+        return 0.5, numpy.identity(3)
+
+    def get_point_params(self, scan, first, last):
+        params = numpy.zeros((self.npoints, self.nparams))
+        params[:, 0] = numpy.linspace(5, 8, self.npoints)  # gamma or ccdy
+        params[:, 1] = numpy.linspace(20, 30, self.npoints)  # delta or ccdz
+        params[:, 2] = numpy.linspace(10, 11, self.npoints)  # theta
+        params[:, 5] = 0.3  # mu
+        params[:, 6:8] = 1  # mon, transm
+        return params[first:last+1]
+
+    def get_images(self, scan, first, last, dry_run=False):
+        for point in range(first, last + 1):
+            yield numpy.ones(self.shape)
+
+
+if id03 is not None:
+    class EH1(Scan, id03.EH1):
+        nparams = 10
+
+    class EH2(Scan, id03.EH2):
+        nparams = 8
+
+    class GisaxsDetector(Scan, id03.GisaxsDetector):
+        nparams = 8
+        shape = 45, 45  # the sample pixel distance correction broadcasts the rows against the columns
+
+
+class Main(object):  # the parts of binoculars.main.Main that estimate the bounds of a job
+    get_bounds = binoculars.main.Main.__dict__['get_bounds']
+
+    def __init__(self, input, projection):
+        self.input = input
+        self.projection = projection
+
+
+@unittest.skipIf(id03 is None, 'PyMca is not installed')
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        config = dict(specfile='', sdd='600', pixelsize='0.055, 0.055', xmask='3-35', ymask='0-15,25-38')
+        self.inputs = [
+            EH1(dict(config, centralpixel='20, 25')),
+            EH2(dict(config, centralpixel='20, 25')),
+            GisaxsDetector(dict(config, directbeam='10, 30', directbeam_coords='5, 20')),
+        ]
+        self.job = binoculars.backend.Job(scan=1, firstpoint=1, lastpoint=5, weight=5)
+
+    def project(self, main):
+        """Returns the Axes of the output of processing the full images of the job, None if it is empty."""
+        projection = main.projection
+        verse = binoculars.space.EmptySpace()
+        for intensity, weights, params in main.input.process_job(self.job):
+            coordinates = projection.project(*params)
+            verse += binoculars.space.Space.from_image(projection.config.resolution, projection.get_axis_labels(), coordinates, intensity, weights, limits=projection.config.limits and projection.config.limits[0])
+        if isinstance(verse, binoculars.space.EmptySpace):
+            return None
+        return verse.axes
+
+    def test_edges(self):
+        for input in self.inputs:
+            for config in ({'resolution': '0.01'}, {'resolution': '0.01, 0.03', 'limits': '[5.:, :27.5]'}):
+                projection = id03.GammaDelta(dict(config))
+                main = Main(input, projection)
+                metadict = input.metadict = {'UB': None}
+                bounds = main.get_bounds(self.job)
+                self.assertTrue(input.metadict is metadict)  # the metadata of a job in progress stays as it is
+                self.assertEqual(len(bounds), 1)
+                axes = self.project(main)
+                if axes is None:  # nothing within the limits
+                    self.assertEqual(bounds[0], None)
+                elif projection.config.limits is None:
+                    self.assertEqual(bounds[0], axes)
+                else:  # the limits cut the box around the edges, not the edges themselves
+                    self.assertTrue(all(ax in bound for ax, bound in zip(axes, bounds[0])))
+                    self.assertEqual([bound.imin for bound in bounds[0]], [ax.imin for ax in axes])
+
+    def test_pixels(self):
+        main = Main(self.inputs[0], id03.pixels({'resolution': '1'}))
+        self.assertEqual(main.get_bounds(self.job), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import binoculars.edf
+import binoculars.errors
+import numpy
+import gzip
+import zlib
+import os
+import tempfile
+import shutil
+
+import unittest
+
+
+def edf_frame(data, compression=None, **fields):
+    raw = data.tobytes()
+    if compression == 'ZCompression':
+        raw = zlib.compress(raw)
+    header = ['{']
+    header.append('DataType = {0} ;'.format({'uint16': 'UnsignedShort', 'float32': 'FloatValue', 'int32': 'SignedInteger'}[data.dtype.name]))
+    header.append('ByteOrder = {0} ;'.format('HighByteFirst' if data.dtype.byteorder == '>' else 'LowByteFirst'))
+    header.append('Dim_1 = {0} ;'.format(data.shape[1]))
+    header.append('Dim_2 = {0} ;'.format(data.shape[0]))
+    header.append('Size = {0} ;'.format(len(raw)))
+    if compression:
+        header.append('Compression = {0} ;'.format(compression))
+    header.extend('{0} = {1} ;'.format(key, value) for key, value in sorted(fields.items()))
+    header = '\n'.join(header) + '\n'
+    header = header.ljust(-(-(len(header) + 2) // 512) * 512 - 2) + '}\n'
+    return header.encode('ascii') + raw
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        random = numpy.random.RandomState(0)
+        self.frames = [
+            random.randint(0, 1000, (20, 30)).astype(numpy.uint16),
+            random.rand(20, 30).astype('>f4'),
+            random.randint(-5, 5, (20, 30)).astype(numpy.int32),
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        filename = os.path.join(self.tmpdir, name)
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(filename, 'wb') as fp:
+            fp.write(content)
+        return filename
+
+    def test_frames(self):
+        content = b''.join(edf_frame(frame, point=index) for index, frame in enumerate(self.frames))
+        edf = binoculars.edf.EdfFile(self.write('zap.edf', content))
+        self.assertEqual(edf.GetNumImages(), 3)
+        for index, frame in enumerate(self.frames):
+            data = edf.GetData(index)
+            self.assertTrue(isinstance(data, numpy.memmap))
+            self.assertFalse(data.flags.writeable)
+            self.assertEqual(data.shape, (20, 30))
+            self.assertTrue((data == frame).all())
+            self.assertEqual(edf.GetHeader(index)['point'], str(index))
+
+    def test_compressed(self):
+        content = edf_frame(self.frames[0], compression='ZCompression', x_beam=12.5) + edf_frame(self.frames[1])
+        for name in ('compressed.edf', 'compressed.edf.gz'):
+            edf = binoculars.edf.EdfFile(self.write(name, content))
+            self.assertTrue((edf.GetData(0) == self.frames[0]).all())
+            self.assertTrue(edf.GetData(0) is not edf.GetData(1))
+            self.assertTrue((edf.GetData(1) == self.frames[1]).all())
+            self.assertEqual(float(edf.GetHeader(0)['x_beam']), 12.5)
+
+    def test_corrupt(self):
+        content = edf_frame(self.frames[0])
+        self.assertRaises(binoculars.errors.FileError, binoculars.edf.EdfFile, self.write('truncated.edf', content[:-10]))
+        self.assertRaises(binoculars.errors.FileError, binoculars.edf.EdfFile, self.write('garbage.edf', content + b'garbage'))
+        self.assertEqual(binoculars.edf.EdfFile(self.write('empty.edf', b'')).GetNumImages(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import binoculars.backend
+import binoculars.space
+import binoculars.util
+import numpy
+import os
+import time
+import tempfile
+import shutil
+
+import unittest
+
+try:
+    from binoculars.backends import id03
+except ImportError:  # PyMca is not installed
+    id03 = None
+
+
+class Scan(object):
+    def __init__(self, number, ub):
+        self._number = number
+        self.ub = ub
+
+    def number(self):
+        return self._number
+
+    def header(self, key):
+        lines = ['#S {0}'.format(self._number)]
+        if self.ub is not None:
+            lines += ['#G0 0', '#G1 0', '#G3 {0}'.format(' '.join(str(value) for value in self.ub))]
+        return [line for line in lines if line[1:].startswith(key)]
+
+    def data(self):
+        return numpy.array([[self._number, 0.5]])
+
+
+class Specfile(object):  # stands in for PyMca's Specfile, a scan per line: '<number> <UB value> or -'
+    def __init__(self, filename):
+        self.filename = filename
+        self.parses = ['full']
+        self.read()
+
+    def read(self):
+        self.scans = {}
+        with open(self.filename) as fp:
+            for line in fp:
+                number, ub = line.split()
+                self.scans[int(number)] = Scan(int(number), None if ub == '-' else [float(ub)] * 9)
+
+    def update(self):
+        self.read()
+        self.parses.append('update')
+
+    def select(self, key):
+        number = int(key.split('.')[0])
+        if number not in self.scans:
+            raise id03.specfile.error('scan {0} not found'.format(number))
+        return self.scans[number]
+
+
+@unittest.skipIf(id03 is None, 'PyMca is not installed')
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.specfilewrapper = id03.specfilewrapper
+        id03.specfilewrapper = type('specfilewrapper', (object, ), {'Specfile': Specfile})
+
+    def tearDown(self):
+        id03.specfilewrapper = self.specfilewrapper
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, filename, lines, mtime):
+        with open(filename, 'w') as fp:
+            fp.write(''.join(line + '\n' for line in lines))
+        os.utime(filename, (mtime, mtime))
+
+    def test_specindex(self):
+        filename = os.path.join(self.tmpdir, 'sample.spec')
+        self.write(filename, ['1 2', '2 -', '3 -'], 1000)
+        index = id03.get_specindex(filename)
+        self.assertTrue(id03.get_specindex(os.path.relpath(filename)) is index)  # shared
+
+        scan = index.get_scan(2)
+        self.assertTrue(index.get_scan(2) is scan)
+        self.assertRaises(id03.specfile.error, index.get_scan, 4)
+        self.assertTrue((index.get_ub(3) == 2).all())  # from scan 1, the last one with a G header
+        self.assertEqual(sorted(index.ubs), [1, 2, 3])
+
+        self.write(filename, ['1 2', '2 -', '3 -', '4 5'], 1001)  # a scan is appended
+        self.assertTrue(index.get_scan(2) is not scan)  # selected again after the update
+        self.assertEqual(index.get_scan(4).number(), 4)
+        self.assertTrue((index.get_ub(4) == 5).all())
+        self.assertTrue((index.get_ub(3) == 2).all())  # still known
+        self.assertEqual(index.spec.parses, ['full', 'update'])
+
+        self.write(filename, ['1 7', '2 -'], 1002)  # rewritten
+        self.assertTrue((index.get_ub(2) == 7).all())
+        self.assertRaises(id03.specfile.error, index.get_scan, 4)
+        self.assertEqual(index.spec.parses, ['full'])
+
+        self.write(filename, ['1 8', '2 -'], 1003)  # same size, changed
+        self.assertTrue((index.get_ub(2) == 8).all())
+        self.assertEqual(index.get_ub(0), None)
+
+    def test_jobcache(self):
+        filename = os.path.join(self.tmpdir, 'sample.spec')
+        background = os.path.join(self.tmpdir, 'background.edf')
+        open(background, 'w').close()
+        input = id03.ID03Input.__new__(id03.ID03Input)  # only the job files, without configuration
+        input.config = binoculars.util.ConfigSection(specfile=filename, maskfile=None, background=background)
+        cache = binoculars.backend.JobCache(os.path.join(self.tmpdir, 'cache'), 2**20, '')
+        jobs = [binoculars.backend.Job(scan=scan, firstpoint=0, lastpoint=9, weight=10) for scan in (1, 2, 3, 4)]
+        space = binoculars.space.Space(binoculars.space.Axes([binoculars.space.Axis(0, 9, 1., 'x')]))
+
+        self.write(filename, ['1 2', '2 -', '3 -'], 1000)
+        for job in jobs[:3]:
+            cache.put(job, input.get_job_files(job), binoculars.space.Multiverse([space]))
+
+        self.write(filename, ['1 2', '2 -', '3 -', '4 5'], 1001)  # a scan is appended
+        self.assertEqual([cache.get(job, input.get_job_files(job)) is None for job in jobs], [False, False, False, True])
+
+        self.write(filename, ['1 3', '2 -', '3 -', '4 5'], 1002)  # another UB matrix for scans 1 to 3
+        self.assertEqual([cache.get(job, input.get_job_files(job)) is None for job in jobs], [True, True, True, True])
+
+        self.write(filename, ['1 2', '2 -', '3 -', '4 5'], 1003)
+        os.utime(background, (2000, 2000))  # the other files still count
+        self.assertEqual(cache.get(jobs[0], input.get_job_files(jobs[0])), None)
+
+    def test_folderindex(self):
+        parsed = []
+
+        def parse(name):  # <prefix>_<scan>_<point>.edf
+            parsed.append(name)
+            scan, point = name.split('.')[0].split('_')[-2:]
+            return int(scan), int(point)
+
+        def touch(*names):
+            for name in names:
+                open(os.path.join(self.tmpdir, name), 'w').close()
+            os.utime(self.tmpdir, (mtime, mtime))
+
+        mtime = 1000
+        touch('img_1_0.edf', 'img_1_1.edf', 'img_2_0.edf', 'notes.txt', '.img_1_2.edf.swp')
+        index = id03.get_folderindex(self.tmpdir, parse)
+        self.assertTrue(id03.get_folderindex(os.path.join(self.tmpdir, '.'), parse) is index)
+        self.assertEqual(index.get(1), {0: os.path.join(self.tmpdir, 'img_1_0.edf'), 1: os.path.join(self.tmpdir, 'img_1_1.edf')})
+        self.assertEqual(index.get(3), {})
+        self.assertEqual(sorted(parsed), ['img_1_0.edf', 'img_1_1.edf', 'img_2_0.edf', 'notes.txt'])
+
+        index.get(1)[5] = 'elsewhere'
+        self.assertEqual(sorted(index.get(1)), [0, 1])  # a copy
+        self.assertEqual(len(parsed), 4)  # not listed again, the directory did not change
+
+        mtime = 1001
+        touch('img_1_2.edf', 'img_3_0.edf')
+        self.assertEqual(sorted(index.get(1)), [0, 1, 2])
+        self.assertEqual(sorted(index.get(3)), [0])
+        self.assertEqual(parsed[4:], ['img_1_2.edf', 'img_3_0.edf'])  # only the new names
+
+        mtime = 1002
+        os.remove(os.path.join(self.tmpdir, 'img_1_0.edf'))
+        touch()
+        self.assertEqual(sorted(index.get(1)), [1, 2])
+
+        mtime = time.time()  # too recent to tell whether it changed since
+        index.get(1)
+        touch('img_1_3.edf')
+        self.assertEqual(sorted(index.get(1)), [1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import binoculars.dispatcher
+import binoculars.backend
+import binoculars.errors
+import binoculars.util
+import os
+import sys
+import json
+import tempfile
+import shutil
+
+import unittest
+
+
+# stand-ins for the OAR commands, oarsub numbers the jobs from 42 and fails for the submissions
+# listed in failing, oarstat reports the states in states.json and logs every call
+OARSUB = '''#!{0}
+import os, sys
+directory = os.path.dirname(os.path.abspath(__file__))
+with open(os.path.join(directory, 'submitted'), 'a') as fp:
+    fp.write(sys.argv[-1] + '\\n')
+with open(os.path.join(directory, 'submitted')) as fp:
+    count = len(fp.readlines())
+failing = os.path.join(directory, 'failing')
+if os.path.exists(failing):
+    with open(failing) as fp:
+        if str(count) in fp.read().split():
+            print('[ADMISSION RULE] Error: walltime too long')
+            sys.exit(1)
+print('[ADMISSION RULE] Set default walltime')
+print('OAR_JOB_ID={{0}}'.format(41 + count))
+'''
+
+OARSTAT = '''#!{0}
+import os, sys, json
+directory = os.path.dirname(os.path.abspath(__file__))
+with open(os.path.join(directory, 'calls'), 'a') as fp:
+    fp.write(' '.join(sys.argv[1:]) + '\\n')
+with open(os.path.join(directory, 'states.json')) as fp:
+    states = json.load(fp)
+for jobid in sys.argv[3::2]:
+    if jobid in states:
+        print('{{0}}: {{1}}'.format(jobid, states[jobid]))
+'''
+
+
+class Main(object):  # the parts of binoculars.main.Main that Oar.process_jobs() uses
+    costmodel = None
+
+    def __init__(self):
+        self.input = binoculars.util.ConfigSection(config=binoculars.util.ConfigSection(target_weight=1))
+
+    def clone_config(self):
+        config = binoculars.util.ConfigSectionGroup()
+        config.dispatcher.destination = binoculars.dispatcher.Destination()
+        return config
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for name, script in (('oarsub', OARSUB), ('oarstat', OARSTAT)):
+            filename = os.path.join(self.tmpdir, name)
+            with open(filename, 'w') as fp:
+                fp.write(script.format(sys.executable))
+            os.chmod(filename, 0o755)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = self.tmpdir + os.pathsep + self.path
+        self.oar = binoculars.dispatcher.Oar({'tmpdir': self.tmpdir, 'executable': 'binoculars', 'poll_interval': '0'}, None)
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.tmpdir)
+
+    def set_states(self, states):
+        with open(os.path.join(self.tmpdir, 'states.json'), 'w') as fp:
+            json.dump(states, fp)
+
+    def get_calls(self):
+        with open(os.path.join(self.tmpdir, 'calls')) as fp:
+            return fp.read().splitlines()
+
+    def test_oarsub(self):
+        self.assertEqual(self.oar.oarsub('job.zpi'), '42')
+
+    def test_oarstat(self):
+        self.set_states({'1': 'Running', '2': 'Waiting', '3': 'Terminated'})
+        states = self.oar.oarstat(['1', '2', '3', '4'])
+        self.assertEqual(states, {'1': 'Running', '2': 'Waiting', '3': 'Terminated', '4': 'Unknown'})
+        self.assertEqual(len(self.get_calls()), 1)
+        self.assertEqual(self.oar.oarstat([]), {})
+
+    def test_oarwait(self):
+        self.set_states({'1': 'Running', '2': 'Finishing'})
+        marker = os.path.join(self.tmpdir, 'binoculars-1-jobout.hdf5')
+        open(marker, 'w').close()
+        self.oar.markers = {'1': marker}
+        jobs = ['1', '2']
+        self.oar.oarwait(jobs)
+        self.assertEqual(jobs, [])
+        self.assertEqual(self.get_calls(), ['-s -j 2'])
+
+    def test_oarwait_unknown(self):
+        self.set_states({'1': 'Running'})
+        self.oar.markers = {}
+        self.oar.config.unknown_timeout = 0
+        jobs = ['1', '2']
+        self.assertRaises(binoculars.errors.SubprocessError, self.oar.oarwait, jobs)  # job 2 is not known to OAR
+        self.assertEqual(jobs, ['1', '2'])
+
+    def test_oarsub_failed(self):
+        with open(os.path.join(self.tmpdir, 'failing'), 'w') as fp:
+            fp.write('2 5')  # the second job and the first summation
+        self.oar.main = Main()
+        self.oar.config.fan_in = 3
+        jobids = list(self.oar.process_jobs(binoculars.backend.Job(scan=scan) for scan in range(7)))
+        self.assertEqual(jobids, [str(jobid) for jobid in (42, 44, 45, 47, 48, 49, 50, 51)])
+        self.assertEqual(sorted(self.oar.markers), jobids)
+        self.assertEqual(self.oar.failed, [self.oar.configfiles[1]])
+
+        configs = [binoculars.util.zpi_load(fn) for fn in self.oar.configfiles]
+        leaves = [config.dispatcher.destination.filename for config in configs if config.dispatcher.jobs]
+        self.assertEqual(configs[8].dispatcher.sum, leaves[4:7])
+        self.assertEqual(configs[-1].dispatcher.sum, [configs[8].dispatcher.destination.filename, leaves[0], leaves[2], leaves[3]])  # also those of the failed summation
+        self.assertFalse(leaves[1] in self.oar.intermediates)
+
+        self.assertRaises(binoculars.errors.SubprocessError, self.oar.sum, [])
+        self.assertEqual([fn for fn in self.oar.configfiles if os.path.exists(fn)], self.oar.failed)
+
+
+    def test_reduction_tree(self):
+        self.oar.main = Main()
+        self.oar.config.fan_in = 3
+        jobids = list(self.oar.process_jobs(binoculars.backend.Job(scan=scan) for scan in range(7)))
+        self.assertEqual(len(jobids), 7 + 2 + 1)
+        configs = [binoculars.util.zpi_load(fn) for fn in self.oar.configfiles]
+        leaves = [config.dispatcher.destination.filename for config in configs if config.dispatcher.jobs]
+        summations = [config for config in configs if config.dispatcher.sum and config.dispatcher.destination.type == 'tmp']
+        self.assertEqual(len(leaves), 7)
+        self.assertEqual([config.dispatcher.sum for config in summations], [leaves[0:3], leaves[3:6]])
+        self.assertEqual(configs[-1].dispatcher.sum, [leaves[6]] + [config.dispatcher.destination.filename for config in summations])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import binoculars.util
+import numpy
+
+import unittest
+
+try:
+    from binoculars.backends import sixs
+except ImportError:  # PyTables, pyFAI or the hkl library is not installed
+    sixs = None
+
+
+class Node(object):  # the image dataset of a nexus file, recording the slabs that are read
+    def __init__(self, images, chunk):
+        self.images = images
+        self.chunkshape = None if chunk is None else (chunk, ) + images.shape[1:]
+        self.reads = []
+
+    def __getitem__(self, key):
+        self.reads.append((key.start, key.stop))
+        return self.images[key]
+
+
+@unittest.skipIf(sixs is None, 'the SIXS backend cannot be imported')
+class TestCase(unittest.TestCase):
+    def get_input(self, **config):
+        input = sixs.FlyScanUHV.__new__(sixs.FlyScanUHV)  # only the reading, without configuration
+        input.config = binoculars.util.ConfigSection(**config)
+        return input
+
+    def test_images(self):
+        images = numpy.arange(50 * 4 * 3).reshape(50, 4, 3)
+        for chunk in (None, 1, 5, 16):
+            for slabsize in (1, 7, 64):
+                input = self.get_input(slabsize=slabsize)
+                for first, last in ((0, 49), (3, 41), (12, 12)):
+                    node = Node(images, chunk)
+                    read = list(input.get_images(node, first, last))
+                    self.assertEqual(len(read), last - first + 1)
+                    self.assertTrue((numpy.array(read) == images[first:last + 1]).all())
+
+                    starts, stops = zip(*node.reads)
+                    self.assertEqual((starts[0], stops[-1]), (first, last + 1))
+                    self.assertEqual(starts[1:], stops[:-1])  # consecutive slabs
+                    step = chunk or 1
+                    self.assertTrue(all(start % step == 0 for start in starts[1:]))  # on chunk boundaries
+                    self.assertTrue(all(stop - start <= max(step, slabsize) for start, stop in node.reads))
+                    if slabsize >= step:
+                        self.assertTrue(len(node.reads) <= (last - first) // (slabsize // step * step) + 2)
+
+    def test_attenuation(self):
+        nodes = {'attenuation': numpy.arange(10.)}
+        input = self.get_input(attenuation_coefficient=1.5)
+        self.assertEqual(list(input.get_attenuation(slice(2, 5), nodes, 2)), [4., 5., 6.])
+        attenuation = input.get_attenuation(slice(5, 12), nodes, 2)  # past the end of the attenuation data
+        self.assertEqual(list(attenuation), [7., 8., 9.] + [sixs.WRONG_ATTENUATION] * 4)
+        self.assertRaises(Exception, input.get_attenuation, slice(2, 5), {'attenuation': None}, 2)
+        self.assertEqual(self.get_input(attenuation_coefficient=None).get_attenuation(slice(2, 5), nodes, 2), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,303 @@
+import binoculars.space
+import binoculars.util
+import numpy
+import h5py
+import os
+import tempfile
+import shutil
+
+import unittest
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        random = numpy.random.RandomState(0)
+        self.resolutions = (0.1, 0.1, 0.2)
+        self.labels = ('h', 'k', 'l')
+        self.images = []
+        for index in range(5):
+            coordinates = tuple(random.randn(20, 30) * scale + index for scale in (1, 2, 0.5))
+            intensity = random.rand(20, 30)
+            self.images.append((coordinates, intensity, numpy.ones_like(intensity)))
+
+    def get_spaces(self):
+        dense = binoculars.space.Accumulator(self.resolutions, self.labels)
+        sparse = binoculars.space.Accumulator(self.resolutions, self.labels, sparse=True)
+        for image in self.images:
+            dense.add_image(*image)
+            sparse.add_image(*image)
+        return dense.get(), sparse.get()
+
+    def assertSpaceEqual(self, first, second):
+        self.assertEqual(first.axes, second.axes)
+        self.assertTrue(numpy.allclose(first.photons, second.photons))
+        self.assertTrue(numpy.allclose(first.contributions, second.contributions))
+
+    def assertFileEqual(self, filename, space):
+        with h5py.File(filename, 'r') as fp:
+            self.assertEqual(binoculars.space.Axes.fromfile(fp['binoculars']), space.axes)
+            self.assertTrue(numpy.allclose(fp['binoculars/counts'][...], space.photons))
+            self.assertTrue(numpy.allclose(fp['binoculars/contributions'][...], space.contributions))
+
+    def test_sparse(self):
+        dense, sparse = self.get_spaces()
+        self.assertTrue(isinstance(sparse, binoculars.space.SparseSpace))
+        self.assertSpaceEqual(dense, sparse.todense())
+        self.assertSpaceEqual(dense, dense.tosparse().todense())
+        self.assertSpaceEqual(dense.project('l'), sparse.project('l').todense())
+        self.assertSpaceEqual(dense.slice('h', slice(-1, 1)), sparse.slice('h', slice(-1, 1)).todense())
+
+        dense.trim()
+        sparse.trim()
+        self.assertSpaceEqual(dense, sparse.todense())
+
+    def test_sparse_add(self):
+        dense, sparse = self.get_spaces()
+        other = binoculars.space.Space.from_image(self.resolutions, self.labels, *self.images[0])
+        self.assertSpaceEqual(dense + other, (sparse + other).todense())
+        self.assertSpaceEqual(dense + dense, (sparse + sparse).todense())
+        dense += sparse
+        sparse += sparse.copy()
+        self.assertSpaceEqual(dense, sparse.todense())
+
+    def test_dtypes(self):
+        dense, sparse = self.get_spaces()
+        compact = binoculars.space.Accumulator(self.resolutions, self.labels, photons_dtype=numpy.float32, contributions_dtype=numpy.uint32)
+        for image in self.images:
+            compact.add_image(*image)
+        compact = compact.get()
+        self.assertEqual(compact.photons.dtype, numpy.float32)
+        self.assertEqual(compact.contributions.dtype, numpy.uint32)
+        self.assertTrue(numpy.allclose(compact.photons, dense.photons, rtol=1e-6))
+        self.assertTrue((compact.contributions == dense.contributions).all())
+
+        overflow = binoculars.space.Space(dense.axes, contributions_dtype=numpy.uint8)
+        self.assertRaises(ValueError, overflow.__iadd__, dense * 0.01)
+        self.assertRaises(ValueError, compact.__iadd__, dense * 3)
+
+    def test_memmap(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            dense, sparse = self.get_spaces()
+            mapped = binoculars.space.sum([dense, sparse.todense()], tmpdir=tmpdir)
+            self.assertTrue(isinstance(mapped.photons, numpy.memmap))
+            self.assertTrue(numpy.allclose(mapped.photons, 2 * dense.photons))
+            self.assertTrue(numpy.allclose(mapped.contributions, 2 * dense.contributions))
+            mapped.trim()
+            self.assertTrue(isinstance(mapped.photons, numpy.memmap))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_lazy(self):
+        dense, sparse = self.get_spaces()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'lazy.hdf5')
+            dense.tofile(filename)
+            lazy = binoculars.space.Space.fromfile(filename, lazy=True)
+            self.assertTrue(isinstance(lazy, binoculars.space.LazySpace))
+            self.assertEqual(lazy.axes, dense.axes)
+            self.assertSpaceEqual(lazy, dense)
+            self.assertSpaceEqual(lazy.project('l'), dense.project('l'))
+            self.assertSpaceEqual(lazy.project('h', 'l'), dense.project('h', 'l'))
+            self.assertSpaceEqual(lazy.slice('h', slice(-1, 1)), dense.slice('h', slice(-1, 1)))
+            self.assertSpaceEqual(lazy.slice('k', 0.5), dense.slice('k', 0.5))
+            self.assertSpaceEqual(lazy.reorder(('l', 'h', 'k')), dense.reorder(('l', 'h', 'k')))
+            self.assertSpaceEqual(lazy[-1:1, 0.5, :], dense[-1:1, 0.5, :])
+
+            # the same selection read in blocks of a few grid points
+            selection = lazy.slice('k', slice(-2, 3)).project('h').reorder(('l', 'k'))
+            expected = dense.slice('k', slice(-2, 3)).project('h').reorder(('l', 'k'))
+            computed = selection.compute(blocksize=7)
+            self.assertSpaceEqual(computed, expected)
+            self.assertTrue(selection.compute() is computed)
+            self.assertSpaceEqual(binoculars.space.Space.fromfile(filename, key=(slice(-1, 1), slice(None), slice(None)), lazy=True), dense[-1:1, :, :])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_chunks(self):
+        dense, sparse = self.get_spaces()
+        self.assertEqual(binoculars.space.get_chunks(dense.axes, 'auto', 8), True)
+        chunks = binoculars.space.get_chunks(dense.axes, 'slab:l', 8, chunksize=2**12)
+        self.assertEqual(chunks[2], 1)
+        self.assertTrue(numpy.prod(chunks) * 8 <= 2**12)
+        self.assertRaises(ValueError, binoculars.space.get_chunks, dense.axes, 'diagonal', 8)
+        self.assertRaises(ValueError, binoculars.space.get_filters, 'zip')
+        self.assertEqual(binoculars.space.get_filters('shuffle+lzf'), {'shuffle': True, 'compression': 'lzf'})
+
+    def test_block_rebin(self):
+        dense, sparse = self.get_spaces()
+        coarse = binoculars.space.block_rebin(dense, (2, 3, 1))
+        self.assertTrue(numpy.allclose([ax.res for ax in coarse.axes], (0.2, 0.3, 0.2)))
+        self.assertAlmostEqual(coarse.photons.sum(), dense.photons.sum())
+        self.assertEqual(coarse.contributions.sum(), dense.contributions.sum())
+        self.assertSpaceEqual(coarse.project('h', 'k'), dense.project('h', 'k'))
+        left, right, axis = binoculars.space.Axis(-3, 7, 1.0, 'x').rebin(2)
+        self.assertEqual((left, right, axis.imin, axis.imax), (2, 2, -2, 4))
+        left, right, axis = binoculars.space.Axis(-3, 7, 1.0, 'x').rebin(3)
+        self.assertEqual((left, right, axis.imin, axis.imax), (1, 0, -1, 2))
+
+    def test_rebin_centred(self):
+        axes = binoculars.space.Axes([binoculars.space.Axis(0, 40, 1.0, 'x'), binoculars.space.Axis(-5, 5, 1.0, 'y')])
+        x = numpy.arange(41.)[:, numpy.newaxis]
+        for centre in (20, 20.3):
+            space = binoculars.space.Space(axes)
+            space.photons[...] = numpy.exp(-(x - centre) ** 2 / 18) * numpy.ones((1, 11))
+            space.contributions[...] = 1
+            for factor in (2, 3, 4, 8):
+                coarse = space.rebin((factor, 1))
+                self.assertEqual(coarse.axes[1], axes[1])
+                self.assertEqual(list(coarse.axes[0]), [factor * index for index in range(len(coarse.axes[0]))])
+                self.assertTrue(coarse.axes[0].min - factor / 2. <= 0 and coarse.axes[0].max + factor / 2. >= 40)
+                profile = coarse.project('y').photons
+                self.assertAlmostEqual((numpy.array(list(coarse.axes[0])) * profile).sum() / profile.sum(), centre, delta=0.05)
+                self.assertAlmostEqual(coarse.contributions.sum(), space.contributions.sum())
+
+    def test_pyramid(self):
+        dense, sparse = self.get_spaces()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'pyramid.hdf5')
+            dense.tofile(filename, pyramid=2)
+            for index in (1, 2):
+                with h5py.File(filename, 'r') as fp:
+                    level = binoculars.space.Space.fromfile(fp['binoculars/pyramid/level_{0}'.format(index)])
+                for ax, full in zip(level.axes, dense.axes):
+                    self.assertAlmostEqual(ax.res, full.res * 2 ** index)
+                    self.assertTrue(ax.min - ax.res / 2 <= full.min and ax.max + ax.res / 2 >= full.max)
+                    profile, fullprofile = level.project(*(label for label in self.labels if label != ax.label)), dense.project(*(label for label in self.labels if label != ax.label))
+                    centroid = (numpy.array(list(profile.axes[0])) * profile.photons).sum() / profile.photons.sum()
+                    self.assertAlmostEqual(centroid, (numpy.array(list(fullprofile.axes[0])) * fullprofile.photons).sum() / fullprofile.photons.sum())
+                self.assertAlmostEqual(level.photons.sum(), dense.photons.sum())
+
+            npoints = len(dense.axes[0]) * len(dense.axes[1]) // 4
+            self.assertEqual(binoculars.space.pyramid_level(filename, npoints=npoints, labels=('h', 'k')), 'pyramid/level_1')
+            self.assertEqual(binoculars.space.Space.fromfile(filename, npoints=npoints, labels=('h', 'k')).axes[0].res, 0.2)
+            window = (slice(None), slice(None), slice(dense.axes[2].min, dense.axes[2].min + 5 * dense.axes[2].res))
+            self.assertEqual(binoculars.space.pyramid_level(filename, window, npoints, ('h', 'k')), None)
+            self.assertEqual(binoculars.space.pyramid_level(filename, window, npoints // 4, ('h', 'k')), 'pyramid/level_1')
+            single = (slice(None), slice(None), dense.axes[2].min)
+            self.assertEqual(binoculars.space.pyramid_level(filename, single, 1, ('h', 'k')), None)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_resample(self):
+        dense, sparse = self.get_spaces()
+        self.assertTrue(dense.rebin((1, 1, 1)) is dense)
+        self.assertSpaceEqual(dense.rebin((2, 1, 2)), binoculars.space.block_rebin(dense, (2, 1, 2)))
+        coarse = dense.resample((0.25, 0.1, 0.3))
+        self.assertTrue(numpy.allclose([ax.res for ax in coarse.axes], (0.25, 0.1, 0.3)))
+        self.assertAlmostEqual(coarse.photons.sum(), dense.photons.sum())
+        self.assertAlmostEqual(coarse.contributions.sum(), dense.contributions.sum())
+        self.assertSpaceEqual(coarse.project('h', 'l'), dense.project('h', 'l'))
+        first, second = binoculars.space.make_compatible([dense, coarse])
+        self.assertEqual(first.axes, second.axes)
+
+    def test_transform(self):
+        dense, sparse = self.get_spaces()
+        transformation = binoculars.util.transformation_from_expressions(dense, self.labels)
+        identity = dense.transform_coordinates(self.resolutions, self.labels, transformation, chunksize=100)
+        identity.trim()
+        dense.trim()
+        self.assertSpaceEqual(identity, dense)
+        transformation = binoculars.util.transformation_from_expressions(dense, ['sqrt(h**2 + k**2)', '3'])
+        radial = dense.transform_coordinates((0.1, 1), ('r', 'n'), transformation, chunksize=100)
+        self.assertEqual(len(radial.axes[radial.axes.index('n')]), 1)
+        self.assertAlmostEqual(radial.photons.sum(), dense.photons.sum())
+        self.assertRaises(ValueError, binoculars.util.transformation_from_expressions, dense, ['sqrt(h'])
+
+    def test_parallel_sum(self):
+        dense, sparse = self.get_spaces()
+        spaces = [binoculars.space.Space.from_image(self.resolutions, self.labels, *image) for image in self.images]
+        self.assertSpaceEqual(binoculars.space.sum(spaces + [sparse], nthreads=3), binoculars.space.sum(spaces + [sparse]))
+        self.assertSpaceEqual(binoculars.space.sum(spaces, nthreads=3), dense)
+        verses = [binoculars.space.Multiverse([space]) for space in spaces]
+        self.assertSpaceEqual(binoculars.space.chunked_sum(verses, chunksize=2, nthreads=2).spaces[0], dense)
+
+    def test_chunked_sum(self):
+        dense, sparse = self.get_spaces()
+        verses = [binoculars.space.Multiverse([binoculars.space.Space.from_image(self.resolutions, self.labels, *image)]) for image in self.images]
+
+        class Checkpoint(object):  # keeps the running sum after every chunk
+            def __init__(self):
+                self.verses = []
+
+            def due(self):
+                return True
+
+            def write(self, verse):
+                self.verses.append(verse)
+
+        unions = [binoculars.space.Axes(binoculars.space.union_axes(axes) for axes in zip(*(verse.spaces[0].axes for verse in verses[:stop]))) for stop in (2, 4, 5)]
+        checkpoint = Checkpoint()
+        self.assertSpaceEqual(binoculars.space.chunked_sum(verses, chunksize=2, checkpoint=checkpoint).spaces[0], dense)
+        self.assertEqual([verse.spaces[0].axes for verse in checkpoint.verses], unions)  # grown to the union of the chunks, nothing more
+
+    def test_multiverse_file(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'verse.hdf5')
+            spaces = [binoculars.space.Space.from_image(self.resolutions, self.labels, *self.images[index % 5]) * (index + 1) for index in range(12)]
+            binoculars.space.Multiverse(spaces).tofile(filename)
+            verse = binoculars.space.Multiverse.fromfile(filename)
+            for space, original in zip(verse.spaces, spaces):  # in order of the limits, space_10 after space_9
+                self.assertSpaceEqual(space, original)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_tree_sum(self):
+        dense, sparse = self.get_spaces()
+        verses = [binoculars.space.Multiverse([binoculars.space.Space.from_image(self.resolutions, self.labels, *image)]) for image in self.images]
+        self.assertSpaceEqual(binoculars.space.tree_sum(verses, 2).spaces[0], dense)
+        merges = []
+        tree = binoculars.util.ReductionTree(3, lambda group: merges.append(group) or sum(group))
+        for index in range(10):
+            tree.add(1)
+        self.assertEqual(len(merges), 4)
+        self.assertEqual(sorted(tree.remaining()), [1, 9])
+
+    def test_add_to_file(self):
+        dense, sparse = self.get_spaces()
+        spaces = [binoculars.space.Space.from_image(self.resolutions, self.labels, *image) for image in self.images]
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'append.hdf5')
+            binoculars.space.add_to_file(dense, filename)
+            binoculars.space.add_to_file(spaces[2], filename)  # in place
+            binoculars.space.add_to_file(sparse, filename)  # in place
+            self.assertFileEqual(filename, dense * 1 + spaces[2] + sparse)
+
+            filename = os.path.join(tmpdir, 'grow.hdf5')
+            binoculars.space.add_to_file(spaces[0], filename)
+            for space in spaces[1:]:
+                binoculars.space.add_to_file(space.tosparse(), filename)  # reallocated
+            self.assertFileEqual(filename, dense)
+
+            filename = os.path.join(tmpdir, 'metadata.hdf5')
+            dense.metadata.add_dataset(binoculars.util.MetaBase('job', {'scan': 1}))
+            binoculars.space.add_to_file(dense, filename)
+            spaces[1].metadata.add_dataset(binoculars.util.MetaBase('job', {'scan': 2}))
+            binoculars.space.add_to_file(spaces[1], filename)  # in place, the metadata is appended
+            self.assertEqual([meta.job['scan'] for meta in binoculars.util.MetaData.fromfile(filename).metas], [1, 2])
+
+            checked_add = binoculars.space.checked_add
+            calls = []
+
+            def interrupted(*args):  # after the first slab is written
+                calls.append(args)
+                if len(calls) > 2:
+                    raise KeyboardInterrupt
+                checked_add(*args)
+            binoculars.space.checked_add = interrupted
+            try:
+                self.assertRaises(KeyboardInterrupt, binoculars.space.add_to_file, spaces[2], filename, slabsize=1)
+            finally:
+                binoculars.space.checked_add = checked_add
+            self.assertFileEqual(filename, dense + spaces[1])  # left as it was
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['append.hdf5', 'grow.hdf5', 'metadata.hdf5'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import binoculars.util
+import numpy
+import threading
+
+import unittest
+
+
+class TestCase(unittest.TestCase):
+    def test_prefetcher(self):
+        images = [numpy.ones((10, 10)) * index for index in range(20)]
+        prefetched = list(binoculars.util.Prefetcher(iter(images), 4, maxbytes=2000))
+        self.assertEqual(len(prefetched), 20)
+        self.assertTrue(all((a == b).all() for a, b in zip(images, prefetched)))
+
+    def test_prefetcher_error(self):
+        def failing():
+            yield 1
+            yield 2
+            raise KeyError('no more images')
+        items = []
+        with self.assertRaises(KeyError):
+            for item in binoculars.util.Prefetcher(failing(), 2):
+                items.append(item)
+        self.assertEqual(items, [1, 2])
+
+    def test_prefetcher_stop(self):
+        produced = []
+        def counting():
+            for index in range(1000):
+                produced.append(index)
+                yield index
+        for item in binoculars.util.Prefetcher(counting(), 3):
+            if item == 5:
+                break
+        self.assertTrue(len(produced) <= 10)
+        self.assertEqual(threading.active_count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()